@@ -1,21 +1,53 @@
-from flask import Flask, request, jsonify, send_file, send_from_directory, make_response
+from flask import Flask, request, jsonify, send_file, send_from_directory, Response, stream_with_context, g, has_request_context
+from flask.json.provider import DefaultJSONProvider
 from flask_cors import CORS
-from flask_jwt_extended import JWTManager, create_access_token, jwt_required, get_jwt_identity
-from datetime import datetime, timedelta
+from flask_jwt_extended import JWTManager, create_access_token, jwt_required, get_jwt_identity, decode_token, verify_jwt_in_request
+from datetime import datetime, timedelta, date
 import json
 import os
-from supabase import create_client, Client
+from supabase import create_client
+from postgrest.exceptions import APIError
+from postgrest.types import ReturnMethod
 from werkzeug.utils import secure_filename
+from werkzeug.http import parse_date, http_date
+from werkzeug.security import safe_join
 import uuid
 import logging
 import traceback
+import threading
+import time
+import hashlib
+import tempfile
+import queue
+import itertools
+from collections import OrderedDict
+from contextlib import contextmanager
+import io
+import csv
+import base64
+import sqlite3
+import gzip
+import mimetypes
+import bisect
+import heapq
+import math
+import re
+import zlib
 import requests
+import httpx
+from PIL import Image, ImageOps
+try:
+    import gevent
+    from gevent import monkey
+except ImportError:
+    gevent = None
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-app = Flask(__name__)
+# /static is served by serve_static below so it gets the caching headers
+app = Flask(__name__, static_folder=None)
 
 # ==================== CONFIGURATION ====================
 app.config['SECRET_KEY'] = os.environ.get('SECRET_KEY', 'karanja-shoe-store-secret-key-2026')
@@ -46,45 +78,878 @@ SUPABASE_KEY = "eyJhbGciOiJIUzI1NiIsInR5cCI6IkpXVCJ9.eyJpc3MiOiJzdXBhYmFzZSIsInJ
 # Buckets/Storage configuration
 STORAGE_BUCKET = "product-images"
 
-# Initialize Supabase client
-try:
-    supabase: Client = create_client(SUPABASE_URL, SUPABASE_KEY)
-    logger.info("✓ Supabase client initialized successfully")
-    
-    # Test connection
+# Keep-alive pools shared by every request in a worker (Supabase REST, storage and image downloads).
+# Size the pool to the worker's concurrency: gevent workers run hundreds of requests at once.
+UPSTREAM_POOL_SIZE = int(os.environ.get('UPSTREAM_POOL_SIZE', 100))
+UPSTREAM_KEEPALIVE_SECONDS = float(os.environ.get('UPSTREAM_KEEPALIVE_SECONDS', 30))
+UPSTREAM_CONNECT_TIMEOUT = float(os.environ.get('UPSTREAM_CONNECT_TIMEOUT', 5))
+UPSTREAM_TIMEOUT = float(os.environ.get('UPSTREAM_TIMEOUT', 30))
+
+def run_blocking(fn, *args):
+    """Run disk- or CPU-bound work (SQLite commits, Pillow) without stalling a gevent worker
+
+    In a monkey-patched gevent worker every request and background thread
+    shares one OS thread, so an fsync or an image resize would hold them all
+    up; the hub's native thread pool runs fn instead. Anywhere else fn runs
+    in the caller. fn should not log or take locks, as it may run outside
+    the hub's thread.
+    """
+    if gevent is not None and monkey.is_module_patched('threading'):
+        return gevent.get_hub().threadpool.apply(fn, args)
+    return fn(*args)
+
+# ==================== METRICS ====================
+
+# Latency histogram buckets in seconds (the Prometheus client defaults)
+METRICS_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+# Per-request Server-Timing header splitting time into upstream calls and JSON encoding
+SERVER_TIMING = os.environ.get('SERVER_TIMING', '1') != '0'
+# /metrics requires "Authorization: Bearer <token>"; without a token it is
+# only served by the debug server (python app.py), never under gunicorn
+METRICS_TOKEN = os.environ.get('METRICS_TOKEN')
+
+METRICS_HELP = {
+    'http_request_duration_seconds': ('histogram', 'Time to produce a response, by route'),
+    'http_response_bytes_total': ('counter', 'Response body bytes, by route'),
+    'upstream_call_duration_seconds': ('histogram', 'Duration of calls to Supabase, storage and image hosts'),
+    'upstream_errors_total': ('counter', 'Upstream calls that raised'),
+    'upstream_rows_total': ('counter', 'Rows returned by Supabase queries'),
+    'upstream_bytes_total': ('counter', 'Payload bytes received from or sent to upstreams'),
+    'single_flight_coalesced_total': ('counter', "Reads that shared another request's in-flight upstream call")
+}
+
+_upstream_local = threading.local()
+
+class Metrics:
+    """In-process counters and histograms, rendered in the Prometheus text format
+
+    Every worker process keeps its own numbers.
+    """
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self._lock = threading.Lock()
+        self._histograms = {}
+        self._counters = {}
+
+    def observe(self, name, labels, value):
+        with self._lock:
+            histogram = self._histograms.get((name, labels))
+            if histogram is None:
+                histogram = self._histograms[(name, labels)] = {'buckets': [0] * len(self.buckets), 'sum': 0.0, 'count': 0}
+            for index, bound in enumerate(self.buckets):
+                if value <= bound:
+                    histogram['buckets'][index] += 1
+            histogram['sum'] += value
+            histogram['count'] += 1
+
+    def inc(self, name, labels, amount=1):
+        with self._lock:
+            self._counters[(name, labels)] = self._counters.get((name, labels), 0) + amount
+
+    def render(self, extra=()):
+        """Text exposition of every series plus (name, type, help, value) point-in-time samples"""
+        def label_text(labels, extra=()):
+            pairs = list(labels) + list(extra)
+            if not pairs:
+                return ''
+            escaped = (str(value).replace('\\', '\\\\').replace('"', '\\"') for _, value in pairs)
+            return '{' + ','.join(f'{key}="{value}"' for (key, _), value in zip(pairs, escaped)) + '}'
+        
+        with self._lock:
+            histograms = {key: {**value, 'buckets': list(value['buckets'])} for key, value in self._histograms.items()}
+            counters = dict(self._counters)
+        lines = []
+        for name, (kind, help_text) in METRICS_HELP.items():
+            lines += [f'# HELP {name} {help_text}', f'# TYPE {name} {kind}']
+            for (series, labels), histogram in sorted(histograms.items()):
+                if series != name:
+                    continue
+                for bound, count in zip(self.buckets, histogram['buckets']):
+                    lines.append(f'{name}_bucket{label_text(labels, [("le", bound)])} {count}')
+                lines.append(f'{name}_bucket{label_text(labels, [("le", "+Inf")])} {histogram["count"]}')
+                lines.append(f'{name}_sum{label_text(labels)} {histogram["sum"]:.6f}')
+                lines.append(f'{name}_count{label_text(labels)} {histogram["count"]}')
+            for (series, labels), value in sorted(counters.items()):
+                if series == name:
+                    lines.append(f'{name}{label_text(labels)} {value}')
+        for name, kind, help_text, value in extra:
+            lines += [f'# HELP {name} {help_text}', f'# TYPE {name} {kind}', f'{name} {value}']
+        return '\n'.join(lines) + '\n'
+
+metrics = Metrics(METRICS_BUCKETS)
+
+def add_timing(name, seconds):
+    """Add to this request's Server-Timing entry for name (no-op outside a request)"""
+    if has_request_context() and 'timings' in g:
+        total, calls = g.timings.get(name, (0.0, 0))
+        g.timings[name] = (total + seconds, calls + 1)
+
+@contextmanager
+def upstream_call(service, operation, target):
+    """Time one upstream call; set 'rows' and 'bytes' on the yielded dict when known"""
+    labels = (('service', service), ('operation', operation), ('target', target))
+    call = {'rows': None, 'bytes': None}
+    started = time.perf_counter()
     try:
-        # Test database access
-        test_query = supabase.table('products').select('*').limit(1).execute()
-        logger.info("✓ Database connection successful")
-        SUPABASE_AVAILABLE = True
-    except Exception as e:
-        logger.error(f"✗ Database connection failed: {e}")
-        SUPABASE_AVAILABLE = False
+        yield call
+    except Exception:
+        metrics.inc('upstream_errors_total', labels)
+        raise
+    finally:
+        elapsed = time.perf_counter() - started
+        metrics.observe('upstream_call_duration_seconds', labels, elapsed)
+        if call['rows'] is not None:
+            metrics.inc('upstream_rows_total', labels, call['rows'])
+        if call['bytes']:
+            metrics.inc('upstream_bytes_total', labels, call['bytes'])
+        add_timing(service, elapsed)
+
+def count_response_bytes(response):
+    """httpx response hook: read the body so its size is known to upstream_call"""
+    response.read()
+    _upstream_local.bytes = len(response.content)
+
+@app.before_request
+def start_request_timer():
+    g.request_started = time.perf_counter()
+    g.timings = {}
+
+@app.after_request
+def record_request_metrics(response):
+    started = g.get('request_started')
+    if started is None:
+        return response
+    elapsed = time.perf_counter() - started
+    route = request.url_rule.rule if request.url_rule else 'unmatched'
+    metrics.observe('http_request_duration_seconds',
+                    (('method', request.method), ('route', route), ('status', str(response.status_code))), elapsed)
+    if response.content_length:
+        metrics.inc('http_response_bytes_total', (('route', route),), response.content_length)
+    if SERVER_TIMING:
+        entries = [f'{name};dur={total * 1000:.1f};desc="{calls} call(s)"' for name, (total, calls) in g.timings.items()]
+        entries.append(f'total;dur={elapsed * 1000:.1f}')
+        response.headers.add('Server-Timing', ', '.join(entries))
+    return response
+
+# ==================== SUPABASE CLIENT ====================
+
+# The client is created on first use and nothing touches the network at
+# import, so workers boot in milliseconds. Failed calls open a circuit
+# breaker: while it is open, queries fail fast instead of waiting on
+# timeouts. After SUPABASE_BREAKER_COOLDOWN one call is let through again.
+# A background prober closes the circuit as soon as Supabase answers.
+SUPABASE_BREAKER_THRESHOLD = int(os.environ.get('SUPABASE_BREAKER_THRESHOLD', 3))
+SUPABASE_BREAKER_COOLDOWN = float(os.environ.get('SUPABASE_BREAKER_COOLDOWN', 15))
+SUPABASE_PROBE_SECONDS = float(os.environ.get('SUPABASE_PROBE_SECONDS', 10))
+
+class SupabaseUnavailable(Exception):
+    """Raised instead of calling Supabase while the circuit is open"""
+
+class SupabaseHealth:
+    """Circuit breaker over Supabase queries, fed by real calls and a background prober"""
+
+    def __init__(self, threshold, cooldown, probe_seconds):
+        self.threshold = threshold
+        self.cooldown = cooldown
+        self.probe_seconds = probe_seconds
+        self._lock = threading.Lock()
+        self._prober = None
+        self._prober_pid = None
+        self.state = 'closed'
+        self.failures = 0
+        self.opened_at = None
+        # monotonic start of the one call let through while half-open
+        self.trial_started = None
+        self.last_error = None
+        self.last_success_at = None
+        self.last_probe_at = None
+        self.counters = {'successes': 0, 'failures': 0, 'rejected': 0, 'opened': 0, 'probes': 0}
+
+    def allow(self):
+        """Whether a call may go out; after the cooldown an open circuit lets exactly one through"""
+        with self._lock:
+            now = time.monotonic()
+            if self.state == 'open':
+                if now - self.opened_at < self.cooldown:
+                    self.counters['rejected'] += 1
+                    return False
+                self.state = 'half-open'
+                self.trial_started = now
+                return True
+            if self.state == 'half-open':
+                # Others wait for the trial's outcome; a trial that never reports
+                # back (its greenlet was killed) is replaced after a cooldown
+                if now - self.trial_started < self.cooldown:
+                    self.counters['rejected'] += 1
+                    return False
+                self.trial_started = now
+            return True
+
+    def record_success(self):
+        with self._lock:
+            if self.state != 'closed':
+                logger.info(f"✓ Supabase reachable again, closing circuit (was {self.state})")
+            self.state = 'closed'
+            self.failures = 0
+            self.trial_started = None
+            self.last_success_at = datetime.now().isoformat()
+            self.counters['successes'] += 1
+
+    def record_failure(self, error):
+        with self._lock:
+            self.failures += 1
+            self.last_error = str(error)
+            self.counters['failures'] += 1
+            if self.state == 'half-open' or (self.state == 'closed' and self.failures >= self.threshold):
+                logger.error(f"✗ Supabase unreachable, opening circuit for {self.cooldown:.0f}s: {error}")
+                self.state = 'open'
+                self.opened_at = time.monotonic()
+                self.trial_started = None
+                self.counters['opened'] += 1
+
+    def available(self):
+        return self.state != 'open'
+
+    def probe(self):
+        """One direct query to Supabase; any answer, even an error response, counts as reachable"""
+        self.counters['probes'] += 1
+        self.last_probe_at = datetime.now().isoformat()
+        try:
+            supabase.client().table('products').select('id').limit(1).execute()
+        except APIError:
+            self.record_success()
+        except Exception as e:
+            self.record_failure(e)
+        else:
+            self.record_success()
+
+    def _run(self):
+        while True:
+            self.probe()
+            time.sleep(self.probe_seconds)
+
+    def start_prober(self):
+        """Start this process's prober thread (again after a fork)"""
+        with self._lock:
+            if self._prober is not None and self._prober.is_alive() and self._prober_pid == os.getpid():
+                return
+            self._prober = threading.Thread(target=self._run, name='supabase-prober', daemon=True)
+            self._prober_pid = os.getpid()
+            self._prober.start()
+
+    def stats(self):
+        with self._lock:
+            return {
+                'state': self.state,
+                'consecutiveFailures': self.failures,
+                'lastError': self.last_error,
+                'lastSuccessAt': self.last_success_at,
+                'lastProbeAt': self.last_probe_at,
+                'counters': dict(self.counters)
+            }
+
+supabase_health = SupabaseHealth(SUPABASE_BREAKER_THRESHOLD, SUPABASE_BREAKER_COOLDOWN, SUPABASE_PROBE_SECONDS)
+
+class GuardedQuery:
+    """Wraps a postgrest builder so that execute() goes through the circuit breaker"""
+
+    def __init__(self, builder):
+        self._builder = builder
+
+    def __getattr__(self, name):
+        attr = getattr(self._builder, name)
+        if name == 'execute':
+            return self._execute
+        if not callable(attr):
+            return attr
         
-except Exception as e:
-    logger.error(f"✗ Failed to initialize Supabase client: {e}")
-    SUPABASE_AVAILABLE = False
-    supabase = None
+        def call(*args, **kwargs):
+            result = attr(*args, **kwargs)
+            return GuardedQuery(result) if hasattr(result, 'execute') else result
+        return call
+
+    def _execute(self):
+        supabase_health.start_prober()
+        if not supabase_health.allow():
+            raise SupabaseUnavailable('Supabase is unreachable (circuit open)')
+        session = getattr(self._builder, 'session', None)
+        if session is not None and count_response_bytes not in session.event_hooks['response']:
+            session.event_hooks['response'].append(count_response_bytes)
+        operation = getattr(self._builder, 'http_method', 'CALL')
+        target = str(getattr(self._builder, 'path', '')).lstrip('/')
+        _upstream_local.bytes = None
+        with upstream_call('supabase', operation, target) as call:
+            try:
+                response = self._builder.execute()
+            except APIError:
+                # Supabase answered; the request itself was refused
+                supabase_health.record_success()
+                raise
+            except Exception as e:
+                supabase_health.record_failure(e)
+                raise
+            call['rows'] = len(response.data) if isinstance(response.data, list) else None
+            call['bytes'] = _upstream_local.bytes
+        supabase_health.record_success()
+        return response
+
+def pooled_session(session):
+    """Replacement for an SDK httpx client that uses the shared pool limits and timeouts"""
+    pooled = type(session)(
+        base_url=session.base_url,
+        headers=session.headers,
+        timeout=httpx.Timeout(UPSTREAM_TIMEOUT, connect=UPSTREAM_CONNECT_TIMEOUT),
+        limits=httpx.Limits(max_connections=UPSTREAM_POOL_SIZE, max_keepalive_connections=UPSTREAM_POOL_SIZE,
+                            keepalive_expiry=UPSTREAM_KEEPALIVE_SECONDS)
+    )
+    session.close()
+    return pooled
+
+class LazySupabase:
+    """Stand-in for the Supabase client that creates it on first use (once per worker process)"""
+
+    def __init__(self):
+        self._client = None
+        self._pid = None
+        self._lock = threading.Lock()
+
+    def client(self):
+        if self._client is None or self._pid != os.getpid():
+            with self._lock:
+                if self._client is None or self._pid != os.getpid():
+                    self._client = self._pool(create_client(SUPABASE_URL, SUPABASE_KEY))
+                    self._pid = os.getpid()
+                    logger.info("✓ Supabase client initialized successfully")
+        return self._client
+
+    @staticmethod
+    def _pool(client):
+        """Swap the SDK's default httpx clients (120s timeout, 20 idle connections) for pooled ones"""
+        postgrest = getattr(client, 'postgrest', None)
+        if postgrest is not None:
+            postgrest.session = pooled_session(postgrest.session)
+        storage = getattr(client, 'storage', None)
+        if isinstance(getattr(storage, 'session', None), httpx.Client):
+            # storage3 keeps the same client in both attributes
+            storage.session = storage._client = pooled_session(storage.session)
+        return client
+
+    def __bool__(self):
+        try:
+            self.client()
+            return True
+        except Exception as e:
+            logger.error(f"✗ Failed to initialize Supabase client: {e}")
+            return False
+
+    def __getattr__(self, name):
+        attr = getattr(self.client(), name)
+        if name in ('table', 'from_', 'rpc'):
+            return lambda *args, **kwargs: GuardedQuery(attr(*args, **kwargs))
+        return attr
+
+supabase = LazySupabase()
+supabase_health.start_prober()
 
 # ==================== EXTENSIONS ====================
 CORS(app)
 jwt = JWTManager(app)
 
+# ==================== JSON SERIALIZATION ====================
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+# Datetimes are passed through to the Flask default (HTTP dates) so output
+# matches the stdlib provider byte for byte on the values this API returns
+ORJSON_OPTIONS = orjson and (orjson.OPT_NON_STR_KEYS | orjson.OPT_PASSTHROUGH_DATETIME)
+
+def json_bytes(value):
+    """Serialize value to compact JSON bytes with the fastest available encoder"""
+    started = time.perf_counter()
+    if orjson is not None:
+        body = orjson.dumps(value, default=DefaultJSONProvider.default, option=ORJSON_OPTIONS)
+    else:
+        body = json.dumps(value, default=DefaultJSONProvider.default, separators=(',', ':')).encode('utf-8')
+    add_timing('json', time.perf_counter() - started)
+    return body
+
+def json_body(body, status=200):
+    """Response for already-serialized JSON bytes"""
+    return app.response_class(body, status=status, mimetype='application/json')
+
+class FastJSONProvider(DefaultJSONProvider):
+    """jsonify/get_json backed by orjson when installed, the stdlib otherwise"""
+
+    def dumps(self, obj, **kwargs):
+        if orjson is None or kwargs:
+            return super().dumps(obj, **kwargs)
+        return json_bytes(obj).decode('utf-8')
+
+    def loads(self, s, **kwargs):
+        if orjson is None or kwargs:
+            return super().loads(s, **kwargs)
+        return orjson.loads(s)
+
+    def response(self, *args, **kwargs):
+        return json_body(json_bytes(self._prepare_response_obj(args, kwargs)))
+
+app.json = FastJSONProvider(app)
+
+# ==================== TABLE CACHE ====================
+
+# Seconds a cached table stays fresh; 0 disables caching. Writes made through
+# this worker are patched in place, writes made by other workers show up once
+# the entry expires.
+TABLE_CACHE_TTL = float(os.environ.get('TABLE_CACHE_TTL', 30))
+TABLE_CACHE_MAX_TABLES = int(os.environ.get('TABLE_CACHE_MAX_TABLES', 8))
+TABLE_CACHE_MAX_ROWS = int(os.environ.get('TABLE_CACHE_MAX_ROWS', 50000))
+
+def _copy_row(row):
+    """Copy a row deep enough that callers can mutate it (sizes is a dict)"""
+    return {k: (v.copy() if isinstance(v, (dict, list)) else v) for k, v in row.items()}
+
+class TableCache:
+    """In-process read-through cache of whole Supabase tables, keyed by row id"""
+
+    def __init__(self, ttl, max_tables, max_rows):
+        self.ttl = ttl
+        self.max_tables = max_tables
+        self.max_rows = max_rows
+        self._entries = OrderedDict()
+        self._generations = {}
+        self._lock = threading.RLock()
+        self.counters = {
+            'hits': 0,
+            'misses': 0,
+            'patches': 0,
+            'invalidations': 0,
+            'evictions': 0,
+            'oversize': 0,
+            'lookup_hits': 0,
+            'lookup_misses': 0
+        }
+
+    def _fresh_entry(self, table_name, allow_stale=False):
+        entry = self._entries.get(table_name)
+        if entry is None:
+            return None
+        # Expired entries are kept (LRU-bounded) to answer reads while Supabase is down
+        if time.monotonic() - entry['loaded_at'] > self.ttl and not allow_stale:
+            return None
+        self._entries.move_to_end(table_name)
+        return entry
+
+    def get(self, table_name, allow_stale=False):
+        """Return copies of the cached rows, or None on a miss"""
+        with self._lock:
+            entry = self._fresh_entry(table_name, allow_stale) if self.ttl > 0 else None
+            if entry is None:
+                self.counters['misses'] += 1
+                return None
+            self.counters['hits'] += 1
+            return [_copy_row(row) for row in entry['rows'].values()]
+
+    def lookup(self, table_name, column, value, allow_stale=False):
+        """Return a copy of the cached row whose column equals value, or None"""
+        with self._lock:
+            entry = self._fresh_entry(table_name, allow_stale) if self.ttl > 0 else None
+            row = None
+            if entry is not None:
+                if column == 'id':
+                    row = entry['rows'].get(value)
+                else:
+                    index = entry['indexes'].get(column)
+                    if index is None:
+                        index = {r.get(column): r['id'] for r in entry['rows'].values()}
+                        entry['indexes'][column] = index
+                    row = entry['rows'].get(index.get(value))
+            if row is None:
+                self.counters['lookup_misses'] += 1
+                return None
+            self.counters['lookup_hits'] += 1
+            return _copy_row(row)
+
+    def _unindex(self, entry, row):
+        for column, index in entry['indexes'].items():
+            if index.get(row.get(column)) == row['id']:
+                del index[row.get(column)]
+
+    def _index(self, entry, row):
+        for column, index in entry['indexes'].items():
+            index[row.get(column)] = row['id']
+
+    def generation(self, table_name):
+        """Write generation of a table, taken before a fetch and checked by put()"""
+        with self._lock:
+            return self._generations.get(table_name, 0)
+
+    def version(self, table_name):
+        """Identity of the cached contents of a table, or None when it is not cached
+
+        Changes on every patch, removal and reload, so anything derived from
+        the rows can be reused for as long as the version stays the same.
+        """
+        with self._lock:
+            entry = self._fresh_entry(table_name) if self.ttl > 0 else None
+            if entry is None:
+                return None
+            return (self._generations.get(table_name, 0), entry['loaded_at'])
+
+    def put(self, table_name, rows, generation):
+        """Store a freshly fetched table unless a write raced the fetch"""
+        if self.ttl <= 0:
+            return
+        with self._lock:
+            if generation != self._generations.get(table_name, 0):
+                return
+            if len(rows) > self.max_rows or any('id' not in row for row in rows):
+                self.counters['oversize'] += 1
+                return
+            self._entries[table_name] = {
+                'rows': OrderedDict((row['id'], _copy_row(row)) for row in rows),
+                'indexes': {},
+                'loaded_at': time.monotonic()
+            }
+            self._entries.move_to_end(table_name)
+            while len(self._entries) > self.max_tables:
+                self._entries.popitem(last=False)
+                self.counters['evictions'] += 1
+
+    def patch(self, table_name, rows):
+        """Apply upserted rows to a cached table in place"""
+        with self._lock:
+            self._generations[table_name] = self._generations.get(table_name, 0) + 1
+            entry = self._entries.get(table_name)
+            if entry is None:
+                return
+            if any('id' not in row for row in rows):
+                self.invalidate(table_name)
+                return
+            for row in rows:
+                current = entry['rows'].get(row['id'])
+                if current is None:
+                    current = entry['rows'][row['id']] = _copy_row(row)
+                else:
+                    self._unindex(entry, current)
+                    current.update(_copy_row(row))
+                self._index(entry, current)
+            self.counters['patches'] += 1
+
+    def remove(self, table_name, record_id):
+        """Drop a deleted row from a cached table"""
+        with self._lock:
+            self._generations[table_name] = self._generations.get(table_name, 0) + 1
+            entry = self._entries.get(table_name)
+            if entry is not None:
+                row = entry['rows'].pop(record_id, None)
+                if row is not None:
+                    self._unindex(entry, row)
+                self.counters['patches'] += 1
+
+    def touch(self, table_name):
+        """Mark a table changed without changing its rows (a sale was queued on top of it)"""
+        with self._lock:
+            self._generations[table_name] = self._generations.get(table_name, 0) + 1
+
+    def invalidate(self, table_name=None):
+        """Forget one table, or every table when no name is given"""
+        with self._lock:
+            names = [table_name] if table_name else list(self._entries)
+            for name in names:
+                self._generations[name] = self._generations.get(name, 0) + 1
+                if self._entries.pop(name, None) is not None:
+                    self.counters['invalidations'] += 1
+
+    def stats(self):
+        with self._lock:
+            return {
+                **self.counters,
+                'ttl': self.ttl,
+                'tables': {name: len(entry['rows']) for name, entry in self._entries.items()}
+            }
+
+table_cache = TableCache(TABLE_CACHE_TTL, TABLE_CACHE_MAX_TABLES, TABLE_CACHE_MAX_ROWS)
+
+# ==================== SINGLE-FLIGHT ====================
+
+# How long a caller waits for someone else's identical upstream read before giving up
+SINGLE_FLIGHT_TIMEOUT = float(os.environ.get('SINGLE_FLIGHT_TIMEOUT', UPSTREAM_TIMEOUT + 5))
+
+class SingleFlightTimeout(TimeoutError):
+    """The in-flight call this caller joined did not finish in time"""
+
+class SingleFlight:
+    """Runs one call per key at a time; concurrent callers for the key share its result or exception
+
+    Keys are tuples whose first item names the kind of read (table, record,
+    listing, report) for the counters. Callers that must not see each other's
+    mutations pass share=, which copies the result for every caller, the one
+    that ran the call included, so the shared object is never handed out.
+    """
+
+    def __init__(self, timeout):
+        self.timeout = timeout
+        self._calls = {}
+        self._lock = threading.Lock()
+        self.counters = {'leaders': 0, 'coalesced': 0, 'errors': 0, 'timeouts': 0}
+
+    def do(self, key, fn, share=None):
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = {'done': threading.Event(), 'result': None, 'error': None}
+                self.counters['leaders'] += 1
+            else:
+                self.counters['coalesced'] += 1
+        if not leader:
+            metrics.inc('single_flight_coalesced_total', (('kind', key[0]),))
+            if not call['done'].wait(self.timeout):
+                with self._lock:
+                    self.counters['timeouts'] += 1
+                raise SingleFlightTimeout(f"Timed out after {self.timeout}s waiting for {key[0]} read")
+            if call['error'] is not None:
+                raise call['error']
+            return share(call['result']) if share else call['result']
+        try:
+            call['result'] = fn()
+            # Waiters may still be copying the result after this returns
+            return share(call['result']) if share else call['result']
+        except Exception as e:
+            call['error'] = e
+            with self._lock:
+                self.counters['errors'] += 1
+            raise
+        finally:
+            with self._lock:
+                self._calls.pop(key, None)
+            call['done'].set()
+
+    def stats(self):
+        with self._lock:
+            return {**self.counters, 'inflight': len(self._calls)}
+
+single_flight = SingleFlight(SINGLE_FLIGHT_TIMEOUT)
+
+# ==================== RECORD IDS ====================
+
+# Snowflake-style ids: 41 bits of milliseconds since ID_EPOCH_MS, 5 bits of
+# worker id and 7 bits of per-millisecond sequence. 53 bits in total, so the
+# ids stay exact as JavaScript numbers. They sort by creation time and are
+# all larger than the older millisecond-timestamp ids.
+ID_EPOCH_MS = 1704067200000  # 2024-01-01T00:00:00Z
+ID_WORKER_BITS = 5
+ID_SEQUENCE_BITS = 7
+ID_SEQUENCE_MASK = (1 << ID_SEQUENCE_BITS) - 1
+ID_MAX_WORKERS = 1 << ID_WORKER_BITS
+
+_worker_id_lock_file = None
+
+def claim_worker_id():
+    """Pick a worker id no other live process on this host holds
+
+    ID_WORKER_ID pins it explicitly (needed when several hosts write to
+    the same tables); otherwise the first free lock file is claimed with
+    flock, which the OS releases when the process exits.
+    """
+    global _worker_id_lock_file
+    if os.environ.get('ID_WORKER_ID'):
+        return int(os.environ['ID_WORKER_ID']) % ID_MAX_WORKERS
+    try:
+        import fcntl
+        lock_dir = os.path.join(tempfile.gettempdir(), 'karanja-id-workers')
+        os.makedirs(lock_dir, exist_ok=True)
+        for candidate in range(ID_MAX_WORKERS):
+            handle = open(os.path.join(lock_dir, f'{candidate}.lock'), 'w')
+            try:
+                fcntl.flock(handle, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except OSError:
+                handle.close()
+                continue
+            _worker_id_lock_file = handle
+            return candidate
+        logger.warning("All id worker slots are taken; falling back to pid-derived worker id")
+    except ImportError:
+        pass
+    return os.getpid() % ID_MAX_WORKERS
+
+class IdGenerator:
+    """Time-ordered, collision-free record ids (time + worker id + sequence)"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._pid = None
+        self.worker_id = None
+        self._last_ms = 0
+        self._sequence = 0
+
+    def next_id(self):
+        with self._lock:
+            if self._pid != os.getpid():
+                # First use, or we are a freshly forked worker: claim our own worker id
+                self._pid = os.getpid()
+                self.worker_id = claim_worker_id()
+                self._last_ms = 0
+            now_ms = int(time.time() * 1000) - ID_EPOCH_MS
+            if now_ms <= self._last_ms:
+                # Same millisecond (or the clock stepped back): keep counting from the last one
+                now_ms = self._last_ms
+                self._sequence = (self._sequence + 1) & ID_SEQUENCE_MASK
+                if self._sequence == 0:
+                    # Sequence exhausted for this millisecond; borrow the next one
+                    now_ms += 1
+            else:
+                self._sequence = 0
+            self._last_ms = now_ms
+            return (now_ms << (ID_WORKER_BITS + ID_SEQUENCE_BITS)) | (self.worker_id << ID_SEQUENCE_BITS) | self._sequence
+
+id_generator = IdGenerator()
+
+def next_record_id():
+    """New id for a product, sale, notification or other record"""
+    return id_generator.next_id()
+
 # ==================== HELPER FUNCTIONS ====================
 
+def fetch_table(table_name, generation):
+    """Read a whole table from Supabase and cache it unless a write raced the read"""
+    response = supabase.table(table_name).select("*").execute()
+    logger.info(f"Retrieved {len(response.data)} records from {table_name}")
+    table_cache.put(table_name, response.data, generation)
+    return response.data
+
 def get_table_data(table_name):
-    """Get all data from a Supabase table"""
+    """Get all data from a Supabase table, as stored upstream
+
+    Sales still in the write-behind queue are not applied; endpoints that
+    return the rows add them with write_queue.overlay().
+    """
+    cached = table_cache.get(table_name)
+    if cached is not None:
+        return cached
     if not supabase:
         logger.error(f"Supabase not available for {table_name}")
         return []
     try:
-        response = supabase.table(table_name).select("*").execute()
-        logger.info(f"Retrieved {len(response.data)} records from {table_name}")
-        return response.data
+        generation = table_cache.generation(table_name)
+        # Concurrent misses share one fetch; keyed by generation so a caller never gets rows read before its own write
+        return single_flight.do(('table', table_name, generation), lambda: fetch_table(table_name, generation),
+                                share=lambda rows: [_copy_row(row) for row in rows])
     except Exception as e:
         logger.error(f"Error reading from {table_name}: {e}")
+        stale = table_cache.get(table_name, allow_stale=True)
+        if stale is not None:
+            logger.warning(f"Serving stale {table_name} while Supabase is unreachable")
+            return stale
+        return []
+
+def get_record(table_name, value, column='id', coalesce=True):
+    """Get a single record by id (or another unique column such as sku)
+
+    Like get_table_data, the row is as stored upstream, so it can serve as the
+    base of a write. coalesce=False reads on its own instead of sharing a
+    concurrent identical read; callers holding write_queue.lock must use it,
+    as the shared read may be waiting for that lock.
+    """
+    cached = table_cache.lookup(table_name, column, value)
+    if cached is not None:
+        return cached
+    if not supabase:
+        logger.error(f"Supabase not available for {table_name}")
+        return None
+    def fetch():
+        response = supabase.table(table_name).select("*").eq(column, value).limit(1).execute()
+        return response.data[0] if response.data else None
+    
+    try:
+        if not coalesce:
+            return fetch()
+        return single_flight.do(('record', table_name, column, value, table_cache.generation(table_name)), fetch,
+                                share=lambda row: _copy_row(row) if row else None)
+    except Exception as e:
+        logger.error(f"Error reading {column}={value} from {table_name}: {e}")
+        stale = table_cache.lookup(table_name, column, value, allow_stale=True)
+        if stale is not None:
+            return stale
+        return None
+
+def get_records(table_name, record_ids):
+    """Get several records by id: cached rows first, the rest in one in_() query"""
+    found = {}
+    for record_id in set(record_ids):
+        cached = table_cache.lookup(table_name, 'id', record_id)
+        if cached is not None:
+            found[record_id] = cached
+    missing = [record_id for record_id in set(record_ids) if record_id not in found]
+    if missing:
+        for row in query_table(table_name, filters=[('in_', 'id', missing)]):
+            found[row['id']] = row
+    return found
+
+def apply_filters(query, filters):
+    """Add (operator, column, value) filters to a postgrest builder"""
+    for operator, column, value in filters:
+        query = getattr(query, operator)(column, value)
+    return query
+
+def count_rows(table_name, filters=()):
+    """Exact server-side count of the rows matching filters (transfers one row at most)"""
+    query = apply_filters(supabase.table(table_name).select('id', count='exact'), filters)
+    return query.limit(1).execute().count or 0
+
+def select_rows(table_name, columns="*", filters=(), order=(), limit=None):
+    """Run a filtered, ordered, limited select against a Supabase table; raises on failure
+
+    filters are (operator, column, value) tuples using the postgrest builder
+    method names (eq, gte, lt, in_, ...); order is a list of (column, desc).
+    """
+    if not supabase:
+        raise SupabaseUnavailable(f"Supabase not available for {table_name}")
+    query = apply_filters(supabase.table(table_name).select(columns), filters)
+    for column, desc in order:
+        query = query.order(column, desc=desc)
+    if limit is not None:
+        query = query.limit(limit)
+    response = query.execute()
+    logger.info(f"Retrieved {len(response.data)} records from {table_name} (filtered)")
+    return response.data
+
+def query_table(table_name, columns="*", filters=(), order=(), limit=None):
+    """select_rows that logs a failure and returns [] instead of raising"""
+    try:
+        return select_rows(table_name, columns, filters, order, limit)
+    except Exception as e:
+        logger.error(f"Error querying {table_name}: {e}")
         return []
 
+def encode_cursor(last_id):
+    """Opaque keyset cursor pointing just after the row with last_id"""
+    return base64.urlsafe_b64encode(str(last_id).encode('ascii')).decode('ascii')
+
+def decode_cursor(cursor):
+    """Inverse of encode_cursor; raises ValueError on a malformed cursor"""
+    try:
+        return int(base64.urlsafe_b64decode(cursor.encode('ascii')))
+    except Exception:
+        raise ValueError('Invalid cursor')
+
+def fetch_page(table_name, columns, filters, limit, cursor=None):
+    """Fetch one newest-first keyset page; ids are time-ordered, so this is creation order
+
+    Returns (rows, next_cursor); next_cursor is None on the last page. A
+    failed query raises rather than looking like an empty last page.
+    """
+    filters = list(filters)
+    if cursor:
+        filters.append(('lt', 'id', decode_cursor(cursor)))
+    rows = select_rows(table_name, columns, filters, [('id', True)], limit + 1)
+    next_cursor = encode_cursor(rows[limit - 1]['id']) if len(rows) > limit else None
+    return rows[:limit], next_cursor
+
 def save_table_data(table_name, data):
     """Save data to Supabase table"""
     if not supabase:
@@ -97,10 +962,50 @@ def save_table_data(table_name, data):
         else:
             result = supabase.table(table_name).upsert(data).execute()
             logger.info(f"✓ Saved single record to {table_name} with ID: {data.get('id', 'unknown')}")
+        table_cache.patch(table_name, result.data or (data if isinstance(data, list) else [data]))
         return True
     except Exception as e:
         logger.error(f"Error saving to {table_name}: {e}")
         logger.error(traceback.format_exc())
+        table_cache.invalidate(table_name)
+        return False
+
+def update_table_data(table_name, record_id, changes):
+    """Update only the given columns of one row; returns the updated row, or None on failure
+
+    Columns left out keep whatever Supabase holds, so a concurrent stock
+    change is never overwritten with an older copy of the row.
+    """
+    if not supabase:
+        logger.error(f"Supabase not available for updating {table_name}")
+        return None
+    try:
+        result = supabase.table(table_name).update(changes).eq("id", record_id).execute()
+        if not result.data:
+            logger.error(f"No row {record_id} in {table_name} to update")
+            return None
+        logger.info(f"✓ Updated {', '.join(changes)} of {table_name} record {record_id}")
+        table_cache.patch(table_name, result.data)
+        return result.data[0]
+    except Exception as e:
+        logger.error(f"Error updating {table_name}: {e}")
+        table_cache.invalidate(table_name)
+        return None
+
+def insert_table_data(table_name, data):
+    """Insert new records into a Supabase table (fails on duplicate ids instead of overwriting)"""
+    if not supabase:
+        logger.error(f"Supabase not available for inserting into {table_name}")
+        return False
+    try:
+        rows = data if isinstance(data, list) else [data]
+        result = supabase.table(table_name).insert(rows).execute()
+        logger.info(f"✓ Inserted {len(rows)} records into {table_name}")
+        table_cache.patch(table_name, result.data or rows)
+        return True
+    except Exception as e:
+        logger.error(f"Error inserting into {table_name}: {e}")
+        table_cache.invalidate(table_name)
         return False
 
 def delete_table_data(table_name, record_id):
@@ -110,11 +1015,36 @@ def delete_table_data(table_name, record_id):
     try:
         supabase.table(table_name).delete().eq("id", record_id).execute()
         logger.info(f"✓ Deleted from {table_name}: {record_id}")
+        table_cache.remove(table_name, record_id)
         return True
     except Exception as e:
         logger.error(f"Error deleting from {table_name}: {e}")
+        table_cache.invalidate(table_name)
         return False
 
+def reencode_upload(file_data, image_format):
+    """Re-encoded copy of an uploaded image: EXIF-rotated, without metadata, at most IMAGE_MAX_DIMENSION"""
+    with Image.open(io.BytesIO(file_data)) as img:
+        img = ImageOps.exif_transpose(img)
+        img.thumbnail((IMAGE_MAX_DIMENSION, IMAGE_MAX_DIMENSION), Image.LANCZOS)
+        if image_format == 'JPEG' and img.mode not in ('RGB', 'L'):
+            img = img.convert('RGB')
+        output = io.BytesIO()
+        img.save(output, format=image_format, quality=IMAGE_QUALITY, optimize=True)
+    return output.getvalue()
+
+def prepare_image_upload(file_data, content_type):
+    """Apply EXIF rotation, strip metadata and cap the size of an uploaded image"""
+    image_format = IMAGE_UPLOAD_FORMATS.get(content_type)
+    if not image_format:
+        return file_data
+    try:
+        # Always the re-encoded copy, even when it is not smaller: the original carries EXIF/GPS
+        return run_blocking(reencode_upload, file_data, image_format)
+    except Exception as e:
+        logger.error(f"Could not process uploaded image, storing as-is: {e}")
+        return file_data
+
 def upload_to_supabase_storage(file, folder="products"):
     """Upload an image to Supabase Storage"""
     if not supabase:
@@ -133,15 +1063,18 @@ def upload_to_supabase_storage(file, folder="products"):
         
         # Determine content type
         content_type = file.content_type or 'image/jpeg'
+        file_data = prepare_image_upload(file_data, content_type)
         
         logger.info(f"Uploading to Supabase: {unique_filename} ({len(file_data)} bytes)")
         
         # Upload to Supabase Storage
-        supabase.storage.from_(STORAGE_BUCKET).upload(
-            path=unique_filename,
-            file=file_data,
-            file_options={"content-type": content_type}
-        )
+        with upstream_call('storage', 'upload', STORAGE_BUCKET) as call:
+            supabase.storage.from_(STORAGE_BUCKET).upload(
+                path=unique_filename,
+                file=file_data,
+                file_options={"content-type": content_type}
+            )
+            call['bytes'] = len(file_data)
         
         logger.info(f"✓ Successfully uploaded to Supabase: {unique_filename}")
         
@@ -163,31 +1096,1213 @@ def delete_from_supabase_storage(path):
     if not supabase or not path:
         return False
     try:
-        supabase.storage.from_(STORAGE_BUCKET).remove([path])
+        with upstream_call('storage', 'remove', STORAGE_BUCKET):
+            supabase.storage.from_(STORAGE_BUCKET).remove([path])
+        image_cache.discard(path)
+        for size in IMAGE_VARIANTS:
+            for image_format in IMAGE_VARIANT_FORMATS:
+                image_cache.discard(f"{path}@{size}.{image_format}")
         logger.info(f"✓ Deleted from Supabase: {path}")
         return True
     except Exception as e:
         logger.error(f"Error deleting from Supabase: {e}")
         return False
 
+# ==================== STOCK UPDATES ====================
+
+# 'auto' tries the record_sale/record_checkout database functions (sql/) and
+# falls back to compare-and-swap updates for any that are not installed;
+# 'on'/'off' force them.
+SALE_RPC_MODE = os.environ.get('SALE_RPC', 'auto').lower()
+STOCK_CAS_RETRIES = int(os.environ.get('STOCK_CAS_RETRIES', 8))
+missing_stock_functions = set()
+
+class StockError(Exception):
+    """A stock change that cannot be applied (missing product/size, not enough stock)"""
+
+    def __init__(self, message, status_code=400):
+        super().__init__(message)
+        self.status_code = status_code
+
+def calculate_total_stock(sizes):
+    """Sum the positive stock levels of a sizes map"""
+    total_stock = 0
+    for stock in sizes.values():
+        try:
+            total_stock += int(stock) if stock and int(stock) > 0 else 0
+        except:
+            pass
+    return total_stock
+
+def stock_level(stock):
+    """Stock of one size as an int (the API accepts "3" as well as 3); 0 if it cannot be parsed"""
+    try:
+        return int(stock or 0)
+    except (TypeError, ValueError):
+        return 0
+
+def fetch_product_fresh(product_id):
+    """Read a product straight from Supabase, bypassing the table cache"""
+    response = supabase.table('products').select("*").eq('id', product_id).limit(1).execute()
+    return response.data[0] if response.data else None
+
+def stock_after(product, changes):
+    """Sizes map of a product once {size: delta} is applied; raises StockError if it cannot be"""
+    if product is None:
+        raise StockError('Product not found', 404)
+    sizes = dict(product.get('sizes') or {})
+    for size_key, delta in changes.items():
+        if size_key not in sizes:
+            raise StockError(f'Size {size_key} not available for this product')
+        current_stock = int(sizes[size_key] or 0)
+        if current_stock + delta < 0:
+            raise StockError(f'Insufficient stock. Only {current_stock} available in size {size_key}')
+        sizes[size_key] = current_stock + delta
+    return sizes
+
+def apply_stock_changes(product, changes, patch_cache=True):
+    """Apply {size: delta} to a product's stock as a compare-and-swap on lastupdated
+
+    The update only matches if nobody has written the row since it was read;
+    on a lost race the row is re-read and the change re-validated.
+    patch_cache=False leaves the products cache to the caller.
+    """
+    for attempt in range(STOCK_CAS_RETRIES):
+        sizes = stock_after(product, changes)
+        
+        update = {
+            'sizes': sizes,
+            'totalstock': calculate_total_stock(sizes),
+            'lastupdated': datetime.now().isoformat()
+        }
+        query = supabase.table('products').update(update).eq('id', product['id'])
+        if product.get('lastupdated') is None:
+            query = query.is_('lastupdated', 'null')
+        else:
+            query = query.eq('lastupdated', product['lastupdated'])
+        response = query.execute()
+        
+        if response.data:
+            if patch_cache:
+                table_cache.patch('products', response.data)
+            return response.data[0]
+        
+        logger.info(f"Stock update for product {product['id']} lost a race (attempt {attempt + 1}), retrying")
+        product = fetch_product_fresh(product['id'])
+    
+    raise StockError('Stock is being updated by another sale, please retry', 409)
+
+def call_stock_function(name, params):
+    """Call a stock database function; returns its data, or None if it is not installed"""
+    if SALE_RPC_MODE == 'off' or name in missing_stock_functions:
+        return None
+    try:
+        return supabase.rpc(name, params).execute().data
+    except Exception as e:
+        message = str(e)
+        if 'insufficient_stock' in message:
+            # Raised as insufficient_stock[:<product id>:<size>]
+            detail = message.split('insufficient_stock', 1)[1].split("'", 1)[0].split(':')
+            where = f' in size {detail[2]} of product {detail[1]}' if len(detail) >= 3 else ''
+            raise StockError(f'Insufficient stock{where}')
+        if 'product_not_found' in message:
+            raise StockError('Product not found', 404)
+        if SALE_RPC_MODE == 'auto' and ('PGRST202' in message or 'Could not find the function' in message):
+            logger.warning(f"{name} function not installed, falling back to compare-and-swap stock updates")
+            missing_stock_functions.add(name)
+            return None
+        raise
+
+def sales_exist(sales):
+    """True if any of these sales is already in Supabase, e.g. after a lost insert response"""
+    response = supabase.table('sales').select('id').in_('id', [sale['id'] for sale in sales]).execute()
+    return bool(response.data)
+
+def sales_saved(sales):
+    """Check after a failed insert whether it went through anyway"""
+    try:
+        return sales_exist(sales)
+    except Exception as e:
+        logger.error(f"Could not check whether sales were saved: {e}")
+        return False
+
+def record_sale(product, size_key, quantity, sale, notification, patch_cache=True):
+    """Atomically take stock for a sale and record it; returns the updated product
+
+    patch_cache=False leaves the products cache to the caller.
+    """
+    updated = call_stock_function('record_sale', {
+        'p_product_id': product['id'],
+        'p_size': size_key,
+        'p_quantity': int(quantity),
+        'p_lastupdated': datetime.now().isoformat(),
+        'p_sale': sale,
+        'p_notification': notification
+    })
+    if updated is not None:
+        if isinstance(updated, list):
+            updated = updated[0] if updated else None
+        if patch_cache:
+            table_cache.patch('products', [updated])
+        table_cache.patch('sales', [sale])
+        table_cache.patch('notifications', [notification])
+        return updated
+    
+    updated = apply_stock_changes(product, {size_key: -int(quantity)}, patch_cache)
+    if not insert_table_data('sales', sale) and not sales_saved([sale]):
+        # Give the stock back so a failed sale does not leak inventory
+        apply_stock_changes(updated, {size_key: int(quantity)}, patch_cache)
+        raise StockError('Failed to save sale record', 500)
+    if not insert_table_data('notifications', notification):
+        logger.error("Sale recorded but its notification could not be saved")
+    return updated
+
+def record_checkout(products, changes, sales, notification, patch_cache=True, taken=(), on_taken=None):
+    """Take stock for every cart line and record all sales, all or nothing
+
+    changes maps product id -> {size: quantity}. Returns the updated products.
+    patch_cache=False leaves the products cache to the caller.
+
+    taken lists products whose stock an earlier attempt already took and
+    could not hand back; they are not taken again. on_taken(product_id,
+    taken) is called as stock is taken and handed back so the caller can
+    remember which lines are applied.
+    """
+    # The database function would take every line again
+    updated = None if taken else call_stock_function('record_checkout', {
+        'p_changes': [
+            {'product_id': product_id, 'size': size_key, 'quantity': quantity}
+            for product_id, sizes in changes.items() for size_key, quantity in sizes.items()
+        ],
+        'p_lastupdated': datetime.now().isoformat(),
+        'p_sales': sales,
+        'p_notification': notification
+    })
+    if updated is not None:
+        if patch_cache:
+            table_cache.patch('products', updated)
+        table_cache.patch('sales', sales)
+        table_cache.patch('notifications', [notification])
+        return updated
+    
+    applied = []
+    try:
+        for product_id in sorted(changes):
+            sizes = changes[product_id]
+            if product_id in taken:
+                product = products[product_id]
+            else:
+                product = apply_stock_changes(products[product_id], {k: -q for k, q in sizes.items()}, patch_cache)
+                if on_taken:
+                    on_taken(product_id, True)
+            applied.append((product, sizes))
+        if not insert_table_data('sales', sales) and not sales_saved(sales):
+            raise StockError('Failed to save sale records', 500)
+    except Exception:
+        # Hand back whatever was already taken so the cart fails as a whole,
+        # whether a line was refused or Supabase stopped answering
+        for product, sizes in reversed(applied):
+            try:
+                apply_stock_changes(product, dict(sizes), patch_cache)
+                if on_taken:
+                    on_taken(product['id'], False)
+            except Exception as e:
+                logger.error(f"Could not restore stock for product {product['id']}: {e}")
+        raise
+    if not insert_table_data('notifications', notification):
+        logger.error("Checkout recorded but its notification could not be saved")
+    return [product for product, _ in applied]
+
+# ==================== WRITE-BEHIND QUEUE ====================
+
+# 'always' accepts sales into a durable local queue and answers the till
+# straight away; a background thread writes them to Supabase. 'fallback'
+# writes through and only queues when Supabase cannot be reached. 'off'
+# writes through and fails the sale on errors, as before.
+#
+# Stock is checked against this worker's view (the table cache plus
+# everything still queued). If another worker or till sold the last pair
+# first, the queued sale fails when it is flushed: it is kept as 'failed',
+# announced as a notification and shown by /api/queue/status.
+#
+# The queue file must outlive the process: on a host whose disk is wiped on
+# deploy or restart (Render's default), point WRITE_QUEUE_PATH at a
+# persistent disk before choosing 'always' (render.yaml does). Workers also
+# drain the queue on shutdown (worker_exit in gunicorn.conf.py), which
+# covers a clean deploy but not a crash.
+WRITE_BEHIND_MODE = os.environ.get('WRITE_BEHIND', 'fallback').lower()
+WRITE_QUEUE_PATH = os.environ.get('WRITE_QUEUE_PATH', os.path.join('data', 'write_queue.sqlite3'))
+WRITE_QUEUE_BATCH_SIZE = int(os.environ.get('WRITE_QUEUE_BATCH_SIZE', 50))
+WRITE_QUEUE_POLL_SECONDS = float(os.environ.get('WRITE_QUEUE_POLL_SECONDS', 2))
+WRITE_QUEUE_MAX_BACKOFF = float(os.environ.get('WRITE_QUEUE_MAX_BACKOFF', 300))
+WRITE_QUEUE_LEASE_SECONDS = 120
+# Flushed entries are kept this long so a replayed key is recognised as done
+WRITE_QUEUE_RETENTION_SECONDS = int(os.environ.get('WRITE_QUEUE_RETENTION_SECONDS', 86400))
+
+WRITE_QUEUE_SCHEMA = """
+CREATE TABLE IF NOT EXISTS write_queue (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    key TEXT NOT NULL UNIQUE,
+    kind TEXT NOT NULL,
+    payload TEXT NOT NULL,
+    state TEXT NOT NULL DEFAULT 'pending',
+    attempts INTEGER NOT NULL DEFAULT 0,
+    next_attempt REAL NOT NULL DEFAULT 0,
+    lease_until REAL NOT NULL DEFAULT 0,
+    lease_token TEXT,
+    last_error TEXT,
+    created_at REAL NOT NULL,
+    finished_at REAL
+);
+CREATE INDEX IF NOT EXISTS write_queue_ready ON write_queue (state, next_attempt);
+"""
+
+def is_duplicate_error(error):
+    """True when Supabase rejected a write because the row already exists"""
+    message = str(error)
+    return '23505' in message or 'duplicate key' in message
+
+class WriteQueue:
+    """Durable SQLite queue of sales and checkouts waiting to be written to Supabase
+
+    Each entry carries an idempotency key derived from its sale ids, so a
+    retried flush never applies the same sale twice.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.RLock()
+        self._conn = None
+        self._pid = None
+        self._thread = None
+        self._wake = threading.Event()
+        self.last_error = None
+        self.last_flush_at = None
+        self.counters = {'enqueued': 0, 'flushed': 0, 'retries': 0, 'conflicts': 0, 'duplicates': 0}
+
+    def _db(self):
+        """Connection for this process (re-opened after a fork)"""
+        if self._conn is None or self._pid != os.getpid():
+            os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+            self._conn = sqlite3.connect(self.path, timeout=30, check_same_thread=False)
+            self._conn.row_factory = sqlite3.Row
+            self._conn.execute('PRAGMA journal_mode=WAL')
+            # An accepted sale must survive a crash, so commits are fsynced
+            self._conn.execute('PRAGMA synchronous=FULL')
+            self._conn.executescript(WRITE_QUEUE_SCHEMA)
+            self._pid = os.getpid()
+        return self._conn
+
+    def _sql(self, work):
+        """work(connection) under the queue lock, through run_blocking as commits are fsynced"""
+        with self.lock:
+            return run_blocking(lambda: work(self._db()))
+
+    def enqueue(self, key, kind, payload):
+        """Persist an entry; returns False if the key was already queued"""
+        def insert(db):
+            cursor = db.execute(
+                'INSERT OR IGNORE INTO write_queue (key, kind, payload, created_at) VALUES (?, ?, ?, ?)',
+                (key, kind, json.dumps(payload), time.time())
+            )
+            db.commit()
+            return cursor.rowcount
+        inserted = self._sql(insert)
+        if inserted:
+            self.counters['enqueued'] += 1
+        else:
+            self.counters['duplicates'] += 1
+        self.start()
+        self._wake.set()
+        return bool(inserted)
+
+    def pending(self):
+        """(kind, payload) of every entry not yet written upstream, oldest first"""
+        rows = self._sql(lambda db: db.execute(
+            "SELECT kind, payload FROM write_queue WHERE state = 'pending' ORDER BY id"
+        ).fetchall())
+        return [(row['kind'], json.loads(row['payload'])) for row in rows]
+
+    def overlay(self, table_name, rows, pending=None):
+        """Apply queued sales to rows just read from Supabase so reads see them
+
+        Only for rows an endpoint returns: the table cache and anything used as
+        the base of a write must stay as stored upstream, or the flusher would
+        take the stock a second time. Mutates and returns rows. pending is a
+        pending() result read before the rows, when the caller has one.
+        """
+        if WRITE_BEHIND_MODE == 'off' or table_name not in ('products', 'sales', 'notifications'):
+            return rows
+        if pending is None:
+            pending = self.pending()
+        if not pending:
+            return rows
+        if table_name == 'products':
+            by_id = {row.get('id'): row for row in rows}
+            for kind, payload in pending:
+                for product_id, size_key, quantity in payload['changes']:
+                    product = by_id.get(product_id)
+                    if product and size_key in (product.get('sizes') or {}):
+                        product['sizes'][size_key] = int(product['sizes'][size_key] or 0) - quantity
+                        product['totalstock'] = calculate_total_stock(product['sizes'])
+            return rows
+        seen = {row.get('id') for row in rows}
+        for kind, payload in pending:
+            queued = payload['sales'] if table_name == 'sales' else [payload['notification']]
+            rows.extend(row for row in queued if row['id'] not in seen)
+        return rows
+
+    def mark_read(self, notification_ids=None, up_to=None, now=None):
+        """Mark queued notifications read (the given ids, or every id up to up_to); returns how many
+
+        An entry already being flushed may have sent its notification unread;
+        flush() compares the stored payload when it finishes and sends the
+        read flag after it.
+        """
+        now = now or datetime.now().isoformat()
+        def mark(db):
+            marked = 0
+            for row in db.execute("SELECT id, payload FROM write_queue WHERE state = 'pending'").fetchall():
+                payload = json.loads(row['payload'])
+                notification = payload.get('notification')
+                if not notification or notification.get('read', False):
+                    continue
+                if notification_ids is not None and notification['id'] not in notification_ids:
+                    continue
+                if up_to is not None and notification['id'] > up_to:
+                    continue
+                notification.update({'read': True, 'updated_at': now})
+                db.execute('UPDATE write_queue SET payload = ? WHERE id = ?', (json.dumps(payload), row['id']))
+                marked += 1
+            db.commit()
+            return marked
+        return self._sql(mark)
+
+    def _claim(self):
+        """Lease a batch of due entries so other workers' flushers skip them"""
+        now = time.time()
+        token = uuid.uuid4().hex
+        def claim(db):
+            db.execute(
+                """UPDATE write_queue SET lease_until = ?, lease_token = ? WHERE id IN (
+                       SELECT id FROM write_queue
+                       WHERE state = 'pending' AND next_attempt <= ? AND lease_until < ?
+                       ORDER BY id LIMIT ?)""",
+                (now + WRITE_QUEUE_LEASE_SECONDS, token, now, now, WRITE_QUEUE_BATCH_SIZE)
+            )
+            db.commit()
+            return db.execute(
+                'SELECT * FROM write_queue WHERE lease_token = ? ORDER BY id', (token,)
+            ).fetchall()
+        return self._sql(claim)
+
+    def _update(self, entry_id, **fields):
+        columns = ', '.join(f'{name} = ?' for name in fields)
+        def update(db):
+            db.execute(f'UPDATE write_queue SET {columns} WHERE id = ?', (*fields.values(), entry_id))
+            db.commit()
+        self._sql(update)
+
+    def _write(self, entry):
+        """Write one entry upstream; returns the updated products"""
+        payload = json.loads(entry['payload'])
+        sales = payload['sales']
+        # After a failed or interrupted attempt the sale may already be in
+        # Supabase; the compare-and-swap path cannot tell on its own
+        if entry['attempts'] and sales_exist(sales):
+            return []
+        changes = {}
+        for product_id, size_key, quantity in payload['changes']:
+            changes.setdefault(product_id, {})[size_key] = quantity
+        products = {}
+        for product_id in changes:
+            # Read fresh so compare-and-swap starts from the current lastupdated
+            product = fetch_product_fresh(product_id)
+            if product is None:
+                raise StockError('Product not found', 404)
+            products[product_id] = product
+        try:
+            # flush() patches the products cache itself, together with marking the entry done
+            if entry['kind'] == 'sale':
+                (product_id, size_key, quantity), = payload['changes']
+                return [record_sale(products[product_id], size_key, quantity, sales[0], payload['notification'],
+                                    patch_cache=False)]
+            # Lines whose stock a failed attempt took and could not hand back
+            # are remembered in the entry, so a retry does not take them twice
+            taken = set(payload.get('taken', []))
+            def on_taken(product_id, applied):
+                (taken.add if applied else taken.discard)(product_id)
+                self._update(entry['id'], payload=json.dumps({**payload, 'taken': sorted(taken)}))
+            return record_checkout(products, changes, sales, payload['notification'], patch_cache=False,
+                                   taken=set(taken), on_taken=on_taken)
+        except Exception as e:
+            if is_duplicate_error(e):
+                return []
+            raise
+
+    def _conflict(self, entry, error):
+        """A queued sale the database refused: keep it, undo it locally and tell the shop"""
+        self.counters['conflicts'] += 1
+        self._update(entry['id'], state='failed', last_error=str(error), finished_at=time.time())
+        logger.error(f"✗ Queued {entry['kind']} {entry['key']} was rejected by Supabase: {error}")
+        # The cache never held the queued rows and the entry is no longer pending, so
+        # bumping the table versions is enough for reads to stop showing it
+        for table_name in ('products', 'sales', 'notifications'):
+            table_cache.touch(table_name)
+        report_cache.invalidate_open()
+        try:
+            dashboard_aggregates.rebuild()
+        except Exception as e:
+            logger.warning(f"Could not rebuild dashboard aggregates after a rejected sale: {e}")
+        try:
+            catalog_index.rebuild()
+        except Exception as e:
+            logger.warning(f"Could not rebuild catalog index after a rejected sale: {e}")
+        now = datetime.now().isoformat()
+        notification = {
+            'id': next_record_id(),
+            'message': f"A queued sale could not be saved ({error}). Check stock and re-enter it.",
+            'type': 'error',
+            'timestamp': now,
+            'updated_at': now,
+            'read': False
+        }
+        insert_table_data('notifications', notification)
+        event_hub.publish('notification', notification)
+
+    def flush(self):
+        """Write one batch upstream; returns how many entries were flushed"""
+        entries = self._claim()
+        flushed = 0
+        for index, entry in enumerate(entries):
+            try:
+                updated = self._write(entry)
+            except StockError as e:
+                if e.status_code in (400, 404):
+                    self._conflict(entry, e)
+                    continue
+                error = e
+            except Exception as e:
+                error = e
+            else:
+                # Under the lock, so queue_sales never sees the upstream stock with
+                # this entry still pending on top of it
+                with self.lock:
+                    stored = self._sql(lambda db: db.execute('SELECT payload FROM write_queue WHERE id = ?',
+                                                             (entry['id'],)).fetchone())
+                    self._update(entry['id'], state='done', finished_at=time.time(), last_error=None)
+                    table_cache.patch('products', [row for row in updated if row])
+                sent = json.loads(entry['payload'])['notification']
+                notification = json.loads(stored['payload'])['notification']
+                if notification.get('read', False) and not sent.get('read', False):
+                    # Marked read by mark_read() while this entry was being written
+                    update_table_data('notifications', notification['id'],
+                                      {'read': True, 'updated_at': notification['updated_at']})
+                for table_name in ('sales', 'notifications'):
+                    table_cache.touch(table_name)
+                self.counters['flushed'] += 1
+                self.last_flush_at = datetime.now().isoformat()
+                flushed += 1
+                continue
+            
+            if isinstance(error, SupabaseUnavailable):
+                # Circuit open: nothing was sent, so try again on the next poll without backing off
+                for skipped in entries[index:]:
+                    self._update(skipped['id'], lease_until=0)
+                break
+            
+            # Supabase is unreachable or erroring: back off and leave the rest of the batch
+            attempts = entry['attempts'] + 1
+            self.counters['retries'] += 1
+            self.last_error = str(error)
+            self._update(entry['id'], attempts=attempts, last_error=str(error), lease_until=0,
+                         next_attempt=time.time() + min(2 ** attempts, WRITE_QUEUE_MAX_BACKOFF))
+            logger.warning(f"Queued {entry['kind']} {entry['key']} not written (attempt {attempts}): {error}")
+            for skipped in entries[index + 1:]:
+                self._update(skipped['id'], lease_until=0)
+            break
+        if flushed:
+            logger.info(f"✓ Flushed {flushed} queued writes to Supabase")
+        return flushed
+
+    def drain(self, timeout):
+        """Flush until nothing more can be written or timeout passes; returns how many are left pending"""
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline and self.flush():
+            pass
+        return self._sql(lambda db: db.execute(
+            "SELECT COUNT(*) FROM write_queue WHERE state = 'pending'").fetchone()[0])
+
+    def purge(self):
+        """Forget entries flushed longer ago than the retention window"""
+        def purge(db):
+            db.execute("DELETE FROM write_queue WHERE state = 'done' AND finished_at < ?",
+                       (time.time() - WRITE_QUEUE_RETENTION_SECONDS,))
+            db.commit()
+        self._sql(purge)
+
+    def _run(self):
+        last_purge = 0
+        while True:
+            try:
+                if not self.flush():
+                    self._wake.wait(WRITE_QUEUE_POLL_SECONDS)
+                    self._wake.clear()
+                if time.monotonic() - last_purge > 3600:
+                    self.purge()
+                    last_purge = time.monotonic()
+            except Exception as e:
+                logger.error(f"Write queue flusher error: {e}")
+                time.sleep(WRITE_QUEUE_POLL_SECONDS)
+
+    def start(self):
+        """Start this process's flusher thread (again after a fork)"""
+        with self.lock:
+            if self._thread is not None and self._thread.is_alive() and self._pid == os.getpid():
+                return
+            self._sql(lambda db: None)
+            self._thread = threading.Thread(target=self._run, name='write-queue-flusher', daemon=True)
+            self._thread.start()
+
+    def status(self):
+        def read(db):
+            counts = dict(db.execute('SELECT state, COUNT(*) FROM write_queue GROUP BY state').fetchall())
+            oldest = db.execute("SELECT MIN(created_at) FROM write_queue WHERE state = 'pending'").fetchone()[0]
+            failed = db.execute(
+                "SELECT key, kind, attempts, last_error, created_at, finished_at FROM write_queue "
+                "WHERE state = 'failed' ORDER BY id DESC LIMIT 20"
+            ).fetchall()
+            return counts, oldest, failed
+        counts, oldest, failed = self._sql(read)
+        return {
+            'mode': WRITE_BEHIND_MODE,
+            'depth': counts.get('pending', 0),
+            'failed': counts.get('failed', 0),
+            'done': counts.get('done', 0),
+            'oldestPendingSeconds': round(time.time() - oldest, 1) if oldest else 0,
+            'lastError': self.last_error,
+            'lastFlushAt': self.last_flush_at,
+            'flusherRunning': bool(self._thread and self._thread.is_alive()),
+            'counters': dict(self.counters),
+            'failures': [
+                {
+                    'key': row['key'],
+                    'kind': row['kind'],
+                    'attempts': row['attempts'],
+                    'error': row['last_error'],
+                    'queuedAt': datetime.fromtimestamp(row['created_at']).isoformat(),
+                    'failedAt': datetime.fromtimestamp(row['finished_at']).isoformat() if row['finished_at'] else None
+                }
+                for row in failed
+            ]
+        }
+
+write_queue = WriteQueue(WRITE_QUEUE_PATH)
+
+def queue_sales(kind, products, changes, sales, notification):
+    """Take stock locally and queue the write; returns the products as they will be upstream
+
+    The table cache is left as it is upstream: reads apply the queue on top
+    (write_queue.overlay), and its versions are bumped so cached listings do.
+    """
+    with write_queue.lock:
+        # Re-read under the lock (cache or Supabase, plus the queue) so two
+        # tills in this worker cannot both take the last pair. A row read from
+        # Supabase while an entry is being flushed can count that entry twice:
+        # the last pair may be refused for a moment, never oversold.
+        pending = write_queue.pending()
+        updated = []
+        for product_id, sizes in changes.items():
+            product = get_record('products', product_id, coalesce=False) or _copy_row(products[product_id])
+            product, = write_queue.overlay('products', [product], pending)
+            sizes = stock_after(product, {size_key: -quantity for size_key, quantity in sizes.items()})
+            updated.append({**product, 'sizes': sizes, 'totalstock': calculate_total_stock(sizes),
+                            'lastupdated': datetime.now().isoformat()})
+        write_queue.enqueue(f"{kind}:{sales[0]['id']}", kind, {
+            'changes': [[product_id, size_key, quantity]
+                        for product_id, sizes in changes.items() for size_key, quantity in sizes.items()],
+            'sales': sales,
+            'notification': notification
+        })
+        for table_name in ('products', 'sales', 'notifications'):
+            table_cache.touch(table_name)
+    return updated
+
+def submit_sale(product, size_key, quantity, sale, notification):
+    """record_sale via the write-behind queue; returns (updated product, queued)"""
+    if WRITE_BEHIND_MODE != 'always':
+        try:
+            return record_sale(product, size_key, quantity, sale, notification), False
+        except StockError:
+            raise
+        except Exception as e:
+            if WRITE_BEHIND_MODE != 'fallback':
+                raise
+            logger.warning(f"Supabase write failed, queueing sale {sale['id']}: {e}")
+    updated = queue_sales('sale', {product['id']: product}, {product['id']: {size_key: int(quantity)}},
+                          [sale], notification)
+    return updated[0], True
+
+def submit_checkout(products, changes, sales, notification):
+    """record_checkout via the write-behind queue; returns (updated products, queued)"""
+    if WRITE_BEHIND_MODE != 'always':
+        try:
+            return record_checkout(products, changes, sales, notification), False
+        except StockError:
+            raise
+        except Exception as e:
+            if WRITE_BEHIND_MODE != 'fallback':
+                raise
+            logger.warning(f"Supabase write failed, queueing checkout {sales[0]['id']}: {e}")
+    return queue_sales('checkout', products, changes, sales, notification), True
+
+if WRITE_BEHIND_MODE != 'off':
+    write_queue.start()
+
+# ==================== DASHBOARD AGGREGATES ====================
+
+# Each worker keeps its own running totals; sales recorded by other workers
+# are folded in when the totals are rebuilt from the tables.
+AGGREGATES_RECONCILE_SECONDS = int(os.environ.get('AGGREGATES_RECONCILE_SECONDS', 300))
+# How soon a first build that failed (e.g. Supabase down at boot) is tried again
+RECONCILE_RETRY_SECONDS = 30
+
+class Reconciled:
+    """In-memory state derived from Supabase tables and rebuilt in the background
+
+    Subclasses implement rebuild(), which reads the tables outside self._lock
+    and swaps the result in under it. The first build runs in the request
+    that needs it; after that a per-process thread rebuilds every
+    reconcile_seconds, so requests and writers never wait for a full read.
+    """
+
+    name = 'state'
+
+    def __init__(self, reconcile_seconds):
+        self.reconcile_seconds = reconcile_seconds
+        self._lock = threading.RLock()
+        # One rebuild at a time (background thread, rebuild endpoint, first request)
+        self._build_lock = threading.RLock()
+        self._built_at = None
+        self._failed_at = None
+        self._thread = None
+        self._pid = None
+
+    def rebuild(self):
+        raise NotImplementedError
+
+    def ensure_built(self):
+        """Build on first use (raises if that fails) and start the reconcile thread"""
+        if self._built_at is None:
+            with self._build_lock:
+                if self._built_at is None:
+                    if self._failed_at is not None and time.monotonic() - self._failed_at < RECONCILE_RETRY_SECONDS:
+                        raise SupabaseUnavailable(f'{self.name} is not built yet')
+                    try:
+                        self.rebuild()
+                    except Exception:
+                        self._failed_at = time.monotonic()
+                        raise
+        self.start()
+
+    def _run(self):
+        while True:
+            # Waits a full interval after a failure too, so an outage costs one read per interval
+            time.sleep(max(self.reconcile_seconds, 1))
+            try:
+                self.rebuild()
+            except Exception as e:
+                logger.warning(f"Keeping {self.name}, reconcile failed: {e}")
+
+    def start(self):
+        """Start this process's reconcile thread (again after a fork)"""
+        with self._lock:
+            if self._thread is not None and self._thread.is_alive() and self._pid == os.getpid():
+                return
+            self._thread = threading.Thread(target=self._run, name=f'{self.name}-reconcile', daemon=True)
+            self._pid = os.getpid()
+            self._thread.start()
+
+class DashboardAggregates(Reconciled):
+    """Running totals behind /api/dashboard/stats with per-day sale buckets"""
+
+    name = 'dashboard aggregates'
+
+    def __init__(self, reconcile_seconds):
+        super().__init__(reconcile_seconds)
+        # Sales recorded while a rebuild reads the tables, replayed onto its result
+        self._recorded = None
+        # Recent sales the last rebuild read; one recorded after it is not added again
+        self._scanned = set()
+        self.days = {}
+        self.total_revenue = 0
+        self.total_profit = 0
+        self.sales_count = 0
+        self.total_stock = 0
+        self.product_count = 0
+
+    def _add_sale(self, sale):
+        day = self.days.setdefault(str(sale.get('timestamp', ''))[:10], {
+            'revenue': 0, 'profit': 0, 'items': 0, 'count': 0
+        })
+        day['revenue'] += sale.get('totalamount', 0) or 0
+        day['profit'] += sale.get('totalprofit', 0) or 0
+        day['items'] += sale.get('quantity', 0) or 0
+        day['count'] += 1
+        self.total_revenue += sale.get('totalamount', 0) or 0
+        self.total_profit += sale.get('totalprofit', 0) or 0
+        self.sales_count += 1
+
+    def rebuild(self):
+        """Recompute every total from the products and sales tables
+
+        The tables are read without holding the lock, so sales keep being
+        recorded meanwhile; those the read missed are replayed onto the new
+        totals. Raises if Supabase cannot be read, leaving the current totals
+        (and the stale table cache kept for outages) untouched.
+        """
+        with self._build_lock:
+            with self._lock:
+                self._recorded = []
+            # Sales still being written when the read starts were created shortly before it
+            recent = (datetime.now() - timedelta(minutes=5)).isoformat()
+            try:
+                pending = write_queue.pending() if WRITE_BEHIND_MODE != 'off' else []
+                products = write_queue.overlay('products', select_rows('products', 'id,sizes,totalstock'), pending)
+                sales = write_queue.overlay(
+                    'sales', select_rows('sales', 'id,timestamp,totalamount,totalprofit,quantity'), pending
+                )
+            except Exception:
+                with self._lock:
+                    self._recorded = None
+                raise
+            
+            fresh = DashboardAggregates(self.reconcile_seconds)
+            for sale in sales:
+                fresh._add_sale(sale)
+            fresh.total_stock = sum([p.get('totalstock', 0) or 0 for p in products])
+            seen = {sale.get('id') for sale in sales}
+            with self._lock:
+                for sale in self._recorded:
+                    if sale.get('id') not in seen:
+                        fresh._add_sale(sale)
+                        fresh.total_stock -= sale.get('quantity', 0) or 0
+                self._recorded = None
+                self._scanned = {sale.get('id') for sale in sales if str(sale.get('timestamp', '')) >= recent}
+                self.days = fresh.days
+                self.total_revenue = fresh.total_revenue
+                self.total_profit = fresh.total_profit
+                self.sales_count = fresh.sales_count
+                self.total_stock = fresh.total_stock
+                self.product_count = len(products)
+                self._built_at = time.monotonic()
+            logger.info(f"Rebuilt dashboard aggregates from {len(products)} products and {len(sales)} sales")
+
+    def record_sale(self, sale):
+        """Add a sale and take its quantity off the stock total
+
+        The stock change is the sale's own quantity, not a diff of product
+        rows: those may be read before a concurrent sale took its stock.
+        """
+        with self._lock:
+            if self._recorded is not None:
+                self._recorded.append(sale)
+            if sale.get('id') in self._scanned:
+                self._scanned.discard(sale.get('id'))
+            elif self._built_at is not None:
+                self._add_sale(sale)
+                self.total_stock -= sale.get('quantity', 0) or 0
+
+    def product_changed(self, old, new):
+        """Apply a product create (old=None), edit or delete (new=None); sales use record_sale"""
+        with self._lock:
+            if self._built_at is None:
+                return
+            self.total_stock += (new or {}).get('totalstock', 0) or 0
+            self.total_stock -= (old or {}).get('totalstock', 0) or 0
+            self.product_count += (new is not None) - (old is not None)
+
+    def snapshot(self, day):
+        with self._lock:
+            today = self.days.get(day, {})
+            return {
+                'totalProducts': self.product_count,
+                'totalStock': self.total_stock,
+                'totalRevenue': self.total_revenue,
+                'totalProfit': self.total_profit,
+                'todayRevenue': today.get('revenue', 0),
+                'todayProfit': today.get('profit', 0),
+                'todayItems': today.get('items', 0),
+                'salesCount': self.sales_count
+            }
+
+dashboard_aggregates = DashboardAggregates(AGGREGATES_RECONCILE_SECONDS)
+
+# ==================== IMAGE VARIANTS ====================
+
+# Longest edge in pixels for each ?size= variant served by /api/images
+IMAGE_VARIANTS = {
+    'thumb': 200,
+    'card': 480,
+    'full': 1200
+}
+IMAGE_VARIANT_FORMATS = {'webp': ('WEBP', 'image/webp'), 'jpeg': ('JPEG', 'image/jpeg')}
+IMAGE_UPLOAD_FORMATS = {'image/jpeg': 'JPEG', 'image/png': 'PNG', 'image/webp': 'WEBP'}
+IMAGE_MAX_DIMENSION = int(os.environ.get('IMAGE_MAX_DIMENSION', 2000))
+IMAGE_QUALITY = int(os.environ.get('IMAGE_QUALITY', 82))
+
+def image_url(image_path, size=None):
+    """Proxy URL for a stored image, optionally for one of IMAGE_VARIANTS"""
+    if size:
+        return f"/api/images/{image_path}?size={size}"
+    return f"/api/images/{image_path}"
+
+# ==================== IMAGE CACHE ====================
+
+IMAGE_CACHE_DIR = os.environ.get('IMAGE_CACHE_DIR', os.path.join(tempfile.gettempdir(), 'karanja-image-cache'))
+IMAGE_CACHE_MAX_BYTES = int(os.environ.get('IMAGE_CACHE_MAX_BYTES', 512 * 1024 * 1024))
+IMAGE_CHUNK_SIZE = 64 * 1024
+IMAGE_FETCH_TIMEOUT = float(os.environ.get('IMAGE_FETCH_TIMEOUT', 10))
+
+class ImageCache:
+    """Bounded on-disk LRU of proxied images, keyed by storage path
+
+    Each image is stored as <sha256>.bin with a <sha256>.json metadata file
+    (content type, ETag, Last-Modified). Files are published with os.replace
+    so several workers can share the directory.
+    """
+
+    def __init__(self, directory, max_bytes):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self._index = OrderedDict()
+        self._size = 0
+        self._inflight = {}
+        self._lock = threading.Lock()
+        self.counters = {'hits': 0, 'misses': 0, 'coalesced': 0, 'evictions': 0}
+        os.makedirs(directory, exist_ok=True)
+        self._load()
+
+    def _paths(self, key):
+        name = hashlib.sha256(key.encode('utf-8')).hexdigest()
+        return os.path.join(self.directory, f"{name}.bin"), os.path.join(self.directory, f"{name}.json")
+
+    def _load(self):
+        entries = []
+        for filename in os.listdir(self.directory):
+            if not filename.endswith('.json'):
+                continue
+            try:
+                with open(os.path.join(self.directory, filename)) as f:
+                    meta = json.load(f)
+                entries.append((os.path.getmtime(meta['file']), meta))
+            except Exception:
+                continue
+        for _, meta in sorted(entries, key=lambda e: e[0]):
+            self._index[meta['key']] = meta
+            self._size += meta['size']
+        self._evict()
+
+    def _evict(self):
+        while self._size > self.max_bytes and self._index:
+            key, meta = self._index.popitem(last=False)
+            self._size -= meta['size']
+            self.counters['evictions'] += 1
+            for path in self._paths(key):
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
+
+    def get(self, key):
+        """Return metadata for a cached image, or None on a miss"""
+        with self._lock:
+            meta = self._index.get(key)
+            if meta is not None and not os.path.exists(meta['file']):
+                self._index.pop(key)
+                self._size -= meta['size']
+                meta = None
+            if meta is None:
+                self.counters['misses'] += 1
+                return None
+            self._index.move_to_end(key)
+            self.counters['hits'] += 1
+            return meta
+
+    def claim(self, key):
+        """Claim the upstream fetch for key; returns None for the leader, else an Event to wait on"""
+        with self._lock:
+            event = self._inflight.get(key)
+            if event is not None:
+                self.counters['coalesced'] += 1
+                metrics.inc('single_flight_coalesced_total', (('kind', 'image'),))
+                return event
+            self._inflight[key] = threading.Event()
+            return None
+
+    def release(self, key):
+        with self._lock:
+            event = self._inflight.pop(key, None)
+        if event is not None:
+            event.set()
+
+    def temp_file(self):
+        return tempfile.NamedTemporaryFile(dir=self.directory, suffix='.part', delete=False)
+
+    def store(self, key, temp_path, content_type, etag, last_modified):
+        """Publish a fully downloaded temp file under key"""
+        data_path, meta_path = self._paths(key)
+        meta = {
+            'key': key,
+            'file': data_path,
+            'size': os.path.getsize(temp_path),
+            'content_type': content_type,
+            'etag': etag,
+            'last_modified': last_modified
+        }
+        os.replace(temp_path, data_path)
+        with open(meta_path + '.part', 'w') as f:
+            json.dump(meta, f)
+        os.replace(meta_path + '.part', meta_path)
+        with self._lock:
+            old = self._index.pop(key, None)
+            if old is not None:
+                self._size -= old['size']
+            self._index[key] = meta
+            self._size += meta['size']
+            self._evict()
+        return meta
+
+    def discard(self, key):
+        with self._lock:
+            meta = self._index.pop(key, None)
+            if meta is not None:
+                self._size -= meta['size']
+        for path in self._paths(key):
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+    def stats(self):
+        with self._lock:
+            return {**self.counters, 'entries': len(self._index), 'bytes': self._size, 'max_bytes': self.max_bytes}
+
+image_cache = ImageCache(IMAGE_CACHE_DIR, IMAGE_CACHE_MAX_BYTES)
+
 # ==================== IMAGE PROXY ====================
 
+def send_cached_image(meta):
+    """Serve a cached image with ETag/Last-Modified validation (304 when unchanged)"""
+    return send_file(
+        meta['file'],
+        mimetype=meta['content_type'],
+        etag=meta['etag'],
+        last_modified=parse_date(meta['last_modified']),
+        max_age=3600,
+        conditional=True
+    )
+
+def stream_image(image_path, upstream, leader):
+    """Stream an upstream image to the client; the leader also writes it into the cache"""
+    etag = (upstream.headers.get('ETag') or '').replace('W/', '').strip('"') or None
+    last_modified = upstream.headers.get('Last-Modified')
+    content_type = upstream.headers.get('Content-Type', 'image/jpeg')
+    closed = []
+    
+    def close():
+        # Runs when the body is done or abandoned, and from call_on_close for
+        # responses whose body is never iterated (HEAD, 304)
+        if closed:
+            return
+        closed.append(True)
+        upstream.close()
+        if leader:
+            image_cache.release(image_path)
+    
+    def generate():
+        temp = image_cache.temp_file() if leader else None
+        digest = hashlib.sha1()
+        completed = False
+        received = 0
+        try:
+            for chunk in upstream.iter_content(IMAGE_CHUNK_SIZE):
+                if temp:
+                    temp.write(chunk)
+                    digest.update(chunk)
+                received += len(chunk)
+                yield chunk
+            if temp:
+                temp.close()
+                image_cache.store(image_path, temp.name, content_type, etag or digest.hexdigest(),
+                                  last_modified or http_date(time.time()))
+            completed = True
+        finally:
+            metrics.inc('upstream_bytes_total', IMAGE_UPSTREAM_LABELS, received)
+            if temp and not completed:
+                temp.close()
+                try:
+                    os.remove(temp.name)
+                except OSError:
+                    pass
+            close()
+    
+    resp = Response(generate(), mimetype=content_type)
+    resp.call_on_close(close)
+    resp.headers['Cache-Control'] = 'public, max-age=3600'
+    if etag:
+        resp.set_etag(etag)
+    if last_modified:
+        resp.headers['Last-Modified'] = last_modified
+    return resp
+
+IMAGE_UPSTREAM_LABELS = (('service', 'image'), ('operation', 'GET'), ('target', STORAGE_BUCKET))
+
+_image_sessions = {}
+
+def image_session():
+    """Keep-alive requests session for image downloads, one per worker process"""
+    session = _image_sessions.get(os.getpid())
+    if session is None:
+        session = requests.Session()
+        adapter = requests.adapters.HTTPAdapter(pool_connections=4, pool_maxsize=UPSTREAM_POOL_SIZE)
+        session.mount('http://', adapter)
+        session.mount('https://', adapter)
+        _image_sessions[os.getpid()] = session
+    return session
+
+def get_upstream_image(public_url):
+    """Open a streamed GET for a stored image; times the wait for its headers"""
+    with upstream_call('image', 'GET', STORAGE_BUCKET):
+        return image_session().get(public_url, timeout=(UPSTREAM_CONNECT_TIMEOUT, IMAGE_FETCH_TIMEOUT), stream=True)
+
+def fetch_image(image_path, leader):
+    """Open an upstream image and stream it, or fall back to the placeholder"""
+    try:
+        public_url = supabase.storage.from_(STORAGE_BUCKET).get_public_url(image_path)
+        upstream = get_upstream_image(public_url) if public_url else None
+        if upstream is not None and upstream.status_code == 200:
+            return stream_image(image_path, upstream, leader)
+        if upstream is not None:
+            upstream.close()
+    except Exception:
+        if leader:
+            image_cache.release(image_path)
+        raise
+    if leader:
+        image_cache.release(image_path)
+    return send_file('static/placeholder.png')
+
+def download_image(image_path):
+    """Download an original image into the cache without streaming it anywhere"""
+    public_url = supabase.storage.from_(STORAGE_BUCKET).get_public_url(image_path)
+    if not public_url:
+        return None
+    upstream = get_upstream_image(public_url)
+    try:
+        if upstream.status_code != 200:
+            return None
+        digest = hashlib.sha1()
+        received = 0
+        with image_cache.temp_file() as temp:
+            for chunk in upstream.iter_content(IMAGE_CHUNK_SIZE):
+                temp.write(chunk)
+                digest.update(chunk)
+                received += len(chunk)
+        metrics.inc('upstream_bytes_total', IMAGE_UPSTREAM_LABELS, received)
+        return image_cache.store(
+            image_path, temp.name,
+            upstream.headers.get('Content-Type', 'image/jpeg'),
+            (upstream.headers.get('ETag') or '').replace('W/', '').strip('"') or digest.hexdigest(),
+            upstream.headers.get('Last-Modified') or http_date(time.time())
+        )
+    finally:
+        upstream.close()
+
+def cached_or_build(key, build):
+    """Return cache metadata for key, running build() once across concurrent callers"""
+    meta = image_cache.get(key)
+    if meta is not None:
+        return meta
+    pending = image_cache.claim(key)
+    if pending is not None:
+        pending.wait(IMAGE_FETCH_TIMEOUT)
+        return image_cache.get(key)
+    try:
+        return build()
+    finally:
+        image_cache.release(key)
+
+def render_image_variant(path, edge, pil_format):
+    """Encoded bytes of the image at path scaled to fit edge (transparency flattened onto white for JPEG)"""
+    with Image.open(path) as img:
+        img = ImageOps.exif_transpose(img)
+        img.thumbnail((edge, edge), Image.LANCZOS)
+        if pil_format == 'JPEG' and img.mode not in ('RGB', 'L'):
+            img = img.convert('RGBA')
+            background = Image.new('RGB', img.size, (255, 255, 255))
+            background.paste(img, mask=img.split()[-1])
+            img = background
+        elif img.mode not in ('RGB', 'RGBA', 'L'):
+            img = img.convert('RGBA')
+        output = io.BytesIO()
+        img.save(output, format=pil_format, quality=IMAGE_QUALITY, optimize=True)
+    return output.getvalue()
+
+def build_image_variant(image_path, key, size, image_format):
+    """Resize the cached original into a variant and cache it"""
+    original = cached_or_build(image_path, lambda: download_image(image_path))
+    if original is None:
+        return None
+    pil_format, content_type = IMAGE_VARIANT_FORMATS[image_format]
+    data = run_blocking(render_image_variant, original['file'], IMAGE_VARIANTS[size], pil_format)
+    with image_cache.temp_file() as temp:
+        temp.write(data)
+    return image_cache.store(key, temp.name, content_type, hashlib.sha1(data).hexdigest(), http_date(time.time()))
+
+def proxy_image_variant(image_path, size, requested_format):
+    """Serve a resized variant of an image, generating it on first request"""
+    image_format = requested_format
+    if requested_format == 'auto':
+        image_format = 'webp' if 'image/webp' in request.headers.get('Accept', '') else 'jpeg'
+    key = f"{image_path}@{size}.{image_format}"
+    meta = cached_or_build(key, lambda: build_image_variant(image_path, key, size, image_format))
+    if meta is None:
+        return send_file('static/placeholder.png')
+    resp = send_cached_image(meta)
+    if requested_format == 'auto':
+        resp.vary.add('Accept')
+    return resp
+
 @app.route('/api/images/<path:image_path>')
 def proxy_image(image_path):
     """Proxy images from Supabase storage"""
     if not supabase:
         return send_file('static/placeholder.png')
+    size = request.args.get('size')
+    requested_format = request.args.get('format')
+    if size or requested_format:
+        size = size or 'full'
+        requested_format = (requested_format or 'auto').lower()
+        if size not in IMAGE_VARIANTS or requested_format not in ('auto', *IMAGE_VARIANT_FORMATS):
+            return jsonify({'error': f'Unknown image size or format. Sizes: {", ".join(IMAGE_VARIANTS)}'}), 400
+        try:
+            return proxy_image_variant(image_path, size, requested_format)
+        except Exception as e:
+            logger.error(f"Error building image variant: {e}")
+            return send_file('static/placeholder.png')
     try:
-        # Get public URL
-        public_url = supabase.storage.from_(STORAGE_BUCKET).get_public_url(image_path)
-        if public_url:
-            response = requests.get(public_url, timeout=10)
-            if response.status_code == 200:
-                resp = make_response(response.content)
-                resp.headers['Content-Type'] = response.headers.get('Content-Type', 'image/jpeg')
-                resp.headers['Cache-Control'] = 'public, max-age=3600'
-                return resp
-        return send_file('static/placeholder.png')
+        meta = image_cache.get(image_path)
+        if meta is None:
+            pending = image_cache.claim(image_path)
+            if pending is None:
+                return fetch_image(image_path, leader=True)
+            # Another request is already downloading this image; wait for it
+            pending.wait(IMAGE_FETCH_TIMEOUT)
+            meta = image_cache.get(image_path)
+            if meta is None:
+                return fetch_image(image_path, leader=False)
+        return send_cached_image(meta)
     except Exception as e:
         logger.error(f"Error proxying image: {e}")
         return send_file('static/placeholder.png')
@@ -284,29 +2399,281 @@ def upload_to_supabase():
         logger.error(f"Upload error: {e}")
         return jsonify({'error': str(e)}), 500
 
+# ==================== EVENT STREAM ====================
+
+# Per-client buffer; a client that falls this far behind loses its oldest events
+EVENT_QUEUE_SIZE = int(os.environ.get('EVENT_QUEUE_SIZE', 100))
+EVENT_HEARTBEAT_SECONDS = 15
+# Streams end after this long and EventSource reconnects, so a stream never pins a worker forever
+EVENT_STREAM_MAX_SECONDS = int(os.environ.get('EVENT_STREAM_MAX_SECONDS', 300))
+
+class EventHub:
+    """In-process fan-out of server-sent events to connected dashboards"""
+
+    def __init__(self, queue_size):
+        self.queue_size = queue_size
+        self._subscribers = set()
+        self._lock = threading.Lock()
+        self._ids = itertools.count(1)
+        self.counters = {'published': 0, 'dropped': 0}
+
+    def subscribe(self):
+        subscriber = queue.Queue(maxsize=self.queue_size)
+        with self._lock:
+            self._subscribers.add(subscriber)
+        return subscriber
+
+    def unsubscribe(self, subscriber):
+        with self._lock:
+            self._subscribers.discard(subscriber)
+
+    def publish(self, event_type, data):
+        """Format an event once and hand it to every subscriber without blocking"""
+        message = f"id: {next(self._ids)}\nevent: {event_type}\ndata: {json.dumps(data, default=str)}\n\n"
+        with self._lock:
+            subscribers = list(self._subscribers)
+            self.counters['published'] += 1
+        for subscriber in subscribers:
+            while True:
+                try:
+                    subscriber.put_nowait(message)
+                    break
+                except queue.Full:
+                    try:
+                        subscriber.get_nowait()
+                        self.counters['dropped'] += 1
+                    except queue.Empty:
+                        pass
+
+    def stats(self):
+        with self._lock:
+            return {**self.counters, 'subscribers': len(self._subscribers)}
+
+event_hub = EventHub(EVENT_QUEUE_SIZE)
+
+def publish_stock_change(product, deleted=False):
+    """Tell connected dashboards that a product's stock levels changed"""
+    event_hub.publish('stock-changed', {
+        'productId': product['id'],
+        'sizes': {} if deleted else product.get('sizes', {}),
+        'totalStock': 0 if deleted else product.get('totalstock', 0),
+        'lastUpdated': product.get('lastupdated', ''),
+        'deleted': deleted
+    })
+
+@app.route('/api/events', methods=['GET'])
+def stream_events():
+    """Server-sent events: sale-created, stock-changed and notification"""
+    # EventSource cannot send headers, so the token may come in the query string
+    try:
+        if request.args.get('token'):
+            decode_token(request.args['token'])
+        else:
+            verify_jwt_in_request()
+    except Exception:
+        return jsonify({'error': 'Unauthorized'}), 401
+    
+    subscriber = event_hub.subscribe()
+    
+    def generate():
+        deadline = time.monotonic() + EVENT_STREAM_MAX_SECONDS
+        try:
+            yield "retry: 3000\n\n"
+            while time.monotonic() < deadline:
+                try:
+                    yield subscriber.get(timeout=EVENT_HEARTBEAT_SECONDS)
+                except queue.Empty:
+                    yield ": keep-alive\n\n"
+        finally:
+            event_hub.unsubscribe(subscriber)
+    
+    resp = Response(stream_with_context(generate()), mimetype='text/event-stream')
+    resp.headers['Cache-Control'] = 'no-cache'
+    resp.headers['X-Accel-Buffering'] = 'no'
+    return resp
+
+# ==================== LISTING HELPERS ====================
+
+PRODUCT_COLUMNS = [
+    'id', 'name', 'sku', 'category', 'color', 'description', 'sizes', 'buyprice', 'minsellprice',
+    'maxsellprice', 'price', 'totalstock', 'dateadded', 'lastupdated', 'image_path', 'storage', 'createdby'
+]
+SALE_COLUMNS = [
+    'id', 'productid', 'productname', 'productsku', 'category', 'buyprice', 'size', 'quantity',
+    'unitprice', 'totalamount', 'totalprofit', 'customername', 'notes', 'isbargain', 'timestamp'
+]
+
+# Database column -> (camelCase key the frontend reads, default)
+PRODUCT_ALIASES = {
+    'buyprice': ('buyPrice', 0),
+    'minsellprice': ('minSellPrice', 0),
+    'maxsellprice': ('maxSellPrice', 0),
+    'totalstock': ('totalStock', 0),
+    'dateadded': ('dateAdded', ''),
+    'lastupdated': ('lastUpdated', '')
+}
+SALE_ALIASES = {
+    'productid': ('productId', None),
+    'productname': ('productName', None),
+    'productsku': ('productSKU', None),
+    'buyprice': ('buyPrice', 0),
+    'unitprice': ('unitPrice', 0),
+    'totalamount': ('totalAmount', 0),
+    'totalprofit': ('totalProfit', 0),
+    'customername': ('customerName', ''),
+    'isbargain': ('isBargain', False)
+}
+
+PAGE_SIZE_DEFAULT = 50
+PAGE_SIZE_MAX = 500
+
+def camel_view(row, aliases, columns=None):
+    """Copy of a row with aliased columns renamed to camelCase (not duplicated)
+
+    Only the projected columns are included; aliased columns missing from the
+    row get their default.
+    """
+    view = {}
+    for column, value in row.items():
+        if columns is None or column in columns:
+            view[aliases[column][0] if column in aliases else column] = value
+    for column, (alias, default) in aliases.items():
+        if alias not in view and (columns is None or column in columns):
+            view[alias] = default
+    return view
+
+def product_view(product, columns=None):
+    """Frontend view of a product with image URLs"""
+    view = camel_view(product, PRODUCT_ALIASES, columns)
+    if product.get('image_path'):
+        view['image'] = image_url(product['image_path'])
+        view['thumbnail'] = image_url(product['image_path'], 'thumb')
+        view['cardImage'] = image_url(product['image_path'], 'card')
+    return view
+
+def sale_view(sale, columns=None):
+    """Frontend view of a sale"""
+    return camel_view(sale, SALE_ALIASES, columns)
+
+class SerializedCache:
+    """Serialized JSON list responses, reused while the source table version is unchanged"""
+
+    def __init__(self):
+        self._entries = {}
+        self._lock = threading.Lock()
+        self.counters = {'hits': 0, 'misses': 0}
+
+    def get(self, key, version):
+        with self._lock:
+            entry = self._entries.get(key)
+            if version is not None and entry and entry[0] == version:
+                self.counters['hits'] += 1
+                return entry[1]
+            self.counters['misses'] += 1
+            return None
+
+    def put(self, key, version, body):
+        with self._lock:
+            self._entries[key] = (version, body)
+
+serialized_cache = SerializedCache()
+
+def cached_table_listing(key, table_name, build):
+    """Serialized body of a full-table listing, rebuilt only when the table changes
+
+    build(rows) returns the value to serialize; rows include sales still in
+    the write-behind queue. The body is only stored when the table version
+    was the same before and after reading the rows.
+    """
+    version = table_cache.version(table_name)
+    body = serialized_cache.get(key, version)
+    if body is None:
+        def render():
+            # Queue first: an entry flushed meanwhile is briefly shown twice rather than missed
+            pending = write_queue.pending() if WRITE_BEHIND_MODE != 'off' else []
+            rendered = json_bytes(build(write_queue.overlay(table_name, get_table_data(table_name), pending)))
+            if version is not None and table_cache.version(table_name) == version:
+                serialized_cache.put(key, version, rendered)
+            return rendered
+        
+        body = single_flight.do(('listing', key, table_cache.generation(table_name)), render)
+    return body
+
+def parse_fields(columns, aliases):
+    """Parse ?fields= (database or camelCase names) into a column list, or None for all"""
+    fields = request.args.get('fields')
+    if not fields:
+        return None
+    by_alias = {alias: column for column, (alias, _) in aliases.items()}
+    if 'image_path' in columns:
+        by_alias.update({'image': 'image_path', 'imageUrl': 'image_path', 'thumbnail': 'image_path', 'cardImage': 'image_path'})
+    selected = []
+    for field in fields.split(','):
+        column = by_alias.get(field.strip(), field.strip())
+        if column not in columns:
+            raise ValueError(f'Unknown field: {field.strip()}')
+        if column not in selected:
+            selected.append(column)
+    return selected
+
+def parse_page_size():
+    """Parse ?limit= into a page size, capped at PAGE_SIZE_MAX"""
+    limit = int(request.args.get('limit', PAGE_SIZE_DEFAULT))
+    if limit < 1:
+        raise ValueError('limit must be positive')
+    return min(limit, PAGE_SIZE_MAX)
+
+def parse_date_range(column):
+    """Turn ?from=/?to= (dates or ISO timestamps, both inclusive) into filters"""
+    filters = []
+    date_from = request.args.get('from')
+    date_to = request.args.get('to')
+    if date_from:
+        filters.append(('gte', column, datetime.fromisoformat(date_from).isoformat()))
+    if date_to:
+        if len(date_to) == 10:
+            end = datetime.fromisoformat(date_to) + timedelta(days=1)
+            filters.append(('lt', column, end.isoformat()))
+        else:
+            filters.append(('lte', column, datetime.fromisoformat(date_to).isoformat()))
+    return filters
+
+def paginated_listing(table_name, all_columns, aliases, filters, view):
+    """Shared body of the paginated GET /api/products and GET /api/sales"""
+    try:
+        fields = parse_fields(all_columns, aliases)
+        limit = parse_page_size()
+        # id is needed to build the next cursor
+        columns = fields and list(dict.fromkeys(fields + ['id']))
+        rows, next_cursor = fetch_page(table_name, ','.join(columns or ['*']), filters, limit,
+                                       request.args.get('cursor'))
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    except Exception as e:
+        logger.error(f"Error listing {table_name}: {e}")
+        return jsonify({'error': str(e)}), 500
+    
+    return jsonify({'items': [view(row, fields) for row in rows], 'nextCursor': next_cursor}), 200
+
 # ==================== PRODUCT ROUTES ====================
 
 @app.route('/api/products', methods=['GET'])
 @jwt_required()
 def get_products():
-    """Get all products"""
+    """Get all products, or one page of them when limit/cursor/filters are given"""
     try:
-        products = get_table_data('products')
-        products.sort(key=lambda x: x.get('dateadded', ''), reverse=True)
+        if set(request.args) & {'limit', 'cursor', 'fields', 'category'}:
+            filters = []
+            if request.args.get('category'):
+                filters.append(('eq', 'category', request.args['category']))
+            return paginated_listing('products', PRODUCT_COLUMNS, PRODUCT_ALIASES,
+                                     filters, product_view)
         
-        # Add image URLs and convert to camelCase for frontend
-        for product in products:
-            if product.get('image_path'):
-                product['image'] = f"/api/images/{product['image_path']}"
-            # Add camelCase versions
-            product['buyPrice'] = product.get('buyprice', 0)
-            product['minSellPrice'] = product.get('minsellprice', 0)
-            product['maxSellPrice'] = product.get('maxsellprice', 0)
-            product['totalStock'] = product.get('totalstock', 0)
-            product['dateAdded'] = product.get('dateadded', '')
-            product['lastUpdated'] = product.get('lastupdated', '')
+        def build(products):
+            products.sort(key=lambda x: x['id'], reverse=True)
+            return [product_view(product) for product in products]
         
-        return jsonify(products), 200
+        return json_body(cached_table_listing('products', 'products', build))
     except Exception as e:
         logger.error(f"Error getting products: {e}")
         return jsonify([]), 200
@@ -340,14 +2707,9 @@ def create_product():
         image_path = request.form.get('image_path')
         
         # Calculate total stock
-        total_stock = 0
-        for stock in sizes.values():
-            try:
-                total_stock += int(stock) if stock and int(stock) > 0 else 0
-            except:
-                pass
+        total_stock = calculate_total_stock(sizes)
         
-        product_id = int(datetime.now().timestamp() * 1000)
+        product_id = next_record_id()
         
         # Use lowercase column names for database
         product = {
@@ -372,19 +2734,12 @@ def create_product():
         
         # Save to Supabase
         if save_table_data('products', product):
-            # Add camelCase versions for response
-            product['buyPrice'] = buy_price
-            product['minSellPrice'] = min_sell
-            product['maxSellPrice'] = max_sell
-            product['totalStock'] = total_stock
-            product['dateAdded'] = product['dateadded']
-            product['lastUpdated'] = product['lastupdated']
-            
-            if image_path:
-                product['image'] = f"/api/images/{image_path}"
+            dashboard_aggregates.product_changed(None, product)
+            catalog_index.product_changed(None, product)
+            publish_stock_change(product)
             
             logger.info(f"✓ Product created: {name}")
-            return jsonify({'success': True, 'product': product}), 201
+            return jsonify({'success': True, 'product': product_view(product)}), 201
         else:
             return jsonify({'error': 'Failed to save to Supabase'}), 500
         
@@ -395,49 +2750,39 @@ def create_product():
 @app.route('/api/products/<int:product_id>', methods=['PUT'])
 @jwt_required()
 def update_product(product_id):
-    """Update existing product"""
+    """Update existing product (only the columns sent are written)"""
     try:
         # Get existing product
-        products = get_table_data('products')
-        product = None
-        for p in products:
-            if p['id'] == product_id:
-                product = p
-                break
+        product = get_record('products', product_id)
         
         if not product:
             return jsonify({'error': 'Product not found'}), 404
         
         # Update fields
+        changes = {}
         if request.form.get('name'):
-            product['name'] = request.form['name'].strip()
+            changes['name'] = request.form['name'].strip()
         if request.form.get('category'):
-            product['category'] = request.form['category']
+            changes['category'] = request.form['category']
         if request.form.get('color'):
-            product['color'] = request.form['color']
+            changes['color'] = request.form['color']
         if request.form.get('description'):
-            product['description'] = request.form['description']
+            changes['description'] = request.form['description']
         if request.form.get('buyPrice'):
-            product['buyprice'] = float(request.form['buyPrice'])
+            changes['buyprice'] = float(request.form['buyPrice'])
         if request.form.get('minSellPrice'):
-            product['minsellprice'] = float(request.form['minSellPrice'])
+            changes['minsellprice'] = float(request.form['minSellPrice'])
         if request.form.get('maxSellPrice'):
-            product['maxsellprice'] = float(request.form['maxSellPrice'])
-            product['price'] = float(request.form['maxSellPrice'])
+            changes['maxsellprice'] = float(request.form['maxSellPrice'])
+            changes['price'] = float(request.form['maxSellPrice'])
         
-        # Update sizes
+        # Update sizes (stock is only written when the request sets it, so
+        # sales recorded meanwhile are not overwritten)
         if request.form.get('sizes'):
             try:
                 sizes = json.loads(request.form['sizes'])
-                product['sizes'] = sizes
-                
-                total_stock = 0
-                for stock in sizes.values():
-                    try:
-                        total_stock += int(stock) if stock and int(stock) > 0 else 0
-                    except:
-                        pass
-                product['totalstock'] = total_stock
+                changes['sizes'] = sizes
+                changes['totalstock'] = calculate_total_stock(sizes)
             except:
                 pass
         
@@ -446,124 +2791,749 @@ def update_product(product_id):
             # Delete old image if exists
             if product.get('image_path'):
                 delete_from_supabase_storage(product['image_path'])
-            product['image_path'] = request.form['image_path']
+            changes['image_path'] = request.form['image_path']
         
-        product['lastupdated'] = datetime.now().isoformat()
+        changes['lastupdated'] = datetime.now().isoformat()
         
         # Save to Supabase
-        if save_table_data('products', product):
-            # Add camelCase for response
-            product['buyPrice'] = product.get('buyprice', 0)
-            product['minSellPrice'] = product.get('minsellprice', 0)
-            product['maxSellPrice'] = product.get('maxsellprice', 0)
-            product['totalStock'] = product.get('totalstock', 0)
-            product['dateAdded'] = product.get('dateadded', '')
-            product['lastUpdated'] = product.get('lastupdated', '')
-            
-            if product.get('image_path'):
-                product['image'] = f"/api/images/{product['image_path']}"
+        updated = update_table_data('products', product_id, changes)
+        if updated:
+            # Show stock still held by queued sales, as reads do
+            previous, updated = write_queue.overlay('products', [product, _copy_row(updated)])
+            dashboard_aggregates.product_changed(previous, updated)
+            catalog_index.product_changed(previous, updated)
+            publish_stock_change(updated)
             
-            return jsonify({'success': True, 'product': product}), 200
+            return jsonify({'success': True, 'product': product_view(updated)}), 200
+        else:
+            return jsonify({'error': 'Failed to save to Supabase'}), 500
+        
+    except Exception as e:
+        logger.error(f"Error updating product: {e}")
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/api/products/<int:product_id>', methods=['DELETE'])
+@jwt_required()
+def delete_product(product_id):
+    """Delete product"""
+    try:
+        # Get product to find image path
+        product = get_record('products', product_id)
+        
+        if not product:
+            return jsonify({'error': 'Product not found'}), 404
+        
+        # Delete image from storage if exists
+        if product.get('image_path'):
+            delete_from_supabase_storage(product['image_path'])
+        
+        # Delete from database
+        if delete_table_data('products', product_id):
+            record_tombstone('products', product_id)
+            # The aggregates count stock held by queued sales too
+            write_queue.overlay('products', [product])
+            dashboard_aggregates.product_changed(product, None)
+            catalog_index.product_changed(product, None)
+            publish_stock_change(product, deleted=True)
+            return jsonify({'success': True}), 200
+        else:
+            return jsonify({'error': 'Failed to delete from Supabase'}), 500
+        
+    except Exception as e:
+        logger.error(f"Error deleting product: {e}")
+        return jsonify({'error': str(e)}), 500
+
+# ==================== BULK IMPORT ====================
+
+IMPORT_BATCH_SIZE = int(os.environ.get('IMPORT_BATCH_SIZE', 500))
+IMPORT_MAX_ERRORS = 1000
+
+def parse_import_sizes(value):
+    """Sizes from JSON ({"40": 5}) or CSV-friendly "40:5;41:3" text"""
+    if isinstance(value, dict):
+        sizes = value
+    elif not value or not str(value).strip():
+        sizes = {}
+    elif str(value).strip().startswith('{'):
+        sizes = json.loads(value)
+    else:
+        sizes = {}
+        for part in str(value).replace('|', ';').split(';'):
+            if part.strip():
+                size, _, stock = part.partition(':')
+                sizes[size.strip()] = stock.strip()
+    parsed = {}
+    for size, stock in sizes.items():
+        stock = int(float(stock or 0))
+        if stock < 0:
+            raise ValueError(f'Negative stock for size {size}')
+        parsed[str(size).strip()] = stock
+    return parsed
+
+def import_field(row, *names, default=None):
+    """First non-empty value among camelCase/lowercase column spellings"""
+    for name in names:
+        value = row.get(name)
+        if value is not None and str(value).strip() != '':
+            return value.strip() if isinstance(value, str) else value
+    return default
+
+def build_import_product(row, existing, now, user_id):
+    """Validate one import row and turn it into a products record
+
+    For an existing SKU, columns that are absent or empty keep the product's
+    current values, and the price checks run on the merged result. Stock
+    (sizes, totalstock) is only touched when the row gives sizes.
+    """
+    current = existing or {}
+    name = import_field(row, 'name', default=current.get('name'))
+    if not name:
+        raise ValueError('Product name required')
+    buy_price = float(import_field(row, 'buyPrice', 'buyprice', default=current.get('buyprice') or 0))
+    min_sell = float(import_field(row, 'minSellPrice', 'minsellprice', default=current.get('minsellprice') or 0))
+    max_sell = float(import_field(row, 'maxSellPrice', 'maxsellprice', 'price',
+                                  default=current.get('maxsellprice') or current.get('price') or 0))
+    if not all(math.isfinite(price) for price in (buy_price, min_sell, max_sell)):
+        raise ValueError('Prices must be finite numbers')
+    if min(buy_price, min_sell, max_sell) < 0:
+        raise ValueError('Prices cannot be negative')
+    if min_sell and max_sell and min_sell > max_sell:
+        raise ValueError('minSellPrice is above maxSellPrice')
+    if max_sell and buy_price > max_sell:
+        raise ValueError('maxSellPrice is below buyPrice')
+    sizes = import_field(row, 'sizes')
+    
+    product = dict(existing) if existing else {
+        'id': next_record_id(),
+        'dateadded': now,
+        'storage': 'supabase',
+        'createdby': user_id
+    }
+    product.update({
+        'name': str(name).strip(),
+        'sku': import_field(row, 'sku', default=None) or product.get('sku') or f"KS-{uuid.uuid4().hex[:8].upper()}",
+        'category': import_field(row, 'category', default=product.get('category', 'Uncategorized')),
+        'color': import_field(row, 'color', default=product.get('color', '')),
+        'description': import_field(row, 'description', default=product.get('description', '')),
+        'buyprice': buy_price,
+        'minsellprice': min_sell,
+        'maxsellprice': max_sell,
+        'price': max_sell,
+        'lastupdated': now,
+        'image_path': import_field(row, 'image_path', 'imagePath', default=product.get('image_path'))
+    })
+    if sizes is not None or not existing:
+        sizes = parse_import_sizes(sizes)
+        product.update({'sizes': sizes, 'totalstock': calculate_total_stock(sizes)})
+    return product
+
+def import_changes(product, existing):
+    """Columns of an import row to write: all of a new product, the changed ones of an existing one"""
+    if not existing:
+        return product
+    return {column: value for column, value in product.items()
+            if column == 'id' or existing.get(column) != value}
+
+def read_import_rows(upload):
+    """Yield (row_number, dict) from a CSV, JSON array or NDJSON upload without buffering CSV/NDJSON"""
+    filename = (upload.filename or '').lower()
+    if filename.endswith('.json'):
+        rows = json.load(upload.stream)
+        if not isinstance(rows, list):
+            raise ValueError('JSON import must be an array of products')
+        yield from enumerate(rows, start=1)
+    elif filename.endswith(('.ndjson', '.jsonl')):
+        for number, line in enumerate(io.TextIOWrapper(upload.stream, encoding='utf-8'), start=1):
+            if line.strip():
+                yield number, json.loads(line)
+    else:
+        reader = csv.DictReader(io.TextIOWrapper(upload.stream, encoding='utf-8-sig', newline=''))
+        # Row 1 is the header line
+        yield from enumerate(reader, start=2)
+
+@app.route('/api/products/import', methods=['POST'])
+@jwt_required()
+def import_products():
+    """Bulk create/update products from a CSV, JSON or NDJSON file (matched on SKU)"""
+    if 'file' in request.files:
+        rows = read_import_rows(request.files['file'])
+    elif request.is_json and isinstance(request.get_json(silent=True), list):
+        rows = enumerate(request.get_json(), start=1)
+    else:
+        return jsonify({'error': 'Upload a file field (CSV, JSON or NDJSON) or POST a JSON array'}), 400
+    dry_run = request.args.get('dryRun', '').lower() in ('1', 'true', 'yes')
+    
+    seen_skus = set()
+    now = datetime.now().isoformat()
+    user_id = get_jwt_identity()
+    report = {'created': 0, 'updated': 0, 'failed': 0, 'errors': []}
+    batch = []
+    
+    def fail(number, sku, message):
+        report['failed'] += 1
+        if len(report['errors']) < IMPORT_MAX_ERRORS:
+            report['errors'].append({'row': number, 'sku': sku, 'error': message})
+    
+    def flush():
+        if not batch:
+            return
+        # Straight from Supabase (not the cache, which can miss SKUs other workers
+        # just created); select_rows raises, so a failed lookup never turns
+        # updates into duplicate products
+        skus = [str(sku) for _, _, sku in batch if sku]
+        existing_by_sku = {
+            product['sku']: product for product in select_rows('products', filters=[('in_', 'sku', skus)])
+        } if skus else {}
+        entries = []
+        for number, row, sku in batch:
+            previous = existing_by_sku.get(str(sku)) if sku else None
+            try:
+                entries.append((number, build_import_product(row, previous, now, user_id), previous))
+            except (ValueError, TypeError) as e:
+                fail(number, sku, str(e))
+        batch.clear()
+        # One upsert per set of columns: a bulk upsert sends every column for
+        # every row, which would overwrite the columns a row leaves unchanged
+        groups = {}
+        for entry in entries:
+            changes = import_changes(entry[1], entry[2])
+            groups.setdefault(tuple(sorted(changes)), []).append((entry, changes))
+        for group in groups.values():
+            if dry_run or save_table_data('products', [changes for _, changes in group]):
+                for (_, product, previous), _ in group:
+                    report['updated' if previous else 'created'] += 1
+                    if not dry_run:
+                        dashboard_aggregates.product_changed(previous, product)
+                        catalog_index.product_changed(previous, product)
+            else:
+                for (number, product, _), _ in group:
+                    fail(number, product.get('sku'), 'Failed to save to Supabase')
+    
+    try:
+        try:
+            for number, row in rows:
+                sku = None
+                try:
+                    if not isinstance(row, dict):
+                        raise ValueError('Row must be an object')
+                    sku = import_field(row, 'sku')
+                    if sku and sku in seen_skus:
+                        raise ValueError('Duplicate SKU in this file')
+                except (ValueError, TypeError) as e:
+                    fail(number, sku, str(e))
+                    continue
+                if sku:
+                    seen_skus.add(sku)
+                batch.append((number, row, sku))
+                if len(batch) >= IMPORT_BATCH_SIZE:
+                    flush()
+            flush()
+        except (ValueError, UnicodeDecodeError, csv.Error) as e:
+            flush()
+            return jsonify({'error': f'Could not read import file: {e}', **report}), 400
+    except Exception as e:
+        # Rows already reported as created/updated are saved; the rest are not
+        logger.error(f"Product import aborted, could not look up existing SKUs: {e}")
+        status = 503 if isinstance(e, SupabaseUnavailable) else 500
+        return jsonify({'error': f'Could not look up existing products, import stopped: {e}', **report}), status
+    
+    if not dry_run and report['created'] + report['updated']:
+        event_hub.publish('products-imported', {'created': report['created'], 'updated': report['updated']})
+    logger.info(f"✓ Product import: {report['created']} created, {report['updated']} updated, {report['failed']} failed")
+    return jsonify({'success': report['failed'] == 0, 'dryRun': dry_run, **report}), 200
+
+# ==================== HTTP CACHING ====================
+
+# Cache-Control per public route group, overridable per deployment so a CDN
+# or shared cache in front of the app can absorb storefront traffic
+CACHE_CONTROL = {
+    'index': os.environ.get('CACHE_CONTROL_INDEX', 'public, no-cache'),
+    'static': os.environ.get('CACHE_CONTROL_STATIC', 'public, max-age=86400, stale-while-revalidate=604800'),
+    'catalog': os.environ.get('CACHE_CONTROL_CATALOG', 'public, max-age=30, stale-while-revalidate=300')
+}
+
+_file_etags = {}
+# Version ETags only mean something within the process that issued them
+_version_etag_salt = uuid.uuid4().hex
+
+def content_etag(data):
+    """Strong ETag for a body, identical on every worker and instance"""
+    return hashlib.sha256(data).hexdigest()[:32]
+
+def version_etag(*version):
+    """Strong ETag for a body derived from in-memory state, without hashing the body
+
+    Read the version before producing the body, so the body is never older
+    than its tag. Unlike content_etag, it differs between workers.
+    """
+    return content_etag(repr((_version_etag_salt, version)).encode())
+
+def file_etag(path):
+    """Content ETag of a file, rehashed only when its size or mtime changes"""
+    stat = os.stat(path)
+    version = (stat.st_mtime_ns, stat.st_size)
+    cached = _file_etags.get(path)
+    if cached and cached[0] == version:
+        return cached[1]
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(65536), b''):
+            digest.update(chunk)
+    etag = digest.hexdigest()[:32]
+    _file_etags[path] = (version, etag)
+    return etag
+
+def cacheable(response, policy, etag=None):
+    """Apply a route's Cache-Control policy and strong ETag; 304 when If-None-Match matches"""
+    response.set_etag(etag or content_etag(response.get_data()))
+    response.headers['Cache-Control'] = CACHE_CONTROL[policy]
+    return response.make_conditional(request)
+
+# ==================== ASSET PIPELINE ====================
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+# Text assets up to this size are minified and precompressed in memory;
+# anything else is streamed from disk by send_file
+ASSET_MAX_BYTES = int(os.environ.get('ASSET_MAX_BYTES', 2 * 1024 * 1024))
+ASSET_MINIFY = os.environ.get('ASSET_MINIFY', '1') != '0'
+ASSET_COMPRESSIBLE_TYPES = ('text/', 'application/javascript', 'application/json', 'image/svg+xml')
+
+_assets = {}
+_assets_lock = threading.Lock()
+
+def minify_css(text):
+    """Drop comments, indentation and blank lines"""
+    text = re.sub(r'/\*.*?\*/', '', text, flags=re.S)
+    return '\n'.join(line.strip() for line in text.splitlines() if line.strip())
+
+def minify_js(text):
+    """Drop indentation, blank lines and whole-line // comments (line breaks are kept for ASI)"""
+    lines = (line.strip() for line in text.splitlines())
+    return '\n'.join(line for line in lines if line and not line.startswith('//'))
+
+def minify_html(text):
+    """Conservative minifier for the inline-everything frontend"""
+    parts = re.split(r'(<(script|style)\b[^>]*>.*?</\2>)', text, flags=re.S | re.I)
+    output = []
+    for index, part in enumerate(parts):
+        if index % 3 == 2:
+            continue  # tag name captured by the inner group
+        if index % 3 == 1:
+            open_end = part.index('>') + 1
+            close_start = part.rindex('<')
+            minify = minify_css if part[1:6].lower() == 'style' else minify_js
+            output.append(part[:open_end] + minify(part[open_end:close_start]) + part[close_start:])
         else:
-            return jsonify({'error': 'Failed to save to Supabase'}), 500
-        
-    except Exception as e:
-        logger.error(f"Error updating product: {e}")
-        return jsonify({'error': str(e)}), 500
+            part = re.sub(r'<!--.*?-->', '', part, flags=re.S)
+            output.append('\n'.join(line.strip() for line in part.splitlines() if line.strip()))
+    return '\n'.join(piece for piece in output if piece)
 
-@app.route('/api/products/<int:product_id>', methods=['DELETE'])
-@jwt_required()
-def delete_product(product_id):
-    """Delete product"""
+ASSET_MINIFIERS = {'.html': minify_html, '.css': minify_css, '.js': minify_js}
+
+def build_asset(path, content_type):
+    """Read, minify and precompress one asset; ETags are content hashes per encoding"""
+    with open(path, 'rb') as f:
+        data = f.read()
+    minify = ASSET_MINIFIERS.get(os.path.splitext(path)[1].lower())
+    if ASSET_MINIFY and minify:
+        data = minify(data.decode('utf-8')).encode('utf-8')
+    etag = content_etag(data)
+    variants = {'identity': (data, etag)}
+    compressed = {'gzip': gzip.compress(data, 9)}
+    if brotli:
+        compressed['br'] = brotli.compress(data, quality=11)
+    for encoding, body in compressed.items():
+        if len(body) < len(data):
+            variants[encoding] = (body, f"{etag}-{encoding}")
+    sizes = ', '.join(f"{name} {len(body)}" for name, (body, _) in variants.items())
+    logger.info(f"✓ Built asset {path}: {sizes} bytes")
+    return {'content_type': content_type, 'variants': variants}
+
+def load_asset(path):
+    """Built asset for path, rebuilt when the file changes; None if it is not worth precompressing"""
+    content_type = mimetypes.guess_type(path)[0] or 'application/octet-stream'
+    stat = os.stat(path)
+    if not content_type.startswith(ASSET_COMPRESSIBLE_TYPES) or stat.st_size > ASSET_MAX_BYTES:
+        return None
+    version = (stat.st_mtime_ns, stat.st_size)
+    with _assets_lock:
+        cached = _assets.get(path)
+        if cached is None or cached['version'] != version:
+            cached = _assets[path] = {**build_asset(path, content_type), 'version': version}
+        return cached
+
+def send_asset(asset, policy):
+    """Serve the best precompressed variant the client accepts, with no per-request compression"""
+    encoding = 'identity'
+    for candidate in ('br', 'gzip'):
+        if candidate in asset['variants'] and request.accept_encodings[candidate]:
+            encoding = candidate
+            break
+    body, etag = asset['variants'][encoding]
+    response = Response(body, mimetype=asset['content_type'])
+    if encoding != 'identity':
+        response.headers['Content-Encoding'] = encoding
+    response.vary.add('Accept-Encoding')
+    return cacheable(response, policy, etag)
+
+def warm_assets():
     try:
-        # Get product to find image path
-        products = get_table_data('products')
-        product = None
-        for p in products:
-            if p['id'] == product_id:
-                product = p
-                break
-        
-        if not product:
-            return jsonify({'error': 'Product not found'}), 404
-        
-        # Delete image from storage if exists
-        if product.get('image_path'):
-            delete_from_supabase_storage(product['image_path'])
-        
-        # Delete from database
-        if delete_table_data('products', product_id):
-            return jsonify({'success': True}), 200
-        else:
-            return jsonify({'error': 'Failed to delete from Supabase'}), 500
-        
+        load_asset('index.html')
     except Exception as e:
-        logger.error(f"Error deleting product: {e}")
-        return jsonify({'error': str(e)}), 500
+        logger.error(f"✗ Failed to build index.html: {e}")
+
+# Build the frontend in the background at startup so neither worker boot nor
+# the first visitor waits for minifying and compressing it
+if os.path.exists('index.html'):
+    threading.Thread(target=warm_assets, name='asset-warmup', daemon=True).start()
 
 # ==================== PUBLIC PRODUCTS ====================
 
+def public_product(product):
+    """Shopper-safe view of a product (no buy price, stock per size only)"""
+    public = {
+        'id': product['id'],
+        'name': product['name'],
+        'sku': product.get('sku', ''),
+        'category': product.get('category', ''),
+        'color': product.get('color', ''),
+        'description': product.get('description', ''),
+        'price': product.get('price', 0),
+        'totalStock': product.get('totalstock', 0),
+        'sizes': product.get('sizes', {})
+    }
+    
+    if product.get('image_path'):
+        public['image'] = image_url(product['image_path'])
+        public['imageUrl'] = image_url(product['image_path'])
+        public['thumbnail'] = image_url(product['image_path'], 'thumb')
+        public['cardImage'] = image_url(product['image_path'], 'card')
+    else:
+        public['image'] = '/static/placeholder.png'
+    return public
+
 @app.route('/api/public/products', methods=['GET'])
 def get_public_products():
     """Public endpoint for products (no auth required)"""
     try:
-        products = get_table_data('products')
-        products.sort(key=lambda x: x.get('dateadded', ''), reverse=True)
-        
-        # Remove sensitive data
-        public_products = []
-        for product in products:
-            public_product = {
-                'id': product['id'],
-                'name': product['name'],
-                'sku': product.get('sku', ''),
-                'category': product.get('category', ''),
-                'color': product.get('color', ''),
-                'description': product.get('description', ''),
-                'price': product.get('price', 0),
-                'totalStock': product.get('totalstock', 0),
-                'sizes': product.get('sizes', {})
-            }
-            
-            if product.get('image_path'):
-                public_product['image'] = f"/api/images/{product['image_path']}"
-                public_product['imageUrl'] = f"/api/images/{product['image_path']}"
-            else:
-                public_product['image'] = '/static/placeholder.png'
-            
-            public_products.append(public_product)
+        def build(products):
+            products.sort(key=lambda x: x['id'], reverse=True)
+            # Remove sensitive data
+            return [public_product(product) for product in products]
         
-        return jsonify(public_products), 200
+        version = table_cache.version('products')
+        body = cached_table_listing('public-products', 'products', build)
+        return cacheable(json_body(body), 'catalog', version_etag('public-products', version) if version else None)
         
     except Exception as e:
         logger.error(f"Error getting public products: {e}")
         return jsonify([]), 200
 
+# ==================== CATALOG SEARCH ====================
+
+CATALOG_INDEX_RECONCILE_SECONDS = int(os.environ.get('CATALOG_INDEX_RECONCILE_SECONDS', 600))
+# Fields that feed the inverted index, with their ranking weight
+CATALOG_SEARCH_FIELDS = {'name': 3, 'sku': 3, 'category': 2, 'color': 2, 'description': 1}
+# Shortest query term that is matched with one typo allowed
+CATALOG_FUZZY_MIN_LENGTH = 4
+
+def search_tokens(text):
+    """Lowercase alphanumeric words of a field value"""
+    return re.findall(r'[a-z0-9]+', str(text or '').lower())
+
+def token_deletes(token):
+    """Every variant of token with one character removed (symmetric-delete typo matching)"""
+    return {token[:i] + token[i + 1:] for i in range(len(token))}
+
+def product_price(product):
+    try:
+        return float(product.get('price') or 0)
+    except (TypeError, ValueError):
+        return 0.0
+
+class CatalogIndex(Reconciled):
+    """In-memory inverted index and facet source behind /api/public/products/search"""
+
+    name = 'catalog index'
+
+    def __init__(self, reconcile_seconds):
+        super().__init__(reconcile_seconds)
+        # Product changes made while a rebuild reads the table, replayed onto its result
+        self._changes = None
+        self.docs = {}
+        self.postings = {}
+        self.tokens = []
+        self.deletes = {}
+        self.queries = 0
+        # Bumped on every change and rebuild; identifies the results for ETags
+        self.version = 0
+
+    def _add(self, product):
+        weights = {}
+        for field, weight in CATALOG_SEARCH_FIELDS.items():
+            for token in search_tokens(product.get(field)):
+                weights[token] = max(weights.get(token, 0), weight)
+        sizes = product.get('sizes') or {}
+        self.docs[product['id']] = {
+            'id': product['id'],
+            'product': public_product(product),
+            'tokens': weights,
+            'category': product.get('category') or '',
+            'color': product.get('color') or '',
+            'category_key': (product.get('category') or '').lower(),
+            'color_key': (product.get('color') or '').lower(),
+            'sizes': sorted(str(size) for size, stock in sizes.items() if stock_level(stock) > 0),
+            'price': product_price(product)
+        }
+        for token, weight in weights.items():
+            postings = self.postings.get(token)
+            if postings is None:
+                postings = self.postings[token] = {}
+                bisect.insort(self.tokens, token)
+                for variant in token_deletes(token):
+                    self.deletes.setdefault(variant, set()).add(token)
+            postings[product['id']] = weight
+
+    def _remove(self, product_id):
+        doc = self.docs.pop(product_id, None)
+        if doc is None:
+            return
+        for token in doc['tokens']:
+            postings = self.postings[token]
+            postings.pop(product_id, None)
+            if not postings:
+                del self.postings[token]
+                del self.tokens[bisect.bisect_left(self.tokens, token)]
+                for variant in token_deletes(token):
+                    self.deletes[variant].discard(token)
+                    if not self.deletes[variant]:
+                        del self.deletes[variant]
+
+    def rebuild(self):
+        """Re-index every product from the products table
+
+        Builds a new index without holding the lock, so searches and product
+        changes carry on meanwhile; changes made during the read are replayed
+        onto it before it is swapped in. Raises if Supabase cannot be read,
+        leaving the current index untouched.
+        """
+        with self._build_lock:
+            with self._lock:
+                self._changes = []
+            try:
+                products = write_queue.overlay('products', select_rows('products'))
+            except Exception:
+                with self._lock:
+                    self._changes = None
+                raise
+
+            fresh = CatalogIndex(self.reconcile_seconds)
+            for product in products:
+                fresh._add(product)
+            with self._lock:
+                for old, new in self._changes:
+                    fresh._apply(old, new)
+                self._changes = None
+                self.docs = fresh.docs
+                self.postings = fresh.postings
+                self.tokens = fresh.tokens
+                self.deletes = fresh.deletes
+                self.version += 1
+                self._built_at = time.monotonic()
+            logger.info(f"Rebuilt catalog index: {len(fresh.docs)} products, {len(fresh.tokens)} terms")
+
+    def _apply(self, old, new):
+        if old is not None:
+            self._remove(old['id'])
+        if new is not None:
+            self._remove(new['id'])
+            self._add(new)
+
+    def product_changed(self, old, new):
+        """Apply a product create (old=None), update or delete (new=None)"""
+        with self._lock:
+            if self._changes is not None:
+                self._changes.append((old, new))
+            if self._built_at is not None:
+                self._apply(old, new)
+                self.version += 1
+
+    def _match_term(self, term):
+        """{product_id: score} for one query term: exact > prefix > one typo"""
+        scores = {}
+        start = bisect.bisect_left(self.tokens, term)
+        for token in itertools.islice(self.tokens, start, None):
+            if not token.startswith(term):
+                break
+            quality = 3 if token == term else 2
+            for product_id, weight in self.postings[token].items():
+                scores[product_id] = max(scores.get(product_id, 0), quality * weight)
+        if len(term) >= CATALOG_FUZZY_MIN_LENGTH:
+            # A token within one edit shares the term itself or one of its one-deletion variants
+            candidates = set(self.deletes.get(term, ()))
+            for variant in token_deletes(term) | {term}:
+                candidates.update(self.deletes.get(variant, ()))
+                if variant in self.postings:
+                    candidates.add(variant)
+            for token in candidates:
+                for product_id, weight in self.postings[token].items():
+                    scores[product_id] = max(scores.get(product_id, 0), weight)
+        return scores
+
+    def search(self, query='', category=None, color=None, size=None,
+               min_price=None, max_price=None, in_stock=False, limit=PAGE_SIZE_DEFAULT, offset=0):
+        """Ranked matches plus category/color/size facets and the price range
+
+        Each facet is counted with every other filter applied but not its own,
+        so the shopper always sees the alternatives for the current selection.
+        """
+        self.ensure_built()
+        with self._lock:
+            self.queries += 1
+            scores = None
+            for term in dict.fromkeys(search_tokens(query)):
+                term_scores = self._match_term(term)
+                if scores is None:
+                    scores = term_scores
+                else:
+                    scores = {pid: score + term_scores[pid] for pid, score in scores.items() if pid in term_scores}
+                if not scores:
+                    break
+            if scores is None:
+                scores = dict.fromkeys(self.docs, 0)
+            
+            category = category and category.lower()
+            color = color and color.lower()
+            size = size and str(size)
+            category_counts, color_counts, size_counts = {}, {}, {}
+            matches = []
+            for product_id in scores:
+                doc = self.docs[product_id]
+                if min_price is not None and doc['price'] < min_price:
+                    continue
+                if max_price is not None and doc['price'] > max_price:
+                    continue
+                if in_stock and not doc['sizes']:
+                    continue
+                category_ok = not category or doc['category_key'] == category
+                color_ok = not color or doc['color_key'] == color
+                size_ok = not size or size in doc['sizes']
+                if color_ok and size_ok:
+                    category_counts[doc['category']] = category_counts.get(doc['category'], 0) + 1
+                if category_ok and size_ok:
+                    color_counts[doc['color']] = color_counts.get(doc['color'], 0) + 1
+                if category_ok and color_ok:
+                    for doc_size in doc['sizes']:
+                        size_counts[doc_size] = size_counts.get(doc_size, 0) + 1
+                    if size_ok:
+                        matches.append(doc)
+            
+            # Only the requested page needs to be ordered
+            page = heapq.nlargest(offset + limit, matches, key=lambda doc: (scores[doc['id']], doc['id']))
+            prices = [doc['price'] for doc in matches]
+            return {
+                'items': [doc['product'] for doc in page[offset:]],
+                'total': len(matches),
+                'facets': {
+                    'category': category_counts,
+                    'color': color_counts,
+                    'size': size_counts,
+                    'price': {'min': min(prices), 'max': max(prices)} if prices else None
+                }
+            }
+
+    def stats(self):
+        with self._lock:
+            return {'products': len(self.docs), 'terms': len(self.tokens), 'queries': self.queries}
+
+catalog_index = CatalogIndex(CATALOG_INDEX_RECONCILE_SECONDS)
+
+@app.route('/api/public/products/search', methods=['GET'])
+def search_public_products():
+    """Search the public catalog (?q=, category, color, size, minPrice, maxPrice, inStock) with facets"""
+    started = time.perf_counter()
+    try:
+        min_price = request.args.get('minPrice')
+        max_price = request.args.get('maxPrice')
+        offset = int(request.args.get('offset', 0))
+        if offset < 0:
+            raise ValueError('offset must not be negative')
+        version = catalog_index.version
+        result = catalog_index.search(
+            request.args.get('q', ''),
+            category=request.args.get('category'),
+            color=request.args.get('color'),
+            size=request.args.get('size'),
+            min_price=float(min_price) if min_price else None,
+            max_price=float(max_price) if max_price else None,
+            in_stock=request.args.get('inStock') in ('1', 'true'),
+            limit=parse_page_size(),
+            offset=offset
+        )
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    except Exception as e:
+        logger.error(f"Error searching products: {e}")
+        return jsonify({'error': str(e)}), 500
+    
+    # Timing goes in a header so identical results keep identical ETags
+    # The results come from the index, so its version identifies them
+    response = cacheable(jsonify(result), 'catalog', version_etag('search', version) if version else None)
+    response.headers['Server-Timing'] = f'search;dur={(time.perf_counter() - started) * 1000:.2f}'
+    return response
+
 # ==================== SALES ROUTES ====================
 
+def build_sale(sale_id, product, size_key, quantity, unit_price, customer_name, notes, is_bargain):
+    """Sale record with LOWERCASE column names to match database"""
+    total_amount = unit_price * quantity
+    total_cost = product['buyprice'] * quantity
+    return {
+        'id': sale_id,
+        'productid': product['id'],
+        'productname': product['name'],
+        'productsku': product.get('sku', ''),
+        'category': product.get('category', ''),
+        'buyprice': float(product['buyprice']),
+        'size': size_key,
+        'quantity': int(quantity),
+        'unitprice': float(unit_price),
+        'totalamount': float(total_amount),
+        'totalprofit': float(total_amount - total_cost),
+        'customername': customer_name,
+        'notes': notes,
+        'isbargain': bool(is_bargain),
+        'timestamp': datetime.now().isoformat()
+    }
+
 @app.route('/api/sales', methods=['GET'])
 @jwt_required()
 def get_sales():
-    """Get all sales"""
+    """Get all sales, or one page of them when limit/cursor/filters are given"""
     try:
-        sales = get_table_data('sales')
-        # Sort by timestamp descending (newest first)
-        sales.sort(key=lambda x: x.get('timestamp', ''), reverse=True)
+        if set(request.args) & {'limit', 'cursor', 'fields', 'category', 'productId', 'from', 'to'}:
+            try:
+                filters = parse_date_range('timestamp')
+            except ValueError:
+                return jsonify({'error': 'from/to must be ISO dates'}), 400
+            if request.args.get('category'):
+                filters.append(('eq', 'category', request.args['category']))
+            if request.args.get('productId'):
+                filters.append(('eq', 'productid', request.args['productId']))
+            return paginated_listing('sales', SALE_COLUMNS, SALE_ALIASES,
+                                     filters, sale_view)
         
-        # Convert to camelCase for frontend
-        for sale in sales:
-            sale['productId'] = sale.get('productid')
-            sale['productName'] = sale.get('productname')
-            sale['productSKU'] = sale.get('productsku')
-            sale['buyPrice'] = sale.get('buyprice', 0)
-            sale['unitPrice'] = sale.get('unitprice', 0)
-            sale['totalAmount'] = sale.get('totalamount', 0)
-            sale['totalProfit'] = sale.get('totalprofit', 0)
-            sale['customerName'] = sale.get('customername', '')
-            sale['isBargain'] = sale.get('isbargain', False)
-        
-        logger.info(f"Returning {len(sales)} sales records")
-        return jsonify(sales), 200
+        def build(sales):
+            # Ids are time-ordered, so this is newest first
+            sales.sort(key=lambda x: x['id'], reverse=True)
+            logger.info(f"Serializing {len(sales)} sales records")
+            return [sale_view(sale) for sale in sales]
+        
+        return json_body(cached_table_listing('sales', 'sales', build))
     except Exception as e:
         logger.error(f"Error getting sales: {e}")
         return jsonify([]), 200
@@ -591,19 +3561,14 @@ def create_sale():
             return jsonify({'error': f'Missing required fields: {", ".join(missing)}'}), 400
         
         # Get product
-        products = get_table_data('products')
-        product = None
-        for p in products:
-            if p['id'] == product_id:
-                product = p
-                break
+        product = get_record('products', product_id)
         
         if not product:
             return jsonify({'error': 'Product not found'}), 404
         
         logger.info(f"Found product: {product['name']}, current stock: {json.dumps(product.get('sizes', {}))}")
         
-        # Check stock
+        # Check stock (re-checked atomically when the stock is taken)
         size_key = str(size)
         if size_key not in product['sizes']:
             return jsonify({'error': f'Size {size} not available for this product'}), 400
@@ -612,94 +3577,51 @@ def create_sale():
         if current_stock < quantity:
             return jsonify({'error': f'Insufficient stock. Only {current_stock} available in size {size}'}), 400
         
-        # Update stock
-        product['sizes'][size_key] = current_stock - quantity
-        
-        # Recalculate total stock
-        total_stock = 0
-        for stock in product['sizes'].values():
-            total_stock += stock if stock > 0 else 0
-        product['totalstock'] = total_stock
-        product['lastupdated'] = datetime.now().isoformat()
-        
-        # Save updated product
-        logger.info(f"Updating product stock: new total stock = {total_stock}")
-        if not save_table_data('products', product):
-            logger.error("Failed to update product stock")
-            return jsonify({'error': 'Failed to update product stock'}), 500
-        
-        # Calculate totals
-        total_amount = unit_price * quantity
-        total_cost = product['buyprice'] * quantity
-        total_profit = total_amount - total_cost
-        
         # Get optional fields
         customer_name = data.get('customerName', 'Walk-in Customer')
         notes = data.get('notes', '')
         is_bargain = data.get('isBargain', False)
         
-        # Create sale record with LOWERCASE column names to match database
-        sale_id = int(datetime.now().timestamp() * 1000)
-        sale = {
-            'id': sale_id,
-            'productid': product_id,
-            'productname': product['name'],
-            'productsku': product.get('sku', ''),
-            'category': product.get('category', ''),
-            'buyprice': float(product['buyprice']),
-            'size': size_key,
-            'quantity': int(quantity),
-            'unitprice': float(unit_price),
-            'totalamount': float(total_amount),
-            'totalprofit': float(total_profit),
-            'customername': customer_name,
-            'notes': notes,
-            'isbargain': bool(is_bargain),
-            'timestamp': datetime.now().isoformat()
+        sale = build_sale(next_record_id(), product, size_key, quantity, unit_price, customer_name, notes, is_bargain)
+        notification = {
+            'id': next_record_id(),
+            'message': f'Sale: {product["name"]} ({quantity} × Size {size})',
+            'type': 'success',
+            'timestamp': sale['timestamp'],
+            'updated_at': sale['timestamp'],
+            'read': False
         }
         
         logger.info(f"Attempting to save sale: {json.dumps(sale, default=str)}")
         
-        # Save sale
-        if save_table_data('sales', sale):
+        # Take stock and save sale + notification
+        try:
+            updated_product, queued = submit_sale(product, size_key, quantity, sale, notification)
+        except StockError as e:
+            logger.error(f"Sale rejected: {e}")
+            return jsonify({'error': str(e)}), e.status_code
+        
+        if updated_product:
+            dashboard_aggregates.record_sale(sale)
+            report_cache.invalidate_open()
+            catalog_index.product_changed(product, updated_product)
             logger.info(f"✓ Sale recorded successfully: {product['name']} - {quantity} x Size {size} @ {unit_price}")
             
-            # Create notification
-            notification = {
-                'id': int(datetime.now().timestamp() * 1000) + 1,
-                'message': f'Sale: {product["name"]} ({quantity} × Size {size})',
-                'type': 'success',
-                'timestamp': datetime.now().isoformat(),
-                'read': False
-            }
-            save_table_data('notifications', notification)
-            
             # Prepare response with camelCase for frontend
-            response_sale = {
-                'id': sale_id,
-                'productId': product_id,
-                'productName': product['name'],
-                'productSKU': product.get('sku', ''),
-                'category': product.get('category', ''),
-                'buyPrice': float(product['buyprice']),
-                'size': size_key,
-                'quantity': int(quantity),
-                'unitPrice': float(unit_price),
-                'totalAmount': float(total_amount),
-                'totalProfit': float(total_profit),
-                'customerName': customer_name,
-                'notes': notes,
-                'isBargain': bool(is_bargain),
-                'timestamp': datetime.now().isoformat()
-            }
+            response_sale = sale_view(sale)
+            
+            event_hub.publish('sale-created', response_sale)
+            publish_stock_change(updated_product)
+            event_hub.publish('notification', notification)
             
             return jsonify({
                 'success': True,
                 'sale': response_sale,
+                'queued': queued,
                 'message': 'Sale recorded successfully'
             }), 201
         else:
-            logger.error("Failed to save sale record - save_table_data returned False")
+            logger.error("Failed to save sale record - record_sale returned no product")
             return jsonify({'error': 'Failed to save sale record'}), 500
         
     except Exception as e:
@@ -707,16 +3629,344 @@ def create_sale():
         logger.error(traceback.format_exc())
         return jsonify({'error': str(e)}), 500
 
+@app.route('/api/sales/checkout', methods=['POST'])
+@jwt_required()
+def checkout():
+    """Record a multi-line sale: every line succeeds or none do"""
+    try:
+        data = request.get_json() or {}
+        items = data.get('items')
+        if not isinstance(items, list) or not items:
+            return jsonify({'error': 'items must be a non-empty list'}), 400
+        
+        # Validate every line before touching stock
+        errors = []
+        unit_prices = []
+        for index, item in enumerate(items):
+            if not isinstance(item, dict):
+                errors.append({'line': index, 'error': 'line must be an object'})
+                continue
+            missing = [field for field in ('productId', 'size', 'quantity', 'unitPrice') if not item.get(field)]
+            if missing:
+                errors.append({'line': index, 'error': f'Missing required fields: {", ".join(missing)}'})
+            elif not str(item['quantity']).isdigit() or int(item['quantity']) <= 0:
+                errors.append({'line': index, 'error': 'quantity must be a positive whole number'})
+            else:
+                try:
+                    unit_price = float(item['unitPrice'])
+                except (TypeError, ValueError):
+                    unit_price = 0
+                if isinstance(item['unitPrice'], bool) or not math.isfinite(unit_price) or unit_price <= 0:
+                    errors.append({'line': index, 'error': 'unitPrice must be a positive number'})
+                else:
+                    unit_prices.append(unit_price)
+        if errors:
+            return jsonify({'error': 'Invalid checkout lines', 'lines': errors}), 400
+        
+        products = get_records('products', [item['productId'] for item in items])
+        changes = {}
+        for index, item in enumerate(items):
+            product = products.get(item['productId'])
+            size_key = str(item['size'])
+            if not product:
+                errors.append({'line': index, 'error': 'Product not found'})
+            elif size_key not in product.get('sizes', {}):
+                errors.append({'line': index, 'error': f'Size {size_key} not available for this product'})
+            else:
+                sizes = changes.setdefault(product['id'], {})
+                sizes[size_key] = sizes.get(size_key, 0) + int(item['quantity'])
+        for product_id, sizes in changes.items():
+            for size_key, quantity in sizes.items():
+                current_stock = products[product_id]['sizes'].get(size_key, 0)
+                if current_stock < quantity:
+                    errors.append({
+                        'productId': product_id,
+                        'error': f'Insufficient stock. Only {current_stock} available in size {size_key}'
+                    })
+        if errors:
+            return jsonify({'error': 'Checkout cannot be completed', 'lines': errors}), 400
+        
+        customer_name = data.get('customerName', 'Walk-in Customer')
+        notes = data.get('notes', '')
+        sales = [
+            build_sale(next_record_id(), products[item['productId']], str(item['size']), int(item['quantity']),
+                       unit_price, customer_name, item.get('notes', notes), item.get('isBargain', False))
+            for item, unit_price in zip(items, unit_prices)
+        ]
+        total_items = sum(sale['quantity'] for sale in sales)
+        total_amount = sum(sale['totalamount'] for sale in sales)
+        notification = {
+            'id': next_record_id(),
+            'message': f'Sale: {total_items} item(s) across {len(sales)} line(s) for KSh {total_amount:,.0f}',
+            'type': 'success',
+            'timestamp': sales[0]['timestamp'],
+            'updated_at': sales[0]['timestamp'],
+            'read': False
+        }
+        
+        try:
+            updated_products, queued = submit_checkout(products, changes, sales, notification)
+        except StockError as e:
+            logger.error(f"Checkout rejected: {e}")
+            return jsonify({'error': str(e)}), e.status_code
+        
+        for sale in sales:
+            dashboard_aggregates.record_sale(sale)
+        for updated in updated_products:
+            catalog_index.product_changed(products[updated['id']], updated)
+            publish_stock_change(updated)
+        report_cache.invalidate_open()
+        
+        response_sales = [sale_view(sale) for sale in sales]
+        for response_sale in response_sales:
+            event_hub.publish('sale-created', response_sale)
+        event_hub.publish('notification', notification)
+        logger.info(f"✓ Checkout recorded: {len(sales)} lines, {total_items} items, {total_amount}")
+        
+        return jsonify({
+            'success': True,
+            'sales': response_sales,
+            'totalAmount': total_amount,
+            'totalProfit': sum(sale['totalprofit'] for sale in sales),
+            'totalItems': total_items,
+            'queued': queued,
+            'message': 'Checkout recorded successfully'
+        }), 201
+        
+    except Exception as e:
+        logger.error(f"Error during checkout: {e}")
+        logger.error(traceback.format_exc())
+        return jsonify({'error': str(e)}), 500
+
+# ==================== SALES EXPORT ====================
+
+EXPORT_BATCH_SIZE = int(os.environ.get('EXPORT_BATCH_SIZE', 1000))
+EXPORT_FORMATS = {
+    'csv': ('text/csv', 'csv'),
+    'ndjson': ('application/x-ndjson', 'ndjson')
+}
+
+EXPORT_HEADER = [SALE_ALIASES.get(column, (column,))[0] for column in SALE_COLUMNS]
+
+def export_sale_row(sale):
+    """camelCase export row; tolerates older rows missing newer columns"""
+    return {
+        SALE_ALIASES.get(column, (column,))[0]: sale.get(column, SALE_ALIASES.get(column, (None, None))[1])
+        for column in SALE_COLUMNS
+    }
+
+def iter_export_batches(filters):
+    """Yield sales newest first, one keyset page of EXPORT_BATCH_SIZE at a time
+
+    A failed page raises out of the generator, so a streamed export is cut
+    off mid-body rather than ending cleanly as if it were complete.
+    """
+    cursor = None
+    while True:
+        try:
+            rows, cursor = fetch_page('sales', ','.join(SALE_COLUMNS), filters, EXPORT_BATCH_SIZE, cursor)
+        except Exception as e:
+            logger.error(f"✗ Sales export aborted: {e}")
+            raise
+        if rows:
+            yield [export_sale_row(sale) for sale in rows]
+        if not cursor:
+            return
+
+def iter_export_chunks(batches, export_format):
+    """Encode each batch as CSV or NDJSON text; only one batch is held at a time"""
+    if export_format == 'csv':
+        header = io.StringIO()
+        csv.writer(header).writerow(EXPORT_HEADER)
+        yield header.getvalue()
+    for batch in batches:
+        if export_format == 'csv':
+            buffer = io.StringIO()
+            writer = csv.writer(buffer)
+            for row in batch:
+                writer.writerow(row.values())
+            yield buffer.getvalue()
+        else:
+            yield ''.join(json.dumps(row) + '\n' for row in batch)
+
+def gzip_chunks(chunks):
+    """Stream-compress text chunks into a single gzip member"""
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 31)
+    for chunk in chunks:
+        data = compressor.compress(chunk.encode('utf-8'))
+        if data:
+            yield data
+    yield compressor.flush()
+
+@app.route('/api/sales/export', methods=['GET'])
+@jwt_required()
+def export_sales():
+    """Stream sales for ?from=/?to= as CSV or NDJSON (?format=), optionally gzipped (?gzip=1)"""
+    export_format = request.args.get('format', 'csv').lower()
+    if export_format not in EXPORT_FORMATS:
+        return jsonify({'error': f'format must be one of: {", ".join(EXPORT_FORMATS)}'}), 400
+    try:
+        filters = parse_date_range('timestamp')
+    except ValueError:
+        return jsonify({'error': 'from/to must be ISO dates'}), 400
+    
+    mimetype, extension = EXPORT_FORMATS[export_format]
+    filename = f"sales-{request.args.get('from', 'all')}-{request.args.get('to', 'now')}.{extension}"
+    batches = iter_export_batches(filters)
+    try:
+        # Read the first page before answering so an outage is a 5xx, not an empty file
+        first = next(batches, None)
+    except SupabaseUnavailable as e:
+        return jsonify({'error': str(e)}), 503
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+    chunks = iter_export_chunks(itertools.chain([first] if first else [], batches), export_format)
+    if request.args.get('gzip') in ('1', 'true'):
+        chunks = gzip_chunks(chunks)
+        mimetype = 'application/gzip'
+        filename += '.gz'
+    
+    logger.info(f"Streaming sales export: {export_format}, filters={filters}")
+    response = Response(stream_with_context(chunks), mimetype=mimetype)
+    response.headers['Content-Disposition'] = f'attachment; filename="{secure_filename(filename)}"'
+    response.headers['Cache-Control'] = 'no-store'
+    return response
+
 # ==================== NOTIFICATION ROUTES ====================
 
+# A sale creates a notification, so this table grows as fast as sales: read it
+# with limited queries and server-side counts, never as a whole.
+NOTIFICATION_LIMIT_DEFAULT = 50
+NOTIFICATION_LIMIT_MAX = 200
+# Unread count reuse window; this worker's own writes refresh it immediately
+NOTIFICATION_COUNT_TTL = float(os.environ.get('NOTIFICATION_COUNT_TTL', 5))
+# Read notifications older than this are deleted (0 keeps everything)
+NOTIFICATION_RETENTION_DAYS = int(os.environ.get('NOTIFICATION_RETENTION_DAYS', 90))
+NOTIFICATION_RETENTION_INTERVAL = int(os.environ.get('NOTIFICATION_RETENTION_INTERVAL', 6 * 3600))
+
+def queued_notifications():
+    """Notifications still waiting in the write-behind queue"""
+    if WRITE_BEHIND_MODE == 'off':
+        return []
+    return [payload['notification'] for _, payload in write_queue.pending() if payload.get('notification')]
+
+class UnreadCount:
+    """Unread notification count from a server-side count query, reused briefly"""
+
+    def __init__(self, ttl):
+        self.ttl = ttl
+        self._value = None
+        self._lock = threading.Lock()
+        self.counters = {'hits': 0, 'queries': 0}
+
+    def _query(self):
+        count = count_rows('notifications', [('eq', 'read', False)])
+        with self._lock:
+            self.counters['queries'] += 1
+        return count
+
+    def get(self):
+        # Queued first: one flushed meanwhile is briefly counted twice rather than missed
+        queued = sum(1 for n in queued_notifications() if not n.get('read', False))
+        generation = table_cache.generation('notifications')
+        with self._lock:
+            value = self._value
+            fresh = value and value[0] == generation and time.monotonic() - value[1] < self.ttl
+            if fresh:
+                self.counters['hits'] += 1
+        if fresh:
+            count = value[2]
+        else:
+            try:
+                count = single_flight.do(('count', 'notifications', generation), self._query)
+            except Exception as e:
+                if value is None:
+                    raise
+                logger.warning(f"Serving the last unread count while the count query fails: {e}")
+                count = value[2]
+            else:
+                with self._lock:
+                    self._value = (generation, time.monotonic(), count)
+        return count + queued
+
+unread_count = UnreadCount(NOTIFICATION_COUNT_TTL)
+
+class NotificationRetention:
+    """Background job deleting read notifications older than the retention window
+
+    Unread ones are never deleted. Each worker runs it; the delete is
+    idempotent. No tombstones are written, so /api/sync clients keep old read
+    notifications they already have.
+    """
+
+    def __init__(self, days, interval):
+        self.days = days
+        self.interval = interval
+        self._thread = None
+        self._pid = None
+        self._lock = threading.Lock()
+        self.counters = {'runs': 0, 'deleted': 0}
+
+    def purge(self):
+        """Delete expired read notifications; returns how many went"""
+        cutoff = (datetime.now() - timedelta(days=self.days)).isoformat()
+        filters = [('eq', 'read', True), ('lt', 'timestamp', cutoff)]
+        # A minimal-return delete reports no count, and returning the rows would defeat the point
+        deleted = count_rows('notifications', filters)
+        if deleted:
+            apply_filters(supabase.table('notifications').delete(returning=ReturnMethod.minimal), filters).execute()
+        self.counters['runs'] += 1
+        self.counters['deleted'] += deleted
+        if deleted:
+            table_cache.invalidate('notifications')
+            logger.info(f"✓ Deleted {deleted} read notifications older than {self.days} days")
+        return deleted
+
+    def _run(self):
+        # First pass soon after boot, so instances that restart often still compact
+        time.sleep(min(self.interval, 60))
+        while True:
+            try:
+                if supabase_health.available():
+                    self.purge()
+            except Exception as e:
+                logger.error(f"Notification retention error: {e}")
+            time.sleep(self.interval)
+
+    def start(self):
+        """Start this process's retention thread (again after a fork)"""
+        with self._lock:
+            if self._thread is not None and self._thread.is_alive() and self._pid == os.getpid():
+                return
+            self._thread = threading.Thread(target=self._run, name='notification-retention', daemon=True)
+            self._pid = os.getpid()
+            self._thread.start()
+
+notification_retention = NotificationRetention(NOTIFICATION_RETENTION_DAYS, NOTIFICATION_RETENTION_INTERVAL)
+if NOTIFICATION_RETENTION_DAYS > 0:
+    notification_retention.start()
+
 @app.route('/api/notifications', methods=['GET'])
 @jwt_required()
 def get_notifications():
-    """Get all notifications"""
+    """Get the newest notifications (?limit=, default 50; ?unread=1 for unread ones only)"""
+    try:
+        limit = int(request.args.get('limit', NOTIFICATION_LIMIT_DEFAULT))
+        if limit < 1:
+            raise ValueError('limit must be positive')
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    limit = min(limit, NOTIFICATION_LIMIT_MAX)
+    unread_only = request.args.get('unread') in ('1', 'true')
+    
     try:
-        notifications = get_table_data('notifications')
-        notifications.sort(key=lambda x: x.get('timestamp', ''), reverse=True)
-        return jsonify(notifications[:50]), 200
+        filters = [('eq', 'read', False)] if unread_only else []
+        notifications = query_table('notifications', filters=filters, order=[('id', True)], limit=limit)
+        seen = {n['id'] for n in notifications}
+        notifications += [n for n in queued_notifications()
+                          if n['id'] not in seen and not (unread_only and n.get('read', False))]
+        notifications.sort(key=lambda x: x['id'], reverse=True)
+        return jsonify(notifications[:limit]), 200
     except Exception as e:
         logger.error(f"Error getting notifications: {e}")
         return jsonify([]), 200
@@ -726,9 +3976,7 @@ def get_notifications():
 def get_notification_count():
     """Get unread notification count"""
     try:
-        notifications = get_table_data('notifications')
-        unread_count = len([n for n in notifications if not n.get('read', False)])
-        return jsonify({'count': unread_count}), 200
+        return jsonify({'count': unread_count.get()}), 200
     except Exception as e:
         logger.error(f"Error getting notification count: {e}")
         return jsonify({'count': 0}), 200
@@ -738,17 +3986,384 @@ def get_notification_count():
 def mark_notification_read(notification_id):
     """Mark notification as read"""
     try:
-        notifications = get_table_data('notifications')
-        for n in notifications:
-            if n['id'] == notification_id:
-                n['read'] = True
-                save_table_data('notifications', n)
-                break
+        now = datetime.now().isoformat()
+        # Queue first: an entry flushed after this carries the flag, one flushed before is upstream
+        if WRITE_BEHIND_MODE != 'off':
+            write_queue.mark_read(notification_ids={notification_id}, now=now)
+        result = supabase.table('notifications').update({'read': True, 'updated_at': now}).eq(
+            'id', notification_id).execute()
+        if result.data:
+            table_cache.patch('notifications', result.data)
         return jsonify({'success': True}), 200
     except Exception as e:
         logger.error(f"Error marking notification read: {e}")
         return jsonify({'error': str(e)}), 500
 
+@app.route('/api/notifications/read-all', methods=['PUT'])
+@jwt_required()
+def mark_all_notifications_read():
+    """Mark every unread notification as read in one update (?upTo=<id> leaves newer ones unread)
+
+    Notifications still in the write-behind queue are marked there. marked
+    counts the rows this update changed.
+    """
+    try:
+        up_to = int(request.args['upTo']) if request.args.get('upTo') else None
+    except ValueError:
+        return jsonify({'error': 'upTo must be a notification id'}), 400
+    
+    try:
+        now = datetime.now().isoformat()
+        # Queue first: an entry flushed after this carries the flag, one flushed before is upstream
+        marked = write_queue.mark_read(up_to=up_to, now=now) if WRITE_BEHIND_MODE != 'off' else 0
+        filters = [('eq', 'read', False)] + ([('lte', 'id', up_to)] if up_to is not None else [])
+        update = supabase.table('notifications').update({'read': True, 'updated_at': now},
+                                                        count='exact', returning=ReturnMethod.minimal)
+        marked += apply_filters(update, filters).execute().count or 0
+        table_cache.invalidate('notifications')
+        logger.info(f"✓ Marked {marked} notifications read")
+        return jsonify({'success': True, 'marked': marked}), 200
+    except Exception as e:
+        logger.error(f"Error marking notifications read: {e}")
+        return jsonify({'error': str(e)}), 500
+
+# ==================== DELTA SYNC ====================
+
+# The returned cursor lags the query start by this much so rows committed
+# while the sync ran are sent again next time rather than missed; clients
+# merge by id, so repeats are harmless. Queued sales keep the time they were
+# accepted but reach Supabase later, so the cursor is also held back to the
+# oldest sale or notification still in the write-behind queue.
+SYNC_OVERLAP_SECONDS = 2
+
+def sync_cursor(started, pending):
+    """Cursor for the next sync: before the query started and before anything still queued"""
+    oldest = started
+    for _, payload in pending:
+        for row in payload['sales'] + [payload['notification']]:
+            try:
+                oldest = min(oldest, datetime.fromisoformat(row['timestamp']))
+            except (KeyError, TypeError, ValueError):
+                continue
+    return (oldest - timedelta(seconds=SYNC_OVERLAP_SECONDS)).isoformat()
+
+def record_tombstone(table_name, record_id):
+    """Remember a delete so /api/sync can tell clients to drop the row"""
+    tombstone = {
+        'id': uuid.uuid4().hex,
+        'tablename': table_name,
+        'recordid': record_id,
+        'deletedat': datetime.now().isoformat()
+    }
+    if not insert_table_data('tombstones', tombstone):
+        logger.error(f"Could not record tombstone for {table_name} {record_id}")
+
+@app.route('/api/sync', methods=['GET'])
+@jwt_required()
+def sync_changes():
+    """Products, sales and notifications changed since a cursor, plus deletes
+
+    Without a cursor (full sync) only the newest NOTIFICATION_LIMIT_MAX
+    notifications are returned; deltas include notifications marked read.
+    """
+    started = datetime.now()
+    since = request.args.get('since')
+    try:
+        if since:
+            since = datetime.fromisoformat(since).isoformat()
+    except ValueError:
+        return jsonify({'error': 'Invalid since cursor'}), 400
+    
+    try:
+        # Read the queue first: an entry flushed after this is in the query results
+        pending = write_queue.pending() if WRITE_BEHIND_MODE != 'off' else []
+        if since:
+            # select_rows raises, so a failed query never advances the client's cursor
+            products = select_rows('products', filters=[('gt', 'lastupdated', since)])
+            queued_ids = {change[0] for _, payload in pending for change in payload['changes']}
+            unchanged = list(queued_ids - {product['id'] for product in products})
+            if unchanged:
+                # Stock taken by queued sales shows on products Supabase has not seen change yet
+                products += select_rows('products', filters=[('in_', 'id', unchanged)])
+            products = write_queue.overlay('products', products, pending)
+            sales = write_queue.overlay('sales', select_rows('sales', filters=[('gt', 'timestamp', since)]), pending)
+            notifications = write_queue.overlay(
+                'notifications', select_rows('notifications', filters=[('gt', 'updated_at', since)]), pending
+            )
+            deleted = {}
+            for tombstone in select_rows('tombstones', filters=[('gt', 'deletedat', since)]):
+                deleted.setdefault(tombstone['tablename'], []).append(tombstone['recordid'])
+        else:
+            products = write_queue.overlay('products', get_table_data('products'), pending)
+            sales = write_queue.overlay('sales', get_table_data('sales'), pending)
+            # Newest notifications only, as GET /api/notifications; older ones are paged from there
+            notifications = write_queue.overlay('notifications', select_rows(
+                'notifications', order=[('id', True)], limit=NOTIFICATION_LIMIT_MAX), pending)
+            notifications = sorted(notifications, key=lambda n: n['id'], reverse=True)[:NOTIFICATION_LIMIT_MAX]
+            deleted = {}
+        
+        return jsonify({
+            'cursor': sync_cursor(started, pending),
+            'full': not since,
+            'products': [product_view(product) for product in products],
+            'sales': [sale_view(sale) for sale in sales],
+            'notifications': notifications,
+            'deleted': deleted
+        }), 200
+    except Exception as e:
+        logger.error(f"Error syncing changes: {e}")
+        return jsonify({'error': str(e)}), 500
+
+# ==================== REPORTS ====================
+
+REPORT_GROUPINGS = ('day', 'week', 'month')
+# dimension -> (sales column to group by, column holding a display label)
+REPORT_DIMENSIONS = {
+    'category': ('category', 'category'),
+    'product': ('productid', 'productname'),
+    'size': ('size', 'size')
+}
+REPORT_OPEN_PERIOD_TTL = int(os.environ.get('REPORT_OPEN_PERIOD_TTL', 60))
+REPORT_CACHE_MAX_ENTRIES = int(os.environ.get('REPORT_CACHE_MAX_ENTRIES', 5000))
+REPORT_BATCH_SIZE = 1000
+# Longest from..to range one request may ask for (every day in it is a period and a sales read)
+REPORT_MAX_DAYS = int(os.environ.get('REPORT_MAX_DAYS', 3 * 366))
+
+class ReportCache:
+    """Per-period report results; closed periods never expire, open ones do"""
+
+    def __init__(self, max_entries, open_ttl):
+        self.max_entries = max_entries
+        self.open_ttl = open_ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.counters = {'hits': 0, 'misses': 0}
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or (entry['expires'] is not None and time.monotonic() > entry['expires']):
+                self.counters['misses'] += 1
+                return None
+            self._entries.move_to_end(key)
+            self.counters['hits'] += 1
+            return entry['value']
+
+    def put(self, key, value, closed):
+        with self._lock:
+            self._entries[key] = {
+                'value': value,
+                'expires': None if closed else time.monotonic() + self.open_ttl
+            }
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def invalidate_open(self):
+        """Drop cached periods that can still change (called when a sale is recorded)"""
+        with self._lock:
+            for key in [k for k, e in self._entries.items() if e['expires'] is not None]:
+                del self._entries[key]
+
+report_cache = ReportCache(REPORT_CACHE_MAX_ENTRIES, REPORT_OPEN_PERIOD_TTL)
+
+def period_start(day, group_by):
+    if group_by == 'week':
+        return day - timedelta(days=day.weekday())
+    if group_by == 'month':
+        return day.replace(day=1)
+    return day
+
+def next_period_start(day, group_by):
+    if group_by == 'week':
+        return day + timedelta(days=7)
+    if group_by == 'month':
+        return (day.replace(day=28) + timedelta(days=4)).replace(day=1)
+    return day + timedelta(days=1)
+
+def report_periods(start, end, group_by):
+    """Split [start, end] (inclusive dates) into periods clipped to the range"""
+    periods = []
+    current = period_start(start, group_by)
+    while current <= end:
+        following = next_period_start(current, group_by)
+        label = current.strftime('%Y-%m') if group_by == 'month' else current.isoformat()
+        periods.append((label, max(current, start), min(following, end + timedelta(days=1))))
+        current = following
+    return periods
+
+def empty_metrics():
+    return {'revenue': 0, 'profit': 0, 'units': 0, 'sales': 0, 'bargains': 0}
+
+def finish_metrics(metrics):
+    metrics['bargainRate'] = metrics['bargains'] / metrics['sales'] if metrics['sales'] else 0
+    return metrics
+
+def merge_metrics(target, source):
+    for name in ('revenue', 'profit', 'units', 'sales', 'bargains'):
+        target[name] += source[name]
+
+def compute_report_periods(periods, dimension, queued=()):
+    """Aggregate sales for a contiguous run of periods in one batched scan
+
+    queued sales (still in the write-behind queue) are counted unless the
+    scan already returned them.
+    """
+    key_column, label_column = REPORT_DIMENSIONS.get(dimension, (None, None))
+    columns = ['id', 'timestamp', 'totalamount', 'totalprofit', 'quantity', 'isbargain']
+    for column in (key_column, label_column):
+        if column and column not in columns:
+            columns.append(column)
+    
+    results = {label: {'totals': empty_metrics(), 'breakdown': {}} for label, _, _ in periods}
+    # Map each calendar day to its period label once instead of per sale
+    day_labels = {}
+    for label, start, end in periods:
+        day = start
+        while day < end:
+            day_labels[day.isoformat()] = label
+            day += timedelta(days=1)
+    
+    filters = [
+        ('gte', 'timestamp', datetime.combine(periods[0][1], datetime.min.time()).isoformat()),
+        ('lt', 'timestamp', datetime.combine(periods[-1][2], datetime.min.time()).isoformat())
+    ]
+    queued = {sale['id']: sale for sale in queued}
+    cursor = None
+    while True:
+        batch, cursor = fetch_page('sales', ','.join(columns), filters, REPORT_BATCH_SIZE, cursor)
+        for row in batch:
+            queued.pop(row.get('id'), None)
+        if not cursor:
+            batch += list(queued.values())
+        # Columnar pass: pull each column out once, then fold rows in a single zip
+        labels = [day_labels.get(str(row.get('timestamp', ''))[:10]) for row in batch]
+        revenue = [row.get('totalamount') or 0 for row in batch]
+        profit = [row.get('totalprofit') or 0 for row in batch]
+        units = [row.get('quantity') or 0 for row in batch]
+        bargains = [1 if row.get('isbargain') else 0 for row in batch]
+        keys = [row.get(key_column) for row in batch] if key_column else [None] * len(batch)
+        names = [row.get(label_column) for row in batch] if key_column else [None] * len(batch)
+        
+        for label, amount, gain, count, bargain, key, name in zip(labels, revenue, profit, units, bargains, keys, names):
+            if label is None:
+                continue
+            period = results[label]
+            targets = [period['totals']]
+            if key_column:
+                entry = period['breakdown'].get(key)
+                if entry is None:
+                    entry = period['breakdown'][key] = {'key': key, 'label': name, **empty_metrics()}
+                targets.append(entry)
+            for metrics in targets:
+                metrics['revenue'] += amount
+                metrics['profit'] += gain
+                metrics['units'] += count
+                metrics['sales'] += 1
+                metrics['bargains'] += bargain
+        
+        if not cursor:
+            break
+    return results
+
+def build_report(start, end, group_by, dimension):
+    """Report over [start, end] with cached per-period results"""
+    today = date.today()
+    periods = report_periods(start, end, group_by)
+    computed = {}
+    missing = []
+    for period in periods:
+        cached = report_cache.get((group_by, dimension, period[1], period[2]))
+        if cached is not None:
+            computed[period[0]] = cached
+        else:
+            missing.append(period)
+    
+    if missing:
+        def compute():
+            # Read the queue before the scan so a sale flushed meanwhile is seen by one or the other
+            queued = [sale for _, payload in write_queue.pending() for sale in payload['sales']] \
+                if WRITE_BEHIND_MODE != 'off' else []
+            queued_days = {str(sale.get('timestamp', ''))[:10] for sale in queued}
+            # One scan from the first to the last missing period; a failed
+            # page raises here, so nothing is cached for a partial scan
+            fresh = compute_report_periods(missing, dimension, queued)
+            for label, period_start_day, period_end_day in missing:
+                # A period with queued sales is not final until they reach Supabase
+                closed = period_end_day <= today and not any(
+                    period_start_day.isoformat() <= day < period_end_day.isoformat() for day in queued_days
+                )
+                report_cache.put((group_by, dimension, period_start_day, period_end_day), fresh[label],
+                                 closed=closed)
+            return fresh
+        
+        fresh = single_flight.do(('report', group_by, dimension, tuple(missing)), compute)
+        for label, _, _ in missing:
+            computed[label] = fresh[label]
+    
+    totals = empty_metrics()
+    overall_breakdown = {}
+    result_periods = []
+    for label, period_start_day, period_end_day in periods:
+        period = computed[label]
+        merge_metrics(totals, period['totals'])
+        breakdown = []
+        for key, metrics in period['breakdown'].items():
+            overall = overall_breakdown.setdefault(key, {'key': key, 'label': metrics['label'], **empty_metrics()})
+            merge_metrics(overall, metrics)
+            breakdown.append(finish_metrics(dict(metrics)))
+        breakdown.sort(key=lambda m: m['revenue'], reverse=True)
+        result_periods.append({
+            'period': label,
+            'start': period_start_day.isoformat(),
+            'end': (period_end_day - timedelta(days=1)).isoformat(),
+            **finish_metrics(dict(period['totals'])),
+            'breakdown': breakdown
+        })
+    
+    return {
+        'from': start.isoformat(),
+        'to': end.isoformat(),
+        'groupBy': group_by,
+        'dimension': dimension,
+        'totals': finish_metrics(totals),
+        'breakdown': sorted((finish_metrics(m) for m in overall_breakdown.values()),
+                            key=lambda m: m['revenue'], reverse=True),
+        'periods': result_periods
+    }
+
+@app.route('/api/reports', methods=['GET'])
+@jwt_required()
+def get_report():
+    """Sales aggregates by day/week/month, optionally broken down by category, product or size"""
+    try:
+        end = date.fromisoformat(request.args['to']) if request.args.get('to') else date.today()
+        start = date.fromisoformat(request.args['from']) if request.args.get('from') else end - timedelta(days=29)
+    except (ValueError, OverflowError):
+        return jsonify({'error': 'from/to must be YYYY-MM-DD dates'}), 400
+    group_by = request.args.get('groupBy', 'day')
+    dimension = request.args.get('dimension') or None
+    if start > end:
+        return jsonify({'error': 'from must not be after to'}), 400
+    if (end - start).days >= REPORT_MAX_DAYS:
+        return jsonify({'error': f'from/to may span at most {REPORT_MAX_DAYS} days'}), 400
+    if group_by not in REPORT_GROUPINGS:
+        return jsonify({'error': f'groupBy must be one of: {", ".join(REPORT_GROUPINGS)}'}), 400
+    if dimension and dimension not in REPORT_DIMENSIONS:
+        return jsonify({'error': f'dimension must be one of: {", ".join(REPORT_DIMENSIONS)}'}), 400
+    
+    try:
+        return jsonify(build_report(start, end, group_by, dimension)), 200
+    except OverflowError:
+        # Periods are extended to whole weeks/months, which can run past year 9999
+        return jsonify({'error': 'from/to are out of range'}), 400
+    except SupabaseUnavailable as e:
+        return jsonify({'error': str(e)}), 503
+    except Exception as e:
+        logger.error(f"Error building report: {e}")
+        logger.error(traceback.format_exc())
+        return jsonify({'error': str(e)}), 500
+
 # ==================== DASHBOARD STATS ====================
 
 @app.route('/api/dashboard/stats', methods=['GET'])
@@ -756,31 +4371,10 @@ def mark_notification_read(notification_id):
 def get_dashboard_stats():
     """Get dashboard statistics"""
     try:
-        products = get_table_data('products')
-        sales = get_table_data('sales')
-        
-        total_products = len(products)
-        total_stock = sum([p.get('totalstock', 0) for p in products])
-        total_revenue = sum([s.get('totalamount', 0) for s in sales])
-        total_profit = sum([s.get('totalprofit', 0) for s in sales])
-        
-        today = datetime.now().strftime('%Y-%m-%d')
-        today_sales = [s for s in sales if s.get('timestamp', '').startswith(today)]
-        today_revenue = sum([s.get('totalamount', 0) for s in today_sales])
-        today_profit = sum([s.get('totalprofit', 0) for s in today_sales])
-        today_items = sum([s.get('quantity', 0) for s in today_sales])
-        
-        return jsonify({
-            'totalProducts': total_products,
-            'totalStock': total_stock,
-            'totalRevenue': total_revenue,
-            'totalProfit': total_profit,
-            'todayRevenue': today_revenue,
-            'todayProfit': today_profit,
-            'todayItems': today_items,
-            'salesCount': len(sales),
-            'storage_type': 'supabase'
-        }), 200
+        dashboard_aggregates.ensure_built()
+        stats = dashboard_aggregates.snapshot(datetime.now().strftime('%Y-%m-%d'))
+        stats['storage_type'] = 'supabase'
+        return jsonify(stats), 200
         
     except Exception as e:
         logger.error(f"Error getting dashboard stats: {e}")
@@ -796,6 +4390,23 @@ def get_dashboard_stats():
             'storage_type': 'supabase'
         }), 200
 
+@app.route('/api/dashboard/rebuild', methods=['POST'])
+@jwt_required()
+def rebuild_dashboard_stats():
+    """Rebuild dashboard aggregates from the tables (reconciliation)"""
+    try:
+        dashboard_aggregates.rebuild()
+        return jsonify({'success': True}), 200
+    except Exception as e:
+        logger.error(f"Error rebuilding dashboard stats: {e}")
+        return jsonify({'error': str(e)}), 500
+
+@app.cli.command('rebuild-aggregates')
+def rebuild_aggregates_command():
+    """Rebuild dashboard aggregates from the products and sales tables"""
+    dashboard_aggregates.rebuild()
+    print(json.dumps(dashboard_aggregates.snapshot(datetime.now().strftime('%Y-%m-%d'))))
+
 # ==================== STORAGE INFO ====================
 
 @app.route('/api/storage/info', methods=['GET'])
@@ -805,10 +4416,29 @@ def get_storage_info():
     return jsonify({
         'provider': 'supabase',
         'bucket': STORAGE_BUCKET,
-        'connected': SUPABASE_AVAILABLE,
+        'connected': supabase_health.available(),
         'storage_type': 'supabase'
     }), 200
 
+@app.route('/api/cache/stats', methods=['GET'])
+@jwt_required()
+def get_cache_stats():
+    """Get table and image cache hit/miss counters"""
+    return jsonify({**table_cache.stats(), 'images': image_cache.stats(), 'events': event_hub.stats(),
+                    'reports': report_cache.counters, 'catalog': catalog_index.stats(),
+                    'serialized': serialized_cache.counters, 'singleFlight': single_flight.stats(),
+                    'unreadCount': unread_count.counters, 'notificationRetention': notification_retention.counters}), 200
+
+@app.route('/api/queue/status', methods=['GET'])
+@jwt_required()
+def get_queue_status():
+    """Depth, failures and flusher state of the write-behind queue"""
+    try:
+        return jsonify(write_queue.status()), 200
+    except Exception as e:
+        logger.error(f"Error reading write queue status: {e}")
+        return jsonify({'error': str(e)}), 500
+
 # ==================== HEALTH CHECK ====================
 
 @app.route('/api/health', methods=['GET'])
@@ -819,7 +4449,7 @@ def health_check():
     try:
         products = get_table_data('products')
         product_count = len(products)
-        sales = get_table_data('sales')
+        sales = write_queue.overlay('sales', get_table_data('sales'))
         sale_count = len(sales)
     except:
         pass
@@ -827,12 +4457,58 @@ def health_check():
     return jsonify({
         'status': 'healthy',
         'timestamp': datetime.now().isoformat(),
-        'supabase': 'connected' if SUPABASE_AVAILABLE else 'disconnected',
+        'supabase': 'connected' if supabase_health.available() else 'disconnected',
+        'circuit': supabase_health.state,
         'products': product_count,
         'sales': sale_count,
         'storage_type': 'supabase'
     }), 200
 
+STARTED_AT = time.time()
+
+@app.route('/api/health/live', methods=['GET'])
+def liveness():
+    """Liveness: the worker is up and answering (never touches Supabase)"""
+    return jsonify({'status': 'alive', 'pid': os.getpid(), 'uptime': round(time.time() - STARTED_AT, 1)}), 200
+
+@app.route('/api/health/ready', methods=['GET'])
+def readiness():
+    """Readiness: 503 while Supabase is unreachable, unless sales can still be queued locally"""
+    upstream = supabase_health.stats()
+    if supabase_health.available():
+        status, code = 'ready', 200
+    elif WRITE_BEHIND_MODE != 'off':
+        status, code = 'degraded', 200
+    else:
+        status, code = 'unavailable', 503
+    try:
+        queue_depth = write_queue.status()['depth'] if WRITE_BEHIND_MODE != 'off' else 0
+    except Exception as e:
+        logger.error(f"Error reading write queue depth: {e}")
+        queue_depth = None
+    return jsonify({'status': status, 'supabase': upstream, 'writeQueueDepth': queue_depth}), code
+
+@app.route('/metrics', methods=['GET'])
+def prometheus_metrics():
+    """Prometheus scrape endpoint: route and upstream histograms plus cache and queue gauges"""
+    if not METRICS_TOKEN and not app.debug:
+        return jsonify({'error': 'Metrics are disabled until METRICS_TOKEN is set'}), 404
+    if METRICS_TOKEN and request.headers.get('Authorization') != f'Bearer {METRICS_TOKEN}':
+        return jsonify({'error': 'Unauthorized'}), 401
+    cache = table_cache.stats()
+    gauges = [
+        ('supabase_circuit_open', 'gauge', 'Whether the Supabase circuit breaker is refusing calls', int(supabase_health.state != 'closed')),
+        ('table_cache_hits_total', 'counter', 'Table cache hits', cache.get('hits', 0)),
+        ('table_cache_misses_total', 'counter', 'Table cache misses', cache.get('misses', 0)),
+        ('image_cache_bytes', 'gauge', 'Bytes held by the image disk cache', image_cache.stats()['bytes'])
+    ]
+    if WRITE_BEHIND_MODE != 'off':
+        try:
+            gauges.append(('write_queue_depth', 'gauge', 'Sales waiting in the write-behind queue', write_queue.status()['depth']))
+        except Exception as e:
+            logger.error(f"Error reading write queue depth: {e}")
+    return Response(metrics.render(gauges), content_type='text/plain; version=0.0.4; charset=utf-8')
+
 # ==================== DEBUG ENDPOINT ====================
 
 @app.route('/api/debug/sales-table', methods=['GET'])
@@ -863,7 +4539,7 @@ def debug_sales_table():
         
         # Try to insert a test record
         try:
-            test_id = int(datetime.now().timestamp())
+            test_id = next_record_id()
             test_sale = {
                 'id': test_id,
                 'productid': 999999,
@@ -893,7 +4569,13 @@ def debug_sales_table():
 def serve_static(filename):
     """Serve static files"""
     try:
-        return send_from_directory('static', filename)
+        path = safe_join('static', filename)
+        asset = load_asset(path)
+        if asset:
+            return send_asset(asset, 'static')
+        response = send_from_directory('static', filename, etag=file_etag(path))
+        response.headers['Cache-Control'] = CACHE_CONTROL['static']
+        return response
     except Exception as e:
         return jsonify({'error': 'File not found'}), 404
 
@@ -904,10 +4586,15 @@ def index():
     """Serve index.html"""
     try:
         if os.path.exists('index.html'):
-            return send_file('index.html')
+            asset = load_asset('index.html')
+            if asset:
+                return send_asset(asset, 'index')
+            response = send_file('index.html', etag=file_etag('index.html'))
+            response.headers['Cache-Control'] = CACHE_CONTROL['index']
+            return response
         return jsonify({
             'message': 'Karanja Shoe Store API is running',
-            'supabase': 'connected' if SUPABASE_AVAILABLE else 'disconnected',
+            'supabase': 'connected' if supabase_health.available() else 'disconnected',
             'status': 'online'
         })
     except Exception as e:
@@ -934,7 +4621,7 @@ if __name__ == '__main__':
     logger.info("=" * 60)
     logger.info(f"Supabase URL: {SUPABASE_URL}")
     logger.info(f"Storage Bucket: {STORAGE_BUCKET}")
-    logger.info(f"Connection: {'✓ Connected' if SUPABASE_AVAILABLE else '✗ Failed'}")
+    logger.info(f"Connection: checked in the background every {SUPABASE_PROBE_SECONDS:.0f}s")
     logger.info("=" * 60)
     logger.info(f"Server starting on port {port}")
     logger.info("=" * 60)
@@ -0,0 +1,361 @@
+"""In-process stand-in for the parts of the Supabase client that app.py uses
+
+Implements the PostgREST table builder (select/insert/upsert/update/delete with
+eq/neq/lt/lte/gt/gte/in_/is_ filters, order, limit, range and exact counts),
+the record_sale/record_checkout functions from sql/record_sale.sql and a storage
+bucket. Every call runs under one lock, so single statements are atomic the
+way they are in Postgres. FakeSupabase(latency=0.02) delays every call by
+20ms, and serve_storage() puts the bucket's public URLs behind a local HTTP
+server so the image proxy fetches over a real socket.
+
+Use install() before importing app so its create_client() returns the fake:
+
+    from bench import fake_supabase
+    fake = fake_supabase.install()
+    import app
+"""
+import copy
+import hashlib
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from postgrest.exceptions import APIError as PostgrestAPIError
+
+
+class APIError(PostgrestAPIError):
+    """An error response from the database, as postgrest raises it
+
+    Subclassing the real class matters: app.py tells refusals (insufficient
+    stock, duplicate keys) from transport failures by it, and only the latter
+    count towards the circuit breaker.
+    """
+
+
+class Response:
+    def __init__(self, data, count=None):
+        self.data = data
+        self.count = count
+
+
+def _comparable(left, right):
+    if isinstance(left, (int, float)) and not isinstance(left, bool):
+        try:
+            return left, float(right)
+        except (TypeError, ValueError):
+            pass
+    return str(left), str(right)
+
+
+class Query:
+    def __init__(self, client, table):
+        self.client = client
+        self.table = table
+        self.operation = 'select'
+        self.columns = None
+        self.count = None
+        self.payload = None
+        self.filters = []
+        self.orders = []
+        self.row_limit = None
+        self.row_offset = 0
+
+    # Mirrors postgrest's request builder attributes used for metrics labels
+    HTTP_METHODS = {'select': 'GET', 'insert': 'POST', 'upsert': 'POST', 'update': 'PATCH', 'delete': 'DELETE'}
+
+    @property
+    def path(self):
+        return f'/{self.table}'
+
+    @property
+    def http_method(self):
+        return self.HTTP_METHODS[self.operation]
+
+    # ---- operations ----
+    def select(self, *columns, count=None):
+        self.columns = [c.strip() for c in ','.join(columns).split(',') if c.strip()]
+        self.count = count
+        return self
+
+    def insert(self, json, **kwargs):
+        self.operation, self.payload = 'insert', json
+        return self
+
+    def upsert(self, json, **kwargs):
+        self.operation, self.payload = 'upsert', json
+        return self
+
+    def update(self, json, count=None, **kwargs):
+        self.operation, self.payload, self.count = 'update', json, count
+        return self
+
+    def delete(self, count=None, **kwargs):
+        self.operation, self.count = 'delete', count
+        return self
+
+    # ---- filters / modifiers ----
+    def _filter(self, op, column, value):
+        self.filters.append((op, column, value))
+        return self
+
+    def eq(self, column, value):
+        return self._filter('eq', column, value)
+
+    def neq(self, column, value):
+        return self._filter('neq', column, value)
+
+    def lt(self, column, value):
+        return self._filter('lt', column, value)
+
+    def lte(self, column, value):
+        return self._filter('lte', column, value)
+
+    def gt(self, column, value):
+        return self._filter('gt', column, value)
+
+    def gte(self, column, value):
+        return self._filter('gte', column, value)
+
+    def in_(self, column, values):
+        return self._filter('in', column, list(values))
+
+    def is_(self, column, value):
+        return self._filter('is', column, value)
+
+    def order(self, column, *, desc=False, **kwargs):
+        self.orders.append((column, desc))
+        return self
+
+    def limit(self, size):
+        self.row_limit = size
+        return self
+
+    def range(self, start, end):
+        self.row_offset, self.row_limit = start, end - start + 1
+        return self
+
+    def _matches(self, row):
+        for op, column, value in self.filters:
+            current = row.get(column)
+            if op == 'is':
+                if (current is None) != (str(value).lower() == 'null'):
+                    return False
+                continue
+            if op == 'in':
+                if str(current) not in {str(v) for v in value}:
+                    return False
+                continue
+            if current is None:
+                return False
+            left, right = _comparable(current, value)
+            if ((op == 'eq' and not left == right) or (op == 'neq' and left == right)
+                    or (op == 'lt' and not left < right) or (op == 'lte' and not left <= right)
+                    or (op == 'gt' and not left > right) or (op == 'gte' and not left >= right)):
+                return False
+        return True
+
+    def _project(self, row):
+        if not self.columns or self.columns == ['*']:
+            return copy.deepcopy(row)
+        return {c: copy.deepcopy(row.get(c)) for c in self.columns}
+
+    def execute(self):
+        self.client.before_call(self)
+        with self.client.lock:
+            self.client.calls += 1
+            rows = self.client.tables.setdefault(self.table, {})
+            if self.operation == 'select':
+                matched = [row for row in rows.values() if self._matches(row)]
+                for column, desc in reversed(self.orders):
+                    matched.sort(key=lambda r: (r.get(column) is None, r.get(column)), reverse=desc)
+                total = len(matched)
+                end = None if self.row_limit is None else self.row_offset + self.row_limit
+                data = [self._project(row) for row in matched[self.row_offset:end]]
+                return Response(data, total if self.count else None)
+            if self.operation in ('insert', 'upsert'):
+                new_rows = self.payload if isinstance(self.payload, list) else [self.payload]
+                if self.operation == 'insert':
+                    ids = [row['id'] for row in new_rows]
+                    if len(set(ids)) != len(ids) or any(i in rows for i in ids):
+                        raise APIError({'code': '23505', 'message': f'duplicate key value violates unique constraint "{self.table}_pkey"'})
+                data = []
+                for new_row in new_rows:
+                    row = rows.setdefault(new_row['id'], {})
+                    row.update(copy.deepcopy(new_row))
+                    data.append(copy.deepcopy(row))
+                return Response(data)
+            if self.operation == 'update':
+                data = []
+                for row in rows.values():
+                    if self._matches(row):
+                        row.update(copy.deepcopy(self.payload))
+                        data.append(copy.deepcopy(row))
+                return Response(data, len(data) if self.count else None)
+            if self.operation == 'delete':
+                doomed = [key for key, row in rows.items() if self._matches(row)]
+                return Response([rows.pop(key) for key in doomed], len(doomed) if self.count else None)
+        raise APIError({'code': 'PGRST000', 'message': f'unsupported operation {self.operation}'})
+
+
+class RPC:
+    def __init__(self, client, fn, params):
+        self.client = client
+        self.fn = fn
+        self.params = params
+        self.path = f'/rpc/{fn}'
+        self.http_method = 'POST'
+
+    def execute(self):
+        self.client.before_call(self)
+        handler = self.client.functions.get(self.fn)
+        if handler is None:
+            raise APIError({'code': 'PGRST202', 'message': f'Could not find the function public.{self.fn}'})
+        with self.client.lock:
+            self.client.calls += 1
+            return Response(handler(self.client.tables, **self.params))
+
+
+def record_sale(tables, p_product_id, p_size, p_quantity, p_lastupdated, p_sale, p_notification):
+    """Python twin of sql/record_sale.sql"""
+    products = tables.setdefault('products', {})
+    sales = tables.setdefault('sales', {})
+    notifications = tables.setdefault('notifications', {})
+    product = products.get(p_product_id)
+    if product is None:
+        raise APIError({'code': 'P0001', 'message': 'product_not_found'})
+    if int(product['sizes'].get(p_size) or 0) < p_quantity:
+        raise APIError({'code': 'P0001', 'message': 'insufficient_stock'})
+    if p_sale['id'] in sales:
+        raise APIError({'code': '23505', 'message': 'duplicate key value violates unique constraint "sales_pkey"'})
+    product['sizes'][p_size] = int(product['sizes'][p_size]) - p_quantity
+    product['totalstock'] = product.get('totalstock', 0) - p_quantity
+    product['lastupdated'] = p_lastupdated
+    sales[p_sale['id']] = copy.deepcopy(p_sale)
+    notifications.setdefault(p_notification['id'], copy.deepcopy(p_notification))
+    return copy.deepcopy(product)
+
+
+def record_checkout(tables, p_changes, p_lastupdated, p_sales, p_notification):
+    """Python twin of record_checkout in sql/record_sale.sql"""
+    products = tables.setdefault('products', {})
+    sales = tables.setdefault('sales', {})
+    notifications = tables.setdefault('notifications', {})
+    for change in p_changes:
+        product = products.get(change['product_id'])
+        if product is None or int(product['sizes'].get(change['size']) or 0) < change['quantity']:
+            raise APIError({'code': 'P0001', 'message': f"insufficient_stock:{change['product_id']}:{change['size']}"})
+    ids = [sale['id'] for sale in p_sales]
+    if len(set(ids)) != len(ids) or any(i in sales for i in ids):
+        raise APIError({'code': '23505', 'message': 'duplicate key value violates unique constraint "sales_pkey"'})
+    for change in p_changes:
+        product = products[change['product_id']]
+        product['sizes'][change['size']] = int(product['sizes'][change['size']]) - change['quantity']
+        product['totalstock'] = product.get('totalstock', 0) - change['quantity']
+        product['lastupdated'] = p_lastupdated
+    for sale in p_sales:
+        sales[sale['id']] = copy.deepcopy(sale)
+    notifications.setdefault(p_notification['id'], copy.deepcopy(p_notification))
+    return [copy.deepcopy(products[i]) for i in dict.fromkeys(c['product_id'] for c in p_changes)]
+
+
+class Bucket:
+    def __init__(self, client, name):
+        self.client = client
+        self.name = name
+
+    def upload(self, path, file, file_options=None):
+        self.client.before_call(self)
+        content_type = (file_options or {}).get('content-type', 'application/octet-stream')
+        self.client.files[path] = (bytes(file), content_type)
+
+    def get_public_url(self, path):
+        return f'{self.client.storage_url}/{self.name}/{path}'
+
+    def download(self, path):
+        self.client.before_call(self)
+        return self.client.files[path][0]
+
+    def remove(self, paths):
+        self.client.before_call(self)
+        for path in paths:
+            self.client.files.pop(path, None)
+
+
+class Storage:
+    def __init__(self, client):
+        self.client = client
+
+    def from_(self, bucket):
+        return Bucket(self.client, bucket)
+
+
+class FakeSupabase:
+    """Drop-in for supabase.Client backed by dicts of {id: row}"""
+
+    storage_url = 'http://fake-supabase.local/storage/v1/object/public'
+
+    def __init__(self, with_rpc=True, latency=0.0):
+        self.latency = latency
+        self.tables = {}
+        self.files = {}
+        self.calls = 0
+        self.lock = threading.RLock()
+        self.functions = {'record_sale': record_sale, 'record_checkout': record_checkout} if with_rpc else {}
+        self.storage = Storage(self)
+
+    def before_call(self, builder):
+        """Hook for latency and fault injection; runs outside the lock like network time"""
+        if self.latency:
+            time.sleep(self.latency)
+
+    def table(self, name):
+        return Query(self, name)
+
+    def rpc(self, fn, params):
+        return RPC(self, fn, params)
+
+
+class StorageHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    prefix = '/storage/v1/object/public/'
+
+    def do_GET(self):
+        client = self.server.client
+        if self.server.latency:
+            time.sleep(self.server.latency)
+        bucket, _, path = self.path.split('?')[0][len(self.prefix):].partition('/')
+        stored = client.files.get(path) if self.path.startswith(self.prefix) and bucket else None
+        if stored is None:
+            self.send_response(404)
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return
+        body, content_type = stored
+        self.send_response(200)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.send_header('ETag', f'"{hashlib.md5(body).hexdigest()}"')
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def serve_storage(client, latency=0.0):
+    """Serve client.files on 127.0.0.1 and point get_public_url() at it; returns the server"""
+    server = ThreadingHTTPServer(('127.0.0.1', 0), StorageHandler)
+    server.daemon_threads = True
+    server.client = client
+    server.latency = latency
+    client.storage_url = f'http://127.0.0.1:{server.server_address[1]}/storage/v1/object/public'
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def install(client=None):
+    """Make supabase.create_client() hand out the fake; returns it"""
+    import supabase
+    client = client or FakeSupabase()
+    supabase.create_client = lambda *args, **kwargs: client
+    return client
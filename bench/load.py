@@ -0,0 +1,360 @@
+"""Load test for the storefront and admin API against the in-process fake
+
+Seeds the fake with a catalog, sales history, notifications and product
+images, then drives a weighted mix of requests from parallel threads and
+reports requests/sec and p50/p99 latency per endpoint:
+
+    python -m bench.load
+    python -m bench.load --products 10000 --sales 1000000 --latency-ms 30 --duration 30
+    python -m bench.load --mix browse=50,search=20,image=20,sale=5,dashboard=5
+    python -m bench.load --json before.json
+    python -m bench.load --compare before.json --tolerance 0.25
+    python -m bench.load --url http://127.0.0.1:8000 --threads 200
+
+
+Scenarios:
+    browse     GET /api/public/products
+    search     GET /api/public/products/search with a catalog word, sometimes filtered
+    image      GET /api/images/<path>, original or a resized variant
+    sale       POST /api/sales for a random product and size
+    dashboard  GET /api/dashboard/stats, /api/notifications/count or /api/reports
+
+Supabase calls pay --latency-ms each and images are fetched over HTTP from a
+local server that adds --storage-latency-ms, so upstream round trips show up
+the way they do in production. Requests go through Flask's test client, so
+the numbers exclude the WSGI server and the client's network.
+
+With --url the same mix is sent over HTTP to a running server instead, e.g.
+one started with `gunicorn -c gunicorn.conf.py bench.serve:app` (see
+bench/serve.py); the seeding and latency options then belong to the server.
+Logging in for the sale and dashboard scenarios uses --email/--password
+(default $BENCH_EMAIL/$BENCH_PASSWORD).
+
+With --compare, exits non-zero when any endpoint's p99 or throughput is worse
+than the baseline by more than --tolerance.
+"""
+import argparse
+import io
+import json
+import logging
+import math
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+from collections import defaultdict
+from types import SimpleNamespace
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+
+import requests
+
+from bench import fake_supabase
+
+CATEGORIES = ['Sneakers', 'Boots', 'Sandals', 'Loafers', 'Heels', 'Slippers', 'Running', 'Formal']
+COLORS = ['black', 'white', 'brown', 'red', 'blue', 'grey', 'tan', 'green']
+BRANDS = ['Nike', 'Adidas', 'Puma', 'Bata', 'Clarks', 'Vans', 'Converse', 'Timberland', 'Reebok', 'Fila']
+STYLES = ['Air', 'Classic', 'Runner', 'Street', 'Trail', 'Court', 'Chelsea', 'Derby', 'Slide', 'Max']
+SIZES = [str(size) for size in range(36, 46)]
+DEFAULT_MIX = 'browse=40,search=25,image=20,sale=10,dashboard=5'
+
+
+def jpeg_bytes(seed):
+    """A small gradient JPEG, distinct per seed"""
+    from PIL import Image, ImageOps
+    gradient = Image.radial_gradient('L').resize((640, 640))
+    image = ImageOps.colorize(gradient, (seed * 37 % 256, seed * 91 % 256, 40), (250, 240, seed * 53 % 256))
+    buffer = io.BytesIO()
+    image.save(buffer, 'JPEG', quality=80)
+    return buffer.getvalue()
+
+
+def seed(fake, args, rng):
+    """Fill the fake's tables and bucket; returns the product rows"""
+    images = [f'bench/{index}.jpg' for index in range(args.images)]
+    for index, path in enumerate(images):
+        fake.files[path] = (jpeg_bytes(index), 'image/jpeg')
+
+    products = {}
+    for product_id in range(1, args.products + 1):
+        brand, style = rng.choice(BRANDS), rng.choice(STYLES)
+        sizes = {size: rng.randint(50, 500) for size in rng.sample(SIZES, rng.randint(3, len(SIZES)))}
+        buy_price = float(rng.randrange(800, 9000, 50))
+        products[product_id] = {
+            'id': product_id, 'name': f'{brand} {style} {product_id}', 'sku': f'SKU-{product_id:06d}',
+            'category': rng.choice(CATEGORIES), 'color': rng.choice(COLORS),
+            'description': f'{brand} {style} in {rng.choice(COLORS)} leather',
+            'buyprice': buy_price, 'price': buy_price * 1.6, 'sizes': sizes,
+            'totalstock': sum(sizes.values()), 'image_path': images[product_id % len(images)] if images else None,
+            'lastupdated': '2026-01-01T00:00:00'
+        }
+    fake.tables['products'] = products
+
+    now = datetime.now()
+    sales = {}
+    for sale_id in range(1, args.sales + 1):
+        product = products[rng.randint(1, args.products)]
+        quantity = rng.randint(1, 3)
+        unit_price = product['price']
+        sales[sale_id] = {
+            'id': sale_id, 'productid': product['id'], 'productname': product['name'],
+            'productsku': product['sku'], 'category': product['category'], 'buyprice': product['buyprice'],
+            'size': rng.choice(list(product['sizes'])), 'quantity': quantity, 'unitprice': unit_price,
+            'totalamount': unit_price * quantity, 'totalprofit': (unit_price - product['buyprice']) * quantity,
+            'customername': 'Walk-in Customer', 'notes': '', 'isbargain': False,
+            'timestamp': (now - timedelta(seconds=rng.randint(0, 365 * 86400))).isoformat()
+        }
+    fake.tables['sales'] = sales
+
+    fake.tables['notifications'] = {notification_id: {
+        'id': notification_id, 'type': 'sale', 'title': 'New Sale', 'message': f'Sale #{notification_id}',
+        'read': rng.random() < 0.8,
+        'timestamp': (now - timedelta(seconds=rng.randint(0, 30 * 86400))).isoformat()
+    } for notification_id in range(1, args.notifications + 1)}
+    return list(products.values())
+
+
+def scenarios(products, words):
+    """name -> callable(client, headers, rng) returning (endpoint label, response)"""
+    def browse(client, headers, rng):
+        return 'GET /api/public/products', client.get('/api/public/products')
+
+    def search(client, headers, rng):
+        query = {'q': rng.choice(words)}
+        if rng.random() < 0.3:
+            query['category'] = rng.choice(CATEGORIES)
+        if rng.random() < 0.2:
+            query['size'] = rng.choice(SIZES)
+        return 'GET /api/public/products/search', client.get('/api/public/products/search', query_string=query)
+
+    def image(client, headers, rng):
+        product = rng.choice(products)
+        if not product.get('image_path'):
+            return browse(client, headers, rng)
+        if rng.random() < 0.5:
+            size = rng.choice(['thumb', 'card'])
+            return 'GET /api/images/<path>?size', client.get(f"/api/images/{product['image_path']}?size={size}")
+        return 'GET /api/images/<path>', client.get(f"/api/images/{product['image_path']}")
+
+    def sale(client, headers, rng):
+        product = rng.choice(products)
+        return 'POST /api/sales', client.post('/api/sales', headers=headers, json={
+            'productId': product['id'], 'size': rng.choice(list(product['sizes'])),
+            'quantity': 1, 'unitPrice': product['price']
+        })
+
+    def dashboard(client, headers, rng):
+        path = rng.choice(['/api/dashboard/stats', '/api/notifications/count', '/api/reports?groupBy=week'])
+        return f"GET {path.split('?')[0]}", client.get(path, headers=headers)
+
+    return {'browse': browse, 'search': search, 'image': image, 'sale': sale, 'dashboard': dashboard}
+
+
+def parse_mix(text):
+    mix = {}
+    for part in text.split(','):
+        name, _, weight = part.partition('=')
+        mix[name.strip()] = float(weight or 1)
+    return mix
+
+
+def percentile(ordered, fraction):
+    """Nearest-rank percentile of an already sorted list"""
+    if not ordered:
+        return 0.0
+    return ordered[max(0, math.ceil(fraction * len(ordered)) - 1)]
+
+
+def summarize(samples, elapsed):
+    results = {}
+    for endpoint, entries in sorted(samples.items()):
+        latencies = sorted(duration for duration, _ in entries)
+        results[endpoint] = {
+            'count': len(entries),
+            'errors': sum(1 for _, status in entries if status >= 400),
+            'rps': round(len(entries) / elapsed, 1),
+            'p50_ms': round(percentile(latencies, 0.50) * 1000, 2),
+            'p99_ms': round(percentile(latencies, 0.99) * 1000, 2),
+            'max_ms': round(latencies[-1] * 1000, 2)
+        }
+    return results
+
+
+def print_table(results, elapsed):
+    width = max([len(endpoint) for endpoint in results] + [8])
+    print(f"{'endpoint':<{width}} {'count':>7} {'errors':>6} {'req/s':>8} {'p50 ms':>8} {'p99 ms':>8} {'max ms':>8}")
+    for endpoint, row in results.items():
+        print(f"{endpoint:<{width}} {row['count']:>7} {row['errors']:>6} {row['rps']:>8} "
+              f"{row['p50_ms']:>8} {row['p99_ms']:>8} {row['max_ms']:>8}")
+    total = sum(row['count'] for row in results.values())
+    print(f"{'total':<{width}} {total:>7} {sum(row['errors'] for row in results.values()):>6} "
+          f"{round(total / elapsed, 1):>8}")
+
+
+def compare(results, baseline, tolerance):
+    """Regressions against a previous --json run, as printable strings"""
+    regressions = []
+    for endpoint, before in baseline.items():
+        after = results.get(endpoint)
+        if not after or before['count'] < 20:
+            continue
+        if after['p99_ms'] > before['p99_ms'] * (1 + tolerance):
+            regressions.append(f"{endpoint}: p99 {before['p99_ms']}ms -> {after['p99_ms']}ms")
+        if after['rps'] < before['rps'] * (1 - tolerance):
+            regressions.append(f"{endpoint}: {before['rps']} -> {after['rps']} req/s")
+    return regressions
+
+
+class HTTPClient:
+    """The slice of Flask's test client API the scenarios use, sent to a live server"""
+
+    def __init__(self, base_url, pool_size):
+        self.base_url = base_url.rstrip('/')
+        self.session = requests.Session()
+        self.session.mount('http://', requests.adapters.HTTPAdapter(pool_maxsize=pool_size))
+
+    def _wrap(self, response):
+        return SimpleNamespace(status_code=response.status_code, get_data=lambda: response.content,
+                               get_json=response.json)
+
+    def get(self, path, query_string=None, headers=None):
+        return self._wrap(self.session.get(self.base_url + path, params=query_string, headers=headers))
+
+    def post(self, path, headers=None, json=None):
+        return self._wrap(self.session.post(self.base_url + path, headers=headers, json=json))
+
+
+def start_in_process(args, rng):
+    """Seed the fake and import app against it; returns (client factory, products, login, fake)"""
+    fake = fake_supabase.install(fake_supabase.FakeSupabase())
+    fake_supabase.serve_storage(fake, latency=args.storage_latency_ms / 1000)
+    started = time.perf_counter()
+    products = seed(fake, args, rng)
+    print(f"seeded {args.products} products, {args.sales} sales, {args.notifications} notifications, "
+          f"{args.images} images in {time.perf_counter() - started:.1f}s")
+
+    work_dir = tempfile.mkdtemp(prefix='bench-load-')
+    os.environ.setdefault('WRITE_QUEUE_PATH', os.path.join(work_dir, 'write_queue.sqlite3'))
+    os.environ.setdefault('IMAGE_CACHE_DIR', os.path.join(work_dir, 'images'))
+    import app as store
+    logging.getLogger(store.__name__).setLevel(logging.CRITICAL)
+    fake.latency = args.latency_ms / 1000
+    login = {'email': store.CONSTANT_EMAIL, 'password': store.CONSTANT_PASSWORD}
+    return store.app.test_client, products, login, fake
+
+
+def catalog_from_server(client):
+    """Product rows the scenarios need, rebuilt from the server's public catalog"""
+    products = []
+    for product in client.get('/api/public/products').get_json():
+        if not product.get('sizes'):
+            continue
+        image = product.get('imageUrl')
+        products.append({
+            'id': product['id'], 'name': product['name'], 'price': product['price'], 'sizes': product['sizes'],
+            'image_path': image[len('/api/images/'):] if image else None
+        })
+    return products
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--products', type=int, default=2000)
+    parser.add_argument('--sales', type=int, default=50000)
+    parser.add_argument('--notifications', type=int, default=5000)
+    parser.add_argument('--images', type=int, default=50)
+    parser.add_argument('--latency-ms', type=float, default=20, help='added to every Supabase call')
+    parser.add_argument('--storage-latency-ms', type=float, default=30, help='added to every image download')
+    parser.add_argument('--threads', type=int, default=16)
+    parser.add_argument('--duration', type=float, default=15, help='seconds of measured load')
+    parser.add_argument('--mix', default=DEFAULT_MIX, help='scenario=weight pairs')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--json', metavar='PATH', help='write per-endpoint results here')
+    parser.add_argument('--compare', metavar='PATH', help='baseline written by an earlier --json run')
+    parser.add_argument('--tolerance', type=float, default=0.2)
+    parser.add_argument('--url', help='load a running server instead of an in-process app')
+    parser.add_argument('--email', default=os.environ.get('BENCH_EMAIL'))
+    parser.add_argument('--password', default=os.environ.get('BENCH_PASSWORD'))
+    args = parser.parse_args(argv)
+
+    mix = parse_mix(args.mix)
+    rng = random.Random(args.seed)
+    if args.url:
+        fake = None
+        client_factory = lambda: HTTPClient(args.url, args.threads)
+        products = catalog_from_server(client_factory())
+        login = {'email': args.email, 'password': args.password}
+        if not (args.email and args.password) and {'sale', 'dashboard'} & set(mix):
+            parser.error('--url with the sale or dashboard scenarios needs --email and --password')
+    else:
+        client_factory, products, login, fake = start_in_process(args, rng)
+
+    client = client_factory()
+    headers = {}
+    if login['email'] and login['password']:
+        token = client.post('/api/auth/login', json=login).get_json()['token']
+        headers = {'Authorization': f'Bearer {token}'}
+    words = sorted({word.lower() for product in products[:500] for word in product['name'].split()[:2]})
+    available = scenarios(products, words)
+    unknown = set(mix) - set(available)
+    if unknown:
+        parser.error(f"unknown scenarios: {', '.join(sorted(unknown))}")
+    names, weights = list(mix), list(mix.values())
+
+    # One cold request per scenario, reported separately from the steady state
+    print('cold start:')
+    for name in names:
+        request_started = time.perf_counter()
+        endpoint, response = available[name](client, headers, rng)
+        print(f"  {endpoint}: {response.status_code} in {(time.perf_counter() - request_started) * 1000:.1f}ms")
+
+    samples = defaultdict(list)
+    samples_lock = threading.Lock()
+    deadline = time.perf_counter() + args.duration
+    calls_before = fake.calls if fake else 0
+
+    def worker(index):
+        worker_rng = random.Random(args.seed * 1000 + index)
+        worker_client = client_factory()
+        local = defaultdict(list)
+        while time.perf_counter() < deadline:
+            name = worker_rng.choices(names, weights)[0]
+            request_started = time.perf_counter()
+            endpoint, response = available[name](worker_client, headers, worker_rng)
+            response.get_data()
+            local[endpoint].append((time.perf_counter() - request_started, response.status_code))
+        with samples_lock:
+            for endpoint, entries in local.items():
+                samples[endpoint].extend(entries)
+
+    load_started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.threads) as pool:
+        list(pool.map(worker, range(args.threads)))
+    elapsed = time.perf_counter() - load_started
+
+    results = summarize(samples, elapsed)
+    if args.url:
+        print(f"\n{args.threads} threads for {elapsed:.1f}s against {args.url}")
+    else:
+        print(f"\n{args.threads} threads for {elapsed:.1f}s, Supabase latency {args.latency_ms}ms, "
+              f"storage latency {args.storage_latency_ms}ms")
+    print_table(results, elapsed)
+    if fake:
+        print(f"upstream Supabase calls during load: {fake.calls - calls_before}")
+
+    if args.json:
+        with open(args.json, 'w') as handle:
+            json.dump(results, handle, indent=2)
+    if args.compare:
+        with open(args.compare) as handle:
+            regressions = compare(results, json.load(handle), args.tolerance)
+        for regression in regressions:
+            print(f"REGRESSION: {regression}")
+        return 1 if regressions else 0
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
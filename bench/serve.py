@@ -0,0 +1,34 @@
+"""WSGI entry point that runs app.py against a seeded fake, for load tests over HTTP
+
+    gunicorn -c gunicorn.conf.py bench.serve:app
+    WORKER_CLASS=sync gunicorn -c gunicorn.conf.py bench.serve:app
+    python -m bench.load --url http://127.0.0.1:8000 --threads 200
+
+Table sizes and latency come from BENCH_PRODUCTS, BENCH_SALES,
+BENCH_NOTIFICATIONS, BENCH_IMAGES, BENCH_LATENCY_MS and
+BENCH_STORAGE_LATENCY_MS. Every worker seeds its own fake, so sales recorded
+by one worker are not seen by the others.
+"""
+import os
+import random
+import tempfile
+from types import SimpleNamespace
+
+from bench import fake_supabase
+from bench.load import seed
+
+settings = SimpleNamespace(
+    products=int(os.environ.get('BENCH_PRODUCTS', 2000)),
+    sales=int(os.environ.get('BENCH_SALES', 50000)),
+    notifications=int(os.environ.get('BENCH_NOTIFICATIONS', 5000)),
+    images=int(os.environ.get('BENCH_IMAGES', 50))
+)
+fake = fake_supabase.install(fake_supabase.FakeSupabase(latency=float(os.environ.get('BENCH_LATENCY_MS', 20)) / 1000))
+fake_supabase.serve_storage(fake, latency=float(os.environ.get('BENCH_STORAGE_LATENCY_MS', 30)) / 1000)
+seed(fake, settings, random.Random(int(os.environ.get('BENCH_SEED', 1))))
+
+work_dir = tempfile.mkdtemp(prefix='bench-serve-')
+os.environ.setdefault('WRITE_QUEUE_PATH', os.path.join(work_dir, 'write_queue.sqlite3'))
+os.environ.setdefault('IMAGE_CACHE_DIR', os.path.join(work_dir, 'images'))
+
+from app import app  # noqa: E402  (the fake must be installed first)
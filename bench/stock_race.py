@@ -0,0 +1,111 @@
+"""Concurrency harness for POST /api/sales against the in-process fake
+
+Fires many sales at one product/size from parallel threads and checks that
+stock never goes negative and that every unit taken from stock is accounted
+for by a recorded sale. Run both stock-update paths:
+
+    python -m bench.stock_race --mode rpc
+    python -m bench.stock_race --mode cas --stock 50 --sales 400 --threads 32
+    python -m bench.stock_race --write-behind always
+    python -m bench.stock_race --mode cas --write-behind always --reload-cache
+
+With --write-behind always|fallback the checks run once the write queue has
+drained. --reload-cache keeps dropping and re-reading the products cache
+while sales are queued, so tills and the flusher race cache reloads.
+
+Exits non-zero when an invariant is violated.
+"""
+import argparse
+import logging
+import os
+import sys
+import tempfile
+import threading
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+
+from bench import fake_supabase
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--mode', choices=['rpc', 'cas'], default='rpc')
+    parser.add_argument('--stock', type=int, default=100)
+    parser.add_argument('--sales', type=int, default=500)
+    parser.add_argument('--threads', type=int, default=32)
+    parser.add_argument('--quantity', type=int, default=1)
+    parser.add_argument('--write-behind', choices=['always', 'fallback', 'off'], default='off')
+    parser.add_argument('--reload-cache', action='store_true')
+    args = parser.parse_args(argv)
+
+    fake = fake_supabase.install(fake_supabase.FakeSupabase(with_rpc=args.mode == 'rpc'))
+    os.environ.setdefault('SALE_RPC', 'on' if args.mode == 'rpc' else 'off')
+    os.environ['WRITE_BEHIND'] = args.write_behind
+    os.environ.setdefault('WRITE_QUEUE_PATH', os.path.join(tempfile.mkdtemp(), 'write_queue.sqlite3'))
+    os.environ.setdefault('WRITE_QUEUE_POLL_SECONDS', '0.1')
+    import app as store
+    logging.getLogger(store.__name__).setLevel(logging.CRITICAL)
+
+    product_id = 1
+    fake.tables['products'] = {product_id: {
+        'id': product_id, 'name': 'Race Runner', 'sku': 'RACE-1', 'category': 'Test',
+        'sizes': {'42': args.stock}, 'buyprice': 1000.0, 'price': 2000.0,
+        'totalstock': args.stock, 'lastupdated': '2026-01-01T00:00:00'
+    }}
+
+    client = store.app.test_client()
+    token = client.post('/api/auth/login', json={
+        'email': store.CONSTANT_EMAIL, 'password': store.CONSTANT_PASSWORD
+    }).get_json()['token']
+    headers = {'Authorization': f'Bearer {token}'}
+
+    observed_negative = threading.Event()
+    statuses = Counter()
+
+    def sell(_):
+        response = store.app.test_client().post('/api/sales', headers=headers, json={
+            'productId': product_id, 'size': '42', 'quantity': args.quantity, 'unitPrice': 2000
+        })
+        if fake.tables['products'][product_id]['sizes']['42'] < 0:
+            observed_negative.set()
+        return response.status_code
+
+    selling = threading.Event()
+    selling.set()
+
+    def reload_products():
+        while selling.is_set():
+            store.table_cache.invalidate('products')
+            store.get_table_data('products')
+            time.sleep(0.005)
+
+    reloader = threading.Thread(target=reload_products, daemon=True)
+    if args.reload_cache:
+        reloader.start()
+    with ThreadPoolExecutor(max_workers=args.threads) as pool:
+        statuses.update(pool.map(sell, range(args.sales)))
+    while args.write_behind != 'off' and store.write_queue.status()['depth']:
+        time.sleep(0.1)
+    selling.clear()
+
+    final_stock = fake.tables['products'][product_id]['sizes']['42']
+    sold_units = sum(s['quantity'] for s in fake.tables.get('sales', {}).values())
+    print(f"mode={args.mode} stock={args.stock} attempts={args.sales} threads={args.threads}")
+    print(f"responses: {dict(sorted(statuses.items()))}")
+    print(f"final stock={final_stock} units in sales table={sold_units} upstream calls={fake.calls}")
+
+    failures = []
+    if final_stock < 0 or observed_negative.is_set():
+        failures.append('stock went negative')
+    if args.stock - final_stock != sold_units:
+        failures.append(f'{args.stock - final_stock} units left stock but {sold_units} were recorded as sold')
+    if statuses[201] * args.quantity != sold_units:
+        failures.append(f'{statuses[201]} sales acknowledged but {sold_units} units recorded')
+    for failure in failures:
+        print(f"FAIL: {failure}")
+    return 1 if failures else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
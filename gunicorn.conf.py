@@ -0,0 +1,51 @@
+"""Gunicorn settings for app.py; every value can be overridden from the environment
+
+The default gevent worker runs each request in a greenlet, so one worker keeps
+serving while hundreds of requests wait on Supabase, storage or image
+downloads (and on /api/events streams). Upstream connections come from the
+keep-alive pools sized by UPSTREAM_POOL_SIZE in app.py; keep it at or below
+WORKER_CONNECTIONS.
+
+    gunicorn -c gunicorn.conf.py app:app
+    WORKER_CLASS=gthread GUNICORN_THREADS=8 gunicorn -c gunicorn.conf.py app:app
+    WORKER_CLASS=sync gunicorn -c gunicorn.conf.py app:app
+
+Caches, aggregates and the write-behind queue's flusher live in each worker
+process, so prefer one or two gevent workers over many sync ones. A stopping
+worker writes its queued sales to Supabase first (worker_exit below). The app is
+not preloaded: gevent must patch the standard library before app.py starts
+its background threads and opens connections.
+"""
+import os
+
+worker_class = os.environ.get('WORKER_CLASS', 'gevent')
+workers = int(os.environ.get('WEB_CONCURRENCY', 1))
+# Concurrent requests per gevent worker
+worker_connections = int(os.environ.get('WORKER_CONNECTIONS', 1000))
+# Request threads per gthread worker
+threads = int(os.environ.get('GUNICORN_THREADS', 1))
+timeout = int(os.environ.get('GUNICORN_TIMEOUT', 60))
+graceful_timeout = int(os.environ.get('GUNICORN_GRACEFUL_TIMEOUT', 30))
+keepalive = int(os.environ.get('GUNICORN_KEEPALIVE', 5))
+preload_app = False
+
+# Seconds a stopping worker spends writing queued sales to Supabase; keep it
+# below graceful_timeout or the worker is killed first
+write_queue_drain_seconds = float(os.environ.get('WRITE_QUEUE_DRAIN_SECONDS', max(graceful_timeout - 5, 1)))
+
+def worker_exit(server, worker):
+    """Drain the write-behind queue before the worker goes
+
+    The queue is a local SQLite file; without a persistent disk it is lost
+    with the instance, so a deploy must not leave accepted sales in it.
+    """
+    import app
+    if app.WRITE_BEHIND_MODE == 'off':
+        return
+    try:
+        left = app.write_queue.drain(write_queue_drain_seconds)
+    except Exception as e:
+        server.log.error(f"Could not drain the write queue: {e}")
+        return
+    if left:
+        server.log.warning(f"{left} queued sales were not written to Supabase and remain in {app.WRITE_QUEUE_PATH}")
@@ -0,0 +1,22 @@
+-- Indexes for the notification queries in app.py.
+--
+-- GET /api/notifications/count runs `count(*) where read = false`, the list
+-- reads the newest rows by id, and PUT /api/notifications/read-all updates
+-- every unread row. The partial index keeps all of these proportional to the
+-- number of unread notifications rather than to every sale ever made. The
+-- retention job deletes read rows by timestamp.
+
+create index if not exists notifications_unread_idx on notifications (id) where read = false;
+
+create index if not exists notifications_read_timestamp_idx on notifications (timestamp) where read = true;
+
+-- GET /api/sync?since= returns notifications whose updated_at is after the
+-- cursor, so marking one read reaches clients that already have it. app.py
+-- sets the column on every insert (record_sale/record_checkout insert the
+-- whole JSON row, which would bypass a default) and on both read paths.
+
+alter table notifications add column if not exists updated_at text;
+
+update notifications set updated_at = timestamp where updated_at is null;
+
+create index if not exists notifications_updated_at_idx on notifications (updated_at);
@@ -0,0 +1,85 @@
+-- Atomic sale recording for POST /api/sales.
+--
+-- Takes `p_quantity` units of `p_size` from a product only if that much stock
+-- is on hand, then inserts the sale and its notification, all in one
+-- transaction. Raises `insufficient_stock` / `product_not_found` otherwise.
+-- app.py calls this through supabase.rpc('record_sale', ...) and falls back to
+-- compare-and-swap updates on products.lastupdated when it is not installed.
+
+create or replace function record_sale(
+    p_product_id bigint,
+    p_size text,
+    p_quantity integer,
+    p_lastupdated products.lastupdated%type,
+    p_sale jsonb,
+    p_notification jsonb
+) returns jsonb
+language plpgsql
+as $$
+declare
+    updated products;
+begin
+    update products
+       set sizes = jsonb_set(sizes, array[p_size], to_jsonb((sizes ->> p_size)::integer - p_quantity)),
+           totalstock = totalstock - p_quantity,
+           lastupdated = p_lastupdated
+     where id = p_product_id
+       and (sizes ->> p_size)::integer >= p_quantity
+    returning * into updated;
+
+    if not found then
+        if not exists (select 1 from products where id = p_product_id) then
+            raise exception 'product_not_found';
+        end if;
+        raise exception 'insufficient_stock';
+    end if;
+
+    insert into sales select * from jsonb_populate_record(null::sales, p_sale);
+    insert into notifications select * from jsonb_populate_record(null::notifications, p_notification)
+        on conflict (id) do nothing;
+
+    return to_jsonb(updated);
+end;
+$$;
+
+-- Multi-line checkout for POST /api/sales/checkout.
+--
+-- p_changes is [{"product_id": 1, "size": "42", "quantity": 2}, ...] with one
+-- entry per product/size. Every line must have enough stock or the whole call
+-- raises `insufficient_stock:<product id>:<size>` and nothing is written.
+-- Returns the updated product rows.
+
+create or replace function record_checkout(
+    p_changes jsonb,
+    p_lastupdated products.lastupdated%type,
+    p_sales jsonb,
+    p_notification jsonb
+) returns setof products
+language plpgsql
+as $$
+declare
+    change jsonb;
+begin
+    for change in select * from jsonb_array_elements(p_changes) order by (value ->> 'product_id')::bigint loop
+        update products
+           set sizes = jsonb_set(sizes, array[change ->> 'size'],
+                                 to_jsonb((sizes ->> (change ->> 'size'))::integer - (change ->> 'quantity')::integer)),
+               totalstock = totalstock - (change ->> 'quantity')::integer,
+               lastupdated = p_lastupdated
+         where id = (change ->> 'product_id')::bigint
+           and (sizes ->> (change ->> 'size'))::integer >= (change ->> 'quantity')::integer;
+
+        if not found then
+            raise exception 'insufficient_stock:%:%', change ->> 'product_id', change ->> 'size';
+        end if;
+    end loop;
+
+    insert into sales select * from jsonb_populate_recordset(null::sales, p_sales);
+    insert into notifications select * from jsonb_populate_record(null::notifications, p_notification)
+        on conflict (id) do nothing;
+
+    return query
+        select * from products
+         where id in (select (value ->> 'product_id')::bigint from jsonb_array_elements(p_changes));
+end;
+$$;
@@ -0,0 +1,14 @@
+-- Delete markers for GET /api/sync.
+--
+-- delete_product writes one row per deleted record so clients syncing with
+-- ?since= learn which ids to drop. Rows older than the oldest cursor any
+-- client still holds can be removed at will.
+
+create table if not exists tombstones (
+    id text primary key,
+    tablename text not null,
+    recordid bigint not null,
+    deletedat text not null
+);
+
+create index if not exists tombstones_deletedat_idx on tombstones (deletedat);